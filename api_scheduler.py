@@ -0,0 +1,189 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+from collections import Counter
+import discord
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 優先度（小さいほど先に処理する）
+PRIORITY_MATCH = 0  # マッチング・試合の進行（スレッド作成、ロール変更、結果の通知など）
+PRIORITY_DEFAULT = 1
+PRIORITY_BACKGROUND = 2  # ランキング・戦績チャンネルの定期投稿など
+
+# 同時に実行するリクエスト数
+DISCORD_API_CONCURRENCY = int(os.getenv('DISCORD_API_CONCURRENCY', 5))
+# Bot 全体で1秒あたりに送るリクエスト数（Discord のグローバル上限 50/秒 より少し低くする）
+DISCORD_API_GLOBAL_RATE = float(os.getenv('DISCORD_API_GLOBAL_RATE', 40))
+# 失敗したリクエストの最大試行回数
+DISCORD_API_RETRIES = 5
+# 再試行しても結果が変わらないエラー（権限がない、対象が存在しない）
+NON_RETRYABLE_STATUSES = (403, 404)
+
+# ルートの種類ごとのトークンバケット (容量, 1秒あたりの補充数)。ルートは (種類, チャンネルIDなど) で表す
+ROUTE_LIMITS = {
+    'thread_create': (5, 1.0),  # チャンネルごと
+    'thread_member': (10, 2.0),  # スレッドごと
+    'message': (5, 1.0),  # チャンネルごと
+    'purge': (1, 0.5),  # チャンネルごと（内部で複数回のリクエストになる）
+    'member_roles': (10, 1.0),  # サーバーごと
+}
+DEFAULT_ROUTE_LIMIT = (5, 1.0)
+
+
+class TokenBucket:
+    """トークンバケット。トークンを先に予約し、使えるようになるまでの待ち時間を返す"""
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0  # 429 を受けた場合、この時刻まで送らない
+
+    def reserve(self, now=None):
+        """トークンを1つ予約し、使えるまでの待ち時間（秒）を返す"""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        return max(wait, self.blocked_until - now)
+
+    def block(self, until):
+        self.blocked_until = max(self.blocked_until, until)
+
+
+class PrioritySlots:
+    """同時実行数を制限するセマフォ。空きが出たら優先度の高い順（同じ優先度は到着順）に割り当てる"""
+    def __init__(self, size):
+        self.free = size
+        self._waiters = []  # (優先度, 連番, Future) のヒープ
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority):
+        if self.free > 0 and not self._waiters:
+            self.free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 割り当てられた直後にキャンセルされた場合は次の待ちに回す
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.free += 1
+
+
+class ApiScheduler:
+    """
+    Discord API へのリクエストをまとめて扱うスケジューラー。
+    ルートごとのトークンバケットで送信間隔をそろえ、同時実行の枠は優先度の高いリクエストから割り当てる。
+    429 や一時的なエラーはジッター付きのバックオフで再試行する。
+    """
+    def __init__(self, concurrency=DISCORD_API_CONCURRENCY, global_rate=DISCORD_API_GLOBAL_RATE):
+        self.slots = PrioritySlots(concurrency)
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.buckets = {}
+        self.waiting = 0  # 送信待ちのリクエスト数
+        self.max_waiting = 0
+        self.in_flight = 0
+        self.request_counts = Counter()  # ルートの種類 -> 送信回数
+        self.rate_limited_counts = Counter()  # ルートの種類 -> 429 の回数
+        self.error_counts = Counter()  # ルートの種類 -> 429 以外のエラーの回数
+
+    def _bucket(self, route):
+        bucket = self.buckets.get(route)
+        if bucket is None:
+            # スレッドごとのルートなどで増え続けないよう、使われていないバケットを捨てる
+            if len(self.buckets) >= 1024:
+                now = time.monotonic()
+                self.buckets = {
+                    key: value for key, value in self.buckets.items()
+                    if value.blocked_until > now or value.tokens + (now - value.updated_at) * value.rate < value.capacity
+                }
+            bucket = TokenBucket(*ROUTE_LIMITS.get(route[0], DEFAULT_ROUTE_LIMIT))
+            self.buckets[route] = bucket
+        return bucket
+
+    async def _wait_turn(self, bucket, priority):
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await asyncio.sleep(bucket.reserve())
+            await self.slots.acquire(priority)
+        finally:
+            self.waiting -= 1
+
+    async def call(self, route, request, priority=PRIORITY_DEFAULT, description="request"):
+        """
+        request() を実行して結果を返す。
+        :param route: (種類, ID) の形式のルート。同じルートのリクエストは同じトークンバケットを使う
+        :param request: 呼び出すたびに新しいコルーチンを返す関数（再試行で何度も呼ぶ）
+        """
+        kind = route[0]
+        bucket = self._bucket(route)
+        for attempt in range(DISCORD_API_RETRIES):
+            await self._wait_turn(bucket, priority)
+            try:
+                await asyncio.sleep(self.global_bucket.reserve())
+                self.in_flight += 1
+                self.request_counts[kind] += 1
+                try:
+                    return await request()
+                finally:
+                    self.in_flight -= 1
+            except discord.HTTPException as e:
+                error = e
+            finally:
+                self.slots.release()
+
+            if error.status in NON_RETRYABLE_STATUSES:
+                raise error
+            if attempt == DISCORD_API_RETRIES - 1:
+                logging.error(f"{description} failed after {DISCORD_API_RETRIES} attempts: {error}")
+                raise error
+            if error.status == 429:
+                self.rate_limited_counts[kind] += 1
+                retry_after = getattr(error, 'retry_after', None) or 5  # デフォルトの待機時間（秒）
+                # 同じルートのリクエストもまとめて待たせる（ジッターで再送が重ならないようにする）
+                delay = retry_after * random.uniform(1.0, 1.2)
+                bucket.block(time.monotonic() + delay)
+                logging.warning(f"Rate limited during {description}. Retrying after {delay:.1f} seconds.")
+            else:
+                self.error_counts[kind] += 1
+                logging.error(f"{description} failed: {error}")
+                # フルジッター付きの指数バックオフ
+                await asyncio.sleep(random.uniform(0, 2 ** attempt))
+
+    def stats(self):
+        """メトリクスの一覧"""
+        return {
+            'waiting': self.waiting,
+            'waiting_for_slot': len(self.slots),
+            'max_waiting': self.max_waiting,
+            'in_flight': self.in_flight,
+            'requests': dict(self.request_counts),
+            'rate_limited': dict(self.rate_limited_counts),
+            'errors': dict(self.error_counts),
+        }
+
+
+# Bot 全体で共有するスケジューラー
+api_scheduler = ApiScheduler()
@@ -0,0 +1,158 @@
+import os
+import logging
+import functools
+import threading
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+from db_connection import connect, DB_ARCHIVE_DIR, DB_POOL_SIZE, DB_POOL_TIMEOUT
+from data_access import Season, SessionLocal
+
+# 終了したシーズンごとに別ファイルへ移す対戦履歴テーブル（外部キーの参照元を先に並べる）
+ARCHIVED_TABLES = ['player_match', 'match_history']
+
+# アーカイブは1シーズン分しか持たないため、ユーザーを先頭にしたインデックスだけを作る
+_ARCHIVE_INDEXES = [
+    'CREATE INDEX archive.idx_player_match_user_date ON player_match (user_id, match_date)',
+    'CREATE INDEX archive.idx_player_match_user_opponent ON player_match (user_id, opponent_id)',
+    'CREATE INDEX archive.idx_match_history_user1 ON match_history (user1_id, match_date)',
+    'CREATE INDEX archive.idx_match_history_user2 ON match_history (user2_id, match_date)',
+]
+
+_archive_engines = {}
+_archive_engines_lock = threading.Lock()
+
+
+def get_archive_path(archive_file):
+    return os.path.join(DB_ARCHIVE_DIR, archive_file)
+
+
+def archive_season(season_id):
+    """
+    終了したシーズンの対戦履歴をアーカイブファイルへ移し、ホットテーブルから削除します。
+    DB処理用のスレッドから呼び出すこと（ATTACH を使うため、セッションとは別の接続で処理する）。
+    :return: 移動した player_match の行数（アーカイブ済みの場合は 0）
+    """
+    conn = connect()
+    try:
+        row = conn.execute('SELECT season_name, end_date, archive_file FROM season WHERE id = ?', (season_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"Season with ID {season_id} not found.")
+        season_name, end_date, archive_file = row
+        if end_date is None:
+            raise ValueError(f"Season {season_name} has not ended yet.")
+        if archive_file:
+            return 0
+
+        archive_file = f'season_{season_id}.db'
+        path = get_archive_path(archive_file)
+        os.makedirs(DB_ARCHIVE_DIR, exist_ok=True)
+        # 前回の処理が途中で止まっていた場合は作り直す
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+        conn.execute('ATTACH DATABASE ? AS archive', (path,))
+        try:
+            # コピーと削除を1つのトランザクションで行う。書き込みロックを最初に取るため、
+            # コピーしてから削除するまでの間に同じシーズンの行が追加されて失われることはない
+            # 失敗した場合はアーカイブ済みにならないため、再実行すればファイルごと作り直される
+            conn.execute('BEGIN IMMEDIATE')
+            # 1. アーカイブファイルへコピー
+            for table in ARCHIVED_TABLES:
+                conn.execute(f'CREATE TABLE archive.{table} AS SELECT * FROM main.{table} WHERE season_id = ?', (season_id,))
+            for index_sql in _ARCHIVE_INDEXES:
+                conn.execute(index_sql)
+            moved = conn.execute('SELECT COUNT(*) FROM archive.player_match').fetchone()[0]
+
+            # 2. ホットテーブルから同じ条件で削除し、アーカイブ済みとして記録
+            for table in ARCHIVED_TABLES:
+                conn.execute(f'DELETE FROM main.{table} WHERE season_id = ?', (season_id,))
+            conn.execute('UPDATE season SET archive_file = ? WHERE id = ?', (archive_file, season_id))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute('DETACH DATABASE archive')
+        return moved
+    finally:
+        conn.close()
+
+
+def archive_closed_seasons():
+    """終了済みでまだアーカイブしていないシーズンを全てアーカイブし、{シーズン名: 移動した行数} を返す"""
+    conn = connect()
+    try:
+        seasons = conn.execute(
+            'SELECT id, season_name FROM season WHERE end_date IS NOT NULL AND archive_file IS NULL ORDER BY id'
+        ).fetchall()
+    finally:
+        conn.close()
+
+    results = {}
+    for season_id, season_name in seasons:
+        try:
+            results[season_name] = archive_season(season_id)
+        except Exception as e:
+            logging.error(f"シーズン {season_name} のアーカイブ中にエラーが発生しました: {e}")
+            raise
+    return results
+
+
+def get_archive_engine(archive_file):
+    """アーカイブファイルごとのエンジンを取得（初回のみ作成）"""
+    with _archive_engines_lock:
+        engine = _archive_engines.get(archive_file)
+        if engine is None:
+            engine = create_engine(
+                'sqlite://',
+                creator=functools.partial(connect, get_archive_path(archive_file)),
+                poolclass=QueuePool,
+                pool_size=1,
+                max_overflow=DB_POOL_SIZE - 1,
+                pool_timeout=DB_POOL_TIMEOUT,
+                echo=False,
+            )
+            _archive_engines[archive_file] = engine
+        return engine
+
+
+def run_on_match_tables(session, func, season=None):
+    """
+    対戦履歴を持つDB（ホットテーブルとアーカイブ）に対して func(session) を実行し、結果のリストを返します。
+    アーカイブはテーブル名・カラムがホットテーブルと同じため、PlayerMatch などのマッピングをそのまま使える。
+    :param season: 指定した場合はそのシーズンの履歴を持つDBのみ、None の場合は全てのDBを対象にする
+    """
+    if season is not None:
+        archive_files = [season.archive_file] if season.archive_file else []
+    else:
+        archive_files = [
+            archive_file for (archive_file,) in
+            session.query(Season.archive_file).filter(Season.archive_file != None).order_by(Season.id).all()
+        ]
+
+    results = []
+    if season is None or not season.archive_file:
+        results.append(func(session))
+    for archive_file in archive_files:
+        archive_session = SessionLocal(bind=get_archive_engine(archive_file))
+        try:
+            results.append(func(archive_session))
+        finally:
+            archive_session.close()
+    return results
+
+
+if __name__ == '__main__':
+    # ログの設定
+    logging.basicConfig(
+        filename='errorlog.txt',  # ログを保存するファイル名
+        level=logging.ERROR,  # ログのレベルをエラーに設定
+        format='%(asctime)s - %(levelname)s - %(message)s'  # ログのフォーマット
+    )
+    results = archive_closed_seasons()
+    for season_name, moved in results.items():
+        print(f"シーズン {season_name}: {moved} 件の対戦履歴をアーカイブしました。")
+    if not results:
+        print("アーカイブするシーズンはありません。")
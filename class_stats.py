@@ -0,0 +1,129 @@
+import logging
+from sqlalchemy import text
+
+from migration import CLASS_STATS_AGGREGATE
+from data_access import session_scope
+from archive import run_on_match_tables
+
+_UPSERT_CLASS_STATS = '''
+INSERT INTO class_stats (user_id, season_id, class_a, class_b, win_count, loss_count)
+VALUES (:user_id, :season_id, :class_a, :class_b, :win_count, :loss_count)
+ON CONFLICT (user_id, season_id, class_a, class_b) DO UPDATE SET
+    win_count = win_count + excluded.win_count,
+    loss_count = loss_count + excluded.loss_count
+'''
+
+
+def normalize_class_pair(class_a, class_b):
+    """クラスの組み合わせを (class_a <= class_b) の順にそろえる（未設定のクラスは空文字）"""
+    return tuple(sorted((class_a or '', class_b or '')))
+
+
+def record_class_result(session, user_id, season_id, class_a, class_b, won):
+    """1試合分の勝敗を class_stats に加算する（settle_match と同じトランザクションで呼び出す）"""
+    if season_id is None:
+        return
+    pair_a, pair_b = normalize_class_pair(class_a, class_b)
+    session.execute(text(_UPSERT_CLASS_STATS), {
+        'user_id': user_id,
+        'season_id': season_id,
+        'class_a': pair_a,
+        'class_b': pair_b,
+        'win_count': 1 if won else 0,
+        'loss_count': 0 if won else 1,
+    })
+
+
+def get_class_stats(session, user_id, selected_classes, season_id=None):
+    """
+    class_stats から指定クラスでの試合数と勝利数を取得します。
+    :param selected_classes: 2つのクラスのリスト（組み合わせに完全一致）または1つのクラス名（どちらかに含む）
+    :param season_id: None の場合は全シーズンの合計
+    :return: (試合数, 勝利数)
+    """
+    params = {'user_id': user_id}
+    if isinstance(selected_classes, list) and len(selected_classes) == 2:
+        params['class_a'], params['class_b'] = normalize_class_pair(*selected_classes)
+        class_condition = 'class_a = :class_a AND class_b = :class_b'
+    else:
+        params['class_name'] = selected_classes[0] if isinstance(selected_classes, list) else selected_classes
+        class_condition = '(class_a = :class_name OR class_b = :class_name)'
+    season_condition = ''
+    if season_id is not None:
+        params['season_id'] = season_id
+        season_condition = 'AND season_id = :season_id'
+
+    win_count, loss_count = session.execute(text(f'''
+    SELECT COALESCE(SUM(win_count), 0), COALESCE(SUM(loss_count), 0)
+    FROM class_stats
+    WHERE user_id = :user_id {season_condition} AND {class_condition}
+    '''), params).one()
+    return win_count + loss_count, win_count
+
+
+def aggregate_class_stats(session):
+    """対戦履歴（アーカイブを含む）から class_stats の正しい内容を集計し、{キー: (勝利数, 敗北数)} を返す"""
+    expected = {}
+    for rows in run_on_match_tables(session, lambda target_session: target_session.execute(text(CLASS_STATS_AGGREGATE)).all()):
+        for user_id, season_id, pair_a, pair_b, win_count, loss_count in rows:
+            expected[(user_id, season_id, pair_a, pair_b)] = (win_count, loss_count)
+    return expected
+
+
+def rebuild_class_stats(session):
+    """class_stats を対戦履歴から作り直し、作成した行数を返す"""
+    expected = aggregate_class_stats(session)
+    session.execute(text('DELETE FROM class_stats'))
+    if expected:
+        session.execute(text('''
+        INSERT INTO class_stats (user_id, season_id, class_a, class_b, win_count, loss_count)
+        VALUES (:user_id, :season_id, :class_a, :class_b, :win_count, :loss_count)
+        '''), [
+            {
+                'user_id': user_id, 'season_id': season_id, 'class_a': pair_a, 'class_b': pair_b,
+                'win_count': win_count, 'loss_count': loss_count,
+            }
+            for (user_id, season_id, pair_a, pair_b), (win_count, loss_count) in expected.items()
+        ])
+    return len(expected)
+
+
+def check_class_stats(session):
+    """class_stats と対戦履歴の集計を比較し、{キー: (期待値, 実際の値)} の形で不一致を返す"""
+    expected = aggregate_class_stats(session)
+    actual = {
+        (user_id, season_id, pair_a, pair_b): (win_count, loss_count)
+        for user_id, season_id, pair_a, pair_b, win_count, loss_count in session.execute(text(
+            'SELECT user_id, season_id, class_a, class_b, win_count, loss_count FROM class_stats'
+        )).all()
+    }
+    mismatches = {}
+    for key in expected.keys() | actual.keys():
+        expected_counts = expected.get(key, (0, 0))
+        actual_counts = actual.get(key, (0, 0))
+        if expected_counts != actual_counts:
+            mismatches[key] = (expected_counts, actual_counts)
+    return mismatches
+
+
+if __name__ == '__main__':
+    import sys
+
+    # ログの設定
+    logging.basicConfig(
+        filename='errorlog.txt',  # ログを保存するファイル名
+        level=logging.ERROR,  # ログのレベルをエラーに設定
+        format='%(asctime)s - %(levelname)s - %(message)s'  # ログのフォーマット
+    )
+    command = sys.argv[1] if len(sys.argv) > 1 else 'check'
+    with session_scope() as session:
+        if command == 'rebuild':
+            print(f"class_stats を {rebuild_class_stats(session)} 行で作り直しました。")
+        elif command == 'check':
+            mismatches = check_class_stats(session)
+            for (user_id, season_id, pair_a, pair_b), (expected_counts, actual_counts) in sorted(mismatches.items()):
+                print(f"不一致: user_id={user_id} season_id={season_id} {pair_a}/{pair_b} 期待値={expected_counts} 実際={actual_counts}")
+            if not mismatches:
+                print("class_stats は対戦履歴と一致しています。")
+        else:
+            print("使い方: python class_stats.py [check|rebuild]")
@@ -0,0 +1,90 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from sqlalchemy import create_engine, desc
+from sqlalchemy.ext.automap import automap_base
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from db_connection import connect, DB_POOL_SIZE, DB_POOL_TIMEOUT
+
+# 接続は db_connection.connect で作成し（WAL・PRAGMA 設定済み）、上限付きのプールで使い回す
+engine = create_engine(
+    'sqlite://',
+    creator=connect,
+    poolclass=QueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=0,
+    pool_timeout=DB_POOL_TIMEOUT,
+    echo=False,
+)
+
+# データベース内のテーブルを一度だけ反映し、全モジュールで共有する
+Base = automap_base()
+Base.prepare(engine, reflect=True)
+
+# マッピングされたクラスの取得
+User = Base.classes.user
+Class = Base.classes.deck_class
+MatchHistory = Base.classes.match_history
+Season = Base.classes.season
+UserSeasonRecord = Base.classes.user_season_record
+PlayerMatch = Base.classes.player_match
+PendingMatch = Base.classes.pending_match
+
+# セッションを閉じた後もロード済みの属性を参照できるよう expire_on_commit は無効にする
+SessionLocal = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+# DB処理専用のスレッドプール（イベントループをブロックしないため）
+DB_MAX_WORKERS = int(os.getenv('DB_MAX_WORKERS', 4))
+db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix='db')
+
+
+@contextmanager
+def session_scope():
+    """1回分の処理で使うセッションを作成し、正常終了ならコミット、例外ならロールバックする"""
+    session = SessionLocal()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def _run_in_session(func, args, kwargs):
+    with session_scope() as session:
+        return func(session, *args, **kwargs)
+
+
+async def run_db(func, *args, **kwargs):
+    """func(session, *args, **kwargs) をDBスレッドで実行して結果を返す
+
+    呼び出しごとに新しいセッションを使うため、返されたオブジェクトはセッションから切り離されている。
+    別の run_db で更新する場合はIDを渡して取得し直すこと。
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(_run_in_session, func, args, kwargs))
+
+
+# よく使う問い合わせ
+def get_user_by_discord_id(session, discord_id):
+    return session.query(User).filter_by(discord_id=str(discord_id)).first()
+
+
+def get_latest_season(session):
+    """最新のシーズン（終了済みを含む）を取得"""
+    return session.query(Season).order_by(desc(Season.id)).first()
+
+
+def get_current_season(session):
+    """開催中のシーズンを取得"""
+    return session.query(Season).filter(Season.end_date == None).order_by(desc(Season.id)).first()
+
+
+def get_class_names(session):
+    return [name for (name,) in session.query(Class.class_name).all()]
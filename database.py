@@ -1,6 +1,7 @@
-import sqlite3
 from datetime import datetime
 import logging
+from migration import migrate
+from db_connection import connect
 
 # ログの設定
 logging.basicConfig(
@@ -11,7 +12,7 @@ logging.basicConfig(
 
 # データベースに接続
 try:
-    conn = sqlite3.connect('db/shadowverse_bridge.db')
+    conn = connect()
     cursor = conn.cursor()
 
     classes = ['エルフ', 'ロイヤル', 'ウィッチ', 'ドラゴン', 'ネクロマンサー', 'ヴァンパイア', 'ビショップ', 'ネメシス']
@@ -164,6 +165,9 @@ try:
     # 変更を保存して接続を閉じる
     conn.commit()
 
+    # 追加のカラムやインデックスなど、未適用のマイグレーションを適用
+    migrate(conn)
+
 except Exception as e:
     logging.error(f"データベースの処理中にエラーが発生しました: {e}")
 
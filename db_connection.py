@@ -0,0 +1,35 @@
+import os
+import sqlite3
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# データベースの設定（.env で上書き可能）
+DB_PATH = os.getenv('DB_PATH', 'db/shadowverse_bridge.db')
+# 終了したシーズンの対戦履歴を保存するディレクトリ
+DB_ARCHIVE_DIR = os.getenv('DB_ARCHIVE_DIR', 'db/archive')
+# ロック中の待機時間（ミリ秒）
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))
+# 接続ごとのページキャッシュ（KiB）
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', 16384))
+# メモリマップで読み込むサイズ（バイト）
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 256 * 1024 * 1024))
+# コネクションプールの上限
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+
+
+def connect(path=DB_PATH):
+    """ボットの負荷に合わせた設定を適用した SQLite 接続を作成する
+
+    WAL モードにすることで、対戦結果の書き込み中でもランキングや戦績の読み込みがブロックされない。
+    """
+    conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode = WAL')
+    # WAL では NORMAL でもコミット済みのデータは壊れない（電源断時に直近のコミットが失われる可能性のみ）
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
@@ -0,0 +1,182 @@
+import bisect
+import asyncio
+from collections import namedtuple
+from data_access import User, run_db
+
+# 勝率ランキングに載るための最低試合数
+WIN_RATE_MIN_MATCHES = 50
+
+# ランキングに載せるユーザーの情報（run_db の外でも参照できるよう ORM オブジェクトから値を写しておく）
+LeaderboardEntry = namedtuple('LeaderboardEntry', [
+    'user_id', 'discord_id', 'user_name', 'rating', 'stayed_rating', 'effective_rating',
+    'win_count', 'loss_count', 'total_matches', 'max_win_streak',
+])
+
+
+def effective_rating(rating, stayed_rating):
+    """ランキングで使うレート（Stay 時のレートと現在のレートの高い方。season_rollover の final_rating と同じ）"""
+    return max(rating, stayed_rating or 0)
+
+
+def win_rate(entry):
+    return entry.win_count / entry.total_matches * 100
+
+
+class RankedBoard:
+    """
+    スコアの高い順に並べた順序統計のリスト。要素は (-スコア, user テーブルのID) で、順位を二分探索で求める。
+    """
+    def __init__(self):
+        self._keys = []
+        self._scores = {}  # user テーブルのID -> スコア
+
+    def __len__(self):
+        return len(self._keys)
+
+    def set(self, user_id, score):
+        """スコアを登録・更新する（None の場合はボードから外す）"""
+        self.discard(user_id)
+        if score is None:
+            return
+        bisect.insort(self._keys, (-score, user_id))
+        self._scores[user_id] = score
+
+    def discard(self, user_id):
+        score = self._scores.pop(user_id, None)
+        if score is not None:
+            del self._keys[bisect.bisect_left(self._keys, (-score, user_id))]
+
+    def rank(self, user_id):
+        """順位（同じスコアは同順位、次の順位はその人数分飛ぶ。SQL の RANK() と同じ）。ボードにいない場合は None"""
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        # (-score,) は同じスコアのどの要素よりも前に並ぶため、スコアが高い人数が求まる
+        return bisect.bisect_left(self._keys, (-score,)) + 1
+
+    def top(self, k):
+        """上位 k 人の user テーブルのID"""
+        return [user_id for _, user_id in self._keys[:k]]
+
+
+class Leaderboard:
+    """
+    最新シーズンでマッチングしたユーザー（latest_season_matched = 1）のランキングをメモリ上で保持する。
+    レート・連勝数・勝率の3つのボードを持ち、試合の精算や Stay などでユーザーが変わるたびに該当ユーザーだけ更新する。
+    更新はイベントループ上でのみ行う（DBの読み込みは run_db、反映はその後）。
+    内容が変わるたびに version を1つ進める（ランキング表示のキャッシュが古いかどうかの判定に使う）。
+    reload は1つずつ行い、DBの読み込み中に update_users で反映されたユーザーは読み込んだ内容で上書きしない。
+    """
+    def __init__(self):
+        self._entries = {}  # user テーブルのID -> LeaderboardEntry
+        self.boards = {
+            'rating': RankedBoard(),
+            'win_streak': RankedBoard(),
+            'win_rate': RankedBoard(),
+        }
+        self.loaded = False
+        self._loading = None
+        self.version = 0
+        self._reload_lock = asyncio.Lock()
+        self._updated_during_reload = set()  # reload の読み込み中に update_users で反映したユーザー
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _apply(self, user):
+        """ユーザー1人分を反映する（最新シーズンでマッチングしていない場合はボードから外す）"""
+        if not user.latest_season_matched:
+            self._remove(user.id)
+            return
+        self._set(LeaderboardEntry(
+            user.id, user.discord_id, user.user_name, user.rating, user.stayed_rating,
+            effective_rating(user.rating, user.stayed_rating),
+            user.win_count, user.loss_count, user.total_matches, user.max_win_streak,
+        ))
+
+    def _set(self, entry):
+        self._entries[entry.user_id] = entry
+        self.boards['rating'].set(entry.user_id, entry.effective_rating)
+        self.boards['win_streak'].set(entry.user_id, entry.max_win_streak)
+        self.boards['win_rate'].set(entry.user_id, win_rate(entry) if entry.total_matches >= WIN_RATE_MIN_MATCHES else None)
+
+    def _remove(self, user_id):
+        self._entries.pop(user_id, None)
+        for board in self.boards.values():
+            board.discard(user_id)
+
+    async def ensure_loaded(self):
+        """初回のみDBから全体を読み込む（同時に呼ばれても読み込みは1回）"""
+        if self.loaded:
+            return
+        # 読み込み中でなければ開始する（前回失敗した場合はやり直す）
+        if self._loading is None or self._loading.done():
+            self._loading = asyncio.ensure_future(self.reload())
+        await asyncio.shield(self._loading)
+
+    async def reload(self, user_ids=None):
+        """
+        DBから読み込み直して反映する。
+        :param user_ids: 指定した場合はそのユーザーのみ（精算・Stay・勝敗数の調整の後に呼び出す）、None の場合は全体
+        """
+        def load(session):
+            query = session.query(User)
+            if user_ids is None:
+                return query.filter(User.latest_season_matched == True).all()
+            return query.filter(User.id.in_(list(user_ids))).all()
+
+        async with self._reload_lock:
+            self._updated_during_reload = set()
+            try:
+                users = await run_db(load)
+                # 読み込み中に精算などで反映されたユーザーは、読み込んだ時点より新しいため上書きしない
+                newer = self._updated_during_reload
+                if user_ids is None:
+                    previous = self._entries
+                    self._entries = {}
+                    self.boards = {name: RankedBoard() for name in self.boards}
+                    self.loaded = True
+                    for user_id in newer:
+                        if user_id in previous:
+                            self._set(previous[user_id])
+                else:
+                    # DBから消えたユーザーもボードから外す
+                    for user_id in set(user_ids) - {user.id for user in users} - newer:
+                        self._remove(user_id)
+                for user in users:
+                    if user.id not in newer:
+                        self._apply(user)
+                self.version += 1
+            finally:
+                self._updated_during_reload = set()
+
+    def update_users(self, users):
+        """run_db から返された最新の User（精算結果など）を反映する"""
+        for user in users:
+            self._apply(user)
+            if self._reload_lock.locked():
+                self._updated_during_reload.add(user.id)
+        self.version += 1
+
+    def get(self, user_id):
+        return self._entries.get(user_id)
+
+    def rank(self, board, user_id):
+        return self.boards[board].rank(user_id)
+
+    async def rating_rank(self, user_id):
+        """
+        現在のシーズンのレートの順位。プロフィール・シーズン統計・直近50戦で共通して使う。
+        シーズン終了時の集計（season_rollover の RANK() OVER (ORDER BY final_rating DESC)）と同じく、
+        Stay 時のレートとの高い方で比べ、同じレートは同順位とする。最新シーズンでマッチングしていない場合は None
+        """
+        await self.ensure_loaded()
+        return self.rank('rating', user_id)
+
+    def top(self, board, k):
+        """上位 k 人の LeaderboardEntry"""
+        return [self._entries[user_id] for user_id in self.boards[board].top(k)]
+
+
+# Bot 全体で共有するランキング
+leaderboard = Leaderboard()
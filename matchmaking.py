@@ -0,0 +1,272 @@
+import os
+import bisect
+import heapq
+import itertools
+import time
+from collections import deque
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# マッチングを許可するレート差（待機開始時）
+MATCH_RATING_WINDOW = 300
+# 待機時間に応じて許容レート差を広げる間隔（秒）と広げる幅、その上限
+MATCH_RATING_WINDOW_INTERVAL = float(os.getenv('MATCH_RATING_WINDOW_INTERVAL', 10))
+MATCH_RATING_WINDOW_STEP = float(os.getenv('MATCH_RATING_WINDOW_STEP', 50))
+MATCH_RATING_WINDOW_MAX = float(os.getenv('MATCH_RATING_WINDOW_MAX', 600))
+# 待機リストに残れる時間（秒）。過ぎると「マッチング相手が見つかりませんでした」として外す
+MATCH_QUEUE_TIMEOUT = float(os.getenv('MATCH_QUEUE_TIMEOUT', 60))
+
+# 待機リストへの追加を検知してから、続けて押されたボタンをまとめるために待つ時間（秒）
+MATCHMAKING_COALESCE_WINDOW = float(os.getenv('MATCHMAKING_COALESCE_MS', 200)) / 1000
+# マッチ成立後の処理（ロール付与・スレッド作成・通知）を並行して行うワーカー数
+MATCH_PIPELINE_WORKERS = int(os.getenv('MATCH_PIPELINE_WORKERS', 4))
+
+# マッチング方式（greedy: レートの低い順に最も近い相手と組む / optimal: 待機リスト全体でレート差の合計を最小化する）
+MATCHMAKING_MODE = os.getenv('MATCHMAKING_MODE', 'greedy')
+# optimal の設定
+# 1回のマッチング計算に使える時間（秒）。超えた場合は greedy で組み合わせる
+MATCHMAKING_TIME_BUDGET = float(os.getenv('MATCHMAKING_TIME_BUDGET_MS', 50)) / 1000
+# レート順で何人先までを相手の候補にするか（間の人はマッチングしない扱いになる）
+MATCH_LOOKBACK = 4
+
+
+def rating_window(wait_seconds):
+    """待機時間に応じて段階的に広がる許容レート差"""
+    steps = int(wait_seconds // MATCH_RATING_WINDOW_INTERVAL)
+    return min(MATCH_RATING_WINDOW + MATCH_RATING_WINDOW_STEP * steps, MATCH_RATING_WINDOW_MAX)
+
+
+def next_window_expansion(joined_at, now):
+    """次に許容レート差が広がる時刻（上限に達している場合は None）"""
+    if rating_window(now - joined_at) >= MATCH_RATING_WINDOW_MAX:
+        return None
+    steps = int((now - joined_at) // MATCH_RATING_WINDOW_INTERVAL)
+    expansion = joined_at + MATCH_RATING_WINDOW_INTERVAL * (steps + 1)
+    # 浮動小数点の丸めで拡大の時刻ちょうどに steps が1つ少なくなる場合があるため、必ず now より後の時刻を返す
+    if expansion <= now:
+        expansion += MATCH_RATING_WINDOW_INTERVAL
+    return expansion
+
+
+class LatencyStats:
+    """直近の計測値を保持し、パーセンタイルを求める"""
+    def __init__(self, max_samples=1000):
+        self.samples = deque(maxlen=max_samples)
+        self.total_count = 0
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+        self.total_count += 1
+
+    def percentiles(self, *percents):
+        """{パーセント: 値} を返す（計測値がない場合は None）"""
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {percent: None for percent in percents}
+        # nearest-rank 法
+        return {
+            percent: ordered[max(int(len(ordered) * percent / 100 + 0.5) - 1, 0)]
+            for percent in percents
+        }
+
+
+# 待機開始からマッチング成立までの時間
+match_latency = LatencyStats()
+
+# 待機リストのイベントの種類
+_EVENT_DEADLINE = 0  # 待機期限
+_EVENT_EXPANSION = 1  # 許容レート差の拡大
+
+
+class WaitingPool:
+    """
+    マッチング待機中のユーザーをレート順に保持する待機リスト。
+    要素は (レート, user テーブルのID, discord.Member) で、レートの範囲検索を二分探索で行う。
+
+    待機期限と許容レート差の拡大は時刻順のヒープで管理する。
+    ユーザーごとに待機のたびに新しいトークンを発行し、ヒープ内のイベントはトークンが一致する場合のみ有効とする。
+    マッチングや期限切れで外れたユーザーのイベントはヒープに残る（トンボストーン）が、先頭に来た時点で捨てられる。
+    """
+    def __init__(self):
+        self._entries = []  # (rating, user_id, user) をレート順に並べたリスト
+        self._keys = {}  # Discord ID -> (rating, user_id)
+        self._joined_at = {}  # Discord ID -> 待機開始時刻 (time.monotonic)
+        self._tokens = {}  # Discord ID -> 待機中のトークン
+        self._events = []  # (時刻, 連番, 種類, Discord ID, トークン) のヒープ
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, discord_id):
+        return discord_id in self._keys
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def add(self, rating, user_id, user, joined_at=None):
+        """待機リストに追加する（既にいる場合は False）"""
+        if user.id in self._keys:
+            return False
+        bisect.insort(self._entries, (rating, user_id, user))
+        self._keys[user.id] = (rating, user_id)
+        joined_at = time.monotonic() if joined_at is None else joined_at
+        self._joined_at[user.id] = joined_at
+        token = next(self._sequence)
+        self._tokens[user.id] = token
+        self._push_event(joined_at + MATCH_QUEUE_TIMEOUT, _EVENT_DEADLINE, user.id, token)
+        expansion = next_window_expansion(joined_at, joined_at)
+        if expansion is not None:
+            self._push_event(expansion, _EVENT_EXPANSION, user.id, token)
+        return True
+
+    def wait_time(self, discord_id, now=None):
+        """待機開始からの経過時間（秒）"""
+        now = time.monotonic() if now is None else now
+        return now - self._joined_at[discord_id]
+
+    def remove(self, discord_id):
+        """待機リストから削除する（いなかった場合は False）"""
+        key = self._keys.pop(discord_id, None)
+        if key is None:
+            return False
+        del self._joined_at[discord_id]
+        # ヒープ内のイベントはトークンが外れたことで無効になる
+        del self._tokens[discord_id]
+        # (rating, user_id) は (rating, user_id, user) より前に並ぶため、bisect_left で要素の位置が求まる
+        del self._entries[bisect.bisect_left(self._entries, key)]
+        return True
+
+    def candidates(self, index, max_rating_diff):
+        """index の要素よりレートが高く、レート差が max_rating_diff 以内の要素を近い順に返す"""
+        rating = self._entries[index][0]
+        end = bisect.bisect_right(self._entries, (rating + max_rating_diff, float('inf')))
+        for j in range(index + 1, end):
+            yield self._entries[j]
+
+    def windows(self, now):
+        """各要素の現在の許容レート差（要素と同じ順）"""
+        return [rating_window(now - self._joined_at[entry[2].id]) for entry in self._entries]
+
+    def find_matches(self, can_pair, now=None):
+        """
+        レートの低い順に、許容レート差以内で最もレートの近い相手と組み合わせる。
+        2人の許容レート差のうち広い方（長く待っている方）を使う。
+        リスト自体は変更しないため、マッチを確定したら remove で取り除くこと。
+        :param can_pair: can_pair(user1, user2) が False の組み合わせは除外する（前回の対戦相手など）
+        :return: [((rating1, user_id1, user1), (rating2, user_id2, user2)), ...]
+        """
+        now = time.monotonic() if now is None else now
+        windows = self.windows(now)
+        # 相手側の許容レート差で組める場合もあるため、探索範囲は最も広い許容レート差にする
+        widest_window = max(windows, default=MATCH_RATING_WINDOW)
+        matched_ids = set()
+        matches = []
+        for i, entry in enumerate(self._entries):
+            rating, _, user1 = entry
+            if user1.id in matched_ids:
+                continue  # マッチ済みのユーザーはスキップ
+            for j, candidate in enumerate(self.candidates(i, widest_window), start=i + 1):
+                user2 = candidate[2]
+                if user2.id in matched_ids or candidate[0] - rating > max(windows[i], windows[j]) or not can_pair(user1, user2):
+                    continue
+                matched_ids.update([user1.id, user2.id])
+                matches.append((entry, candidate))
+                break
+        return matches
+
+    def find_optimal_matches(self, can_pair, now=None, time_budget=MATCHMAKING_TIME_BUDGET):
+        """
+        待機リスト全体で、マッチ数が最大になり、その中でレート差の合計が最小になる組み合わせを求める。
+        レート順に並べた上での動的計画法で、各ユーザーは MATCH_LOOKBACK 人先までを相手の候補にする。
+        許容レート差は2人のうち長く待っている方の待機時間に応じて広がる。
+        time_budget を超えた場合は find_matches（greedy）の結果を返す。
+        :return: find_matches と同じ形式
+        """
+        now = time.monotonic() if now is None else now
+        started_at = time.perf_counter()
+        entries = self._entries
+        windows = self.windows(now)
+
+        # best[i]: 先頭 i 人での (マッチ数, -レート差の合計) の最大値
+        # partner[i]: そのとき i-1 番目の人と組む相手の位置（組まない場合は None）
+        best = [(0, 0)] * (len(entries) + 1)
+        partner = [None] * (len(entries) + 1)
+        for i in range(1, len(entries) + 1):
+            if i % 256 == 0 and time.perf_counter() - started_at > time_budget:
+                return self.find_matches(can_pair, now)
+            best[i] = best[i - 1]
+            rating, _, user = entries[i - 1]
+            for j in range(i - 2, max(i - 2 - MATCH_LOOKBACK, -1), -1):
+                gap = rating - entries[j][0]
+                if gap > max(windows[i - 1], windows[j]) or not can_pair(entries[j][2], user):
+                    continue
+                # j と i-1 を組み、間の人はマッチングしない
+                matched_count, negative_gap = best[j]
+                candidate = (matched_count + 1, negative_gap - gap)
+                if candidate > best[i]:
+                    best[i] = candidate
+                    partner[i] = j
+
+        matches = []
+        i = len(entries)
+        while i > 0:
+            j = partner[i]
+            if j is None:
+                i -= 1
+            else:
+                matches.append((entries[j], entries[i - 1]))
+                i = j
+        matches.reverse()
+        return matches
+
+    def select_matches(self, can_pair, now=None):
+        """MATCHMAKING_MODE に応じた方式で組み合わせを求める"""
+        if MATCHMAKING_MODE == 'optimal':
+            return self.find_optimal_matches(can_pair, now)
+        return self.find_matches(can_pair, now)
+
+    def _push_event(self, event_time, kind, discord_id, token):
+        heapq.heappush(self._events, (event_time, next(self._sequence), kind, discord_id, token))
+        # 無効なイベントが溜まりすぎた場合は有効なものだけで作り直す
+        if len(self._events) > 4 * len(self._tokens) + 64:
+            self._events = [event for event in self._events if self._is_live(event)]
+            heapq.heapify(self._events)
+
+    def _is_live(self, event):
+        return self._tokens.get(event[3]) == event[4]
+
+    def _advance(self, now):
+        """無効なイベントと、過ぎた許容レート差の拡大をヒープの先頭から取り除く（次の拡大を登録する）"""
+        while self._events:
+            event_time, _, kind, discord_id, token = self._events[0]
+            if not self._is_live(self._events[0]):
+                heapq.heappop(self._events)
+            elif kind == _EVENT_EXPANSION and event_time <= now:
+                heapq.heappop(self._events)
+                expansion = next_window_expansion(self._joined_at[discord_id], now)
+                if expansion is not None:
+                    self._push_event(expansion, _EVENT_EXPANSION, discord_id, token)
+            else:
+                break
+
+    def pop_expired(self, now=None):
+        """待機時間が MATCH_QUEUE_TIMEOUT を過ぎた要素を取り除いて返す"""
+        now = time.monotonic() if now is None else now
+        expired = []
+        self._advance(now)
+        while self._events and self._events[0][0] <= now:
+            discord_id = heapq.heappop(self._events)[3]
+            # _advance の後なので、期限を過ぎた先頭のイベントは有効な待機期限
+            rating, user_id = self._keys[discord_id]
+            expired.append(self._entries[bisect.bisect_left(self._entries, (rating, user_id))])
+            self.remove(discord_id)
+            self._advance(now)
+        return expired
+
+    def next_event_time(self, now=None):
+        """次に待機リストの状態が変わる時刻（許容レート差の拡大か待機期限）。空の場合は None"""
+        now = time.monotonic() if now is None else now
+        self._advance(now)
+        return self._events[0][0] if self._events else None
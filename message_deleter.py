@@ -0,0 +1,63 @@
+import time
+import asyncio
+import logging
+from collections import defaultdict
+import discord
+
+from timer_wheel import TimerWheel
+from api_scheduler import api_scheduler, PRIORITY_BACKGROUND
+
+
+class MessageDeleter:
+    """
+    一定時間後のメッセージ削除をまとめて行うスケジューラー。
+    削除対象はメッセージオブジェクトではなく (インタラクションの Webhook, メッセージID) のタプルで保持し、
+    同じ時刻（1秒単位）に削除するものを1つのタイマーにまとめる。
+    遅れて削除するのはエフェメラルメッセージなど、インタラクションのトークン経由でしか削除できないものだけのため、
+    一括削除は使わず1件ずつ削除する（元の応答のメッセージIDは '@original'）。トークンの有効期限は15分。
+    Webhook は interaction.followup から取得し、Bot の HTTP セッションを使う（Bot の終了時に閉じられる）。
+    """
+    def __init__(self):
+        self._timers = TimerWheel("message_deleter")
+        self._pending = defaultdict(list)  # 削除する時刻（秒） -> 削除対象のリスト
+        self.deleted_count = 0
+        self.failed_count = 0
+
+    def __len__(self):
+        """削除待ちのメッセージ数"""
+        return sum(len(targets) for targets in self._pending.values())
+
+    def _schedule(self, target, delay):
+        second = int(time.time() + delay)
+        if second not in self._pending:
+            self._timers.schedule(second, second, lambda: self._flush(second))
+        self._pending[second].append(target)
+
+    def delete_followup_later(self, interaction, message, delay):
+        """interaction.followup.send で送ったメッセージを delay 秒後に削除する"""
+        self._schedule((interaction.followup, message.id), delay)
+
+    def delete_original_response_later(self, interaction, delay):
+        """インタラクションへの応答メッセージを delay 秒後に削除する"""
+        self._schedule((interaction.followup, '@original'), delay)
+
+    async def _flush(self, second):
+        targets = self._pending.pop(second, [])
+        await asyncio.gather(*(self._delete_webhook_message(webhook, message_id) for webhook, message_id in targets))
+
+    async def _delete_webhook_message(self, webhook, message_id):
+        await self._delete_one(('webhook', webhook.id), lambda: webhook.delete_message(message_id))
+
+    async def _delete_one(self, route, request):
+        try:
+            await api_scheduler.call(route, request, priority=PRIORITY_BACKGROUND, description="Deleting message")
+            self.deleted_count += 1
+        except discord.NotFound:
+            pass  # メッセージが既に削除されている場合は無視
+        except Exception as e:
+            self.failed_count += 1
+            logging.error(f"Failed to delete message: {e}")
+
+
+# Bot 全体で共有する削除スケジューラー
+message_deleter = MessageDeleter()
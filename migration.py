@@ -0,0 +1,395 @@
+import os
+import logging
+
+from db_connection import connect, DB_ARCHIVE_DIR
+
+
+def _column_exists(cursor, table, column):
+    cursor.execute(f'PRAGMA table_info({table})')
+    return any(row[1] == column for row in cursor.fetchall())
+
+
+def _add_column_if_missing(cursor, table, column, definition):
+    if not _column_exists(cursor, table, column):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def _migrate_v1(cursor):
+    """database.py で定義のみされていたカラム追加を適用する"""
+    _add_column_if_missing(cursor, 'user', 'cancelled_matches_count', 'INTEGER DEFAULT 0')
+    _add_column_if_missing(cursor, 'user_season_record', 'total_matches', 'INTEGER DEFAULT 0')
+    _add_column_if_missing(cursor, 'user_season_record', 'win_streak', 'INTEGER DEFAULT 0')
+    _add_column_if_missing(cursor, 'user_season_record', 'max_win_streak', 'INTEGER DEFAULT 0')
+
+
+def _migrate_v2(cursor):
+    """戦績・ランキング表示で使うクエリ用のインデックスを作成する"""
+    # ユーザーIDを先頭にすることで、シーズン指定なしのクラス別戦績でも使える
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_match_history_user1
+    ON match_history (user1_id, season_name, match_date)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_match_history_user2
+    ON match_history (user2_id, season_name, match_date)
+    ''')
+    # 対戦相手別・期間別の戦績用
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_match_history_winner
+    ON match_history (winner_user_id, match_date)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_match_history_loser
+    ON match_history (loser_user_id, match_date)
+    ''')
+    # 過去シーズンのランキングとユーザーごとのシーズン記録の検索用
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_user_season_record_season_rating
+    ON user_season_record (season_id, rating)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_user_season_record_user_season
+    ON user_season_record (user_id, season_id)
+    ''')
+
+
+def _migrate_v3(cursor):
+    """
+    プレイヤー視点の対戦履歴テーブル player_match を作成し、match_history から移行する。
+    rating_after は各シーズンの 1500 からの累計で、開催中のシーズンの Stay は反映するが、
+    終了したシーズンの Stay と管理者によるレートの調整は反映されない（記録がないため）。
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS player_match (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        match_history_id INTEGER,
+        user_id INTEGER,
+        season_name TEXT,
+        match_date TEXT,
+        opponent_id INTEGER,
+        class_a TEXT,
+        class_b TEXT,
+        opponent_class_a TEXT,
+        opponent_class_b TEXT,
+        rating_change INTEGER,
+        rating_after INTEGER,
+        won BOOLEAN DEFAULT 0,
+        FOREIGN KEY (match_history_id) REFERENCES match_history(id),
+        FOREIGN KEY (user_id) REFERENCES user(id),
+        FOREIGN KEY (opponent_id) REFERENCES user(id),
+        FOREIGN KEY (season_name) REFERENCES season(season_name)
+    )
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_player_match_user_season
+    ON player_match (user_id, season_name, match_date)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_player_match_user_opponent
+    ON player_match (user_id, opponent_id, match_date)
+    ''')
+
+    # 1試合を両プレイヤー分の2行に展開する。id が時系列順になるよう日付順に挿入し、
+    # 対戦後のレートはシーズン開始時の 1500 から日付順に累計して復元する。
+    # Stay するとレートは 1500 に、total_matches は 0 に戻るため、開催中のシーズンで stay_flag = 1 のユーザーは
+    # 最後の total_matches 試合を Stay 後として、そこから 1500 で累計し直す（stay_segment）。
+    cursor.execute('''
+    INSERT INTO player_match (
+        match_history_id, user_id, season_name, match_date, opponent_id,
+        class_a, class_b, opponent_class_a, opponent_class_b,
+        rating_change, rating_after, won
+    )
+    SELECT
+        match_history_id, user_id, season_name, match_date, opponent_id,
+        class_a, class_b, opponent_class_a, opponent_class_b,
+        rating_change,
+        1500 + SUM(rating_change) OVER (
+            PARTITION BY user_id, season_name, stay_segment ORDER BY match_date, match_history_id
+        ),
+        won
+    FROM (
+        SELECT
+            numbered.*,
+            numbered.season_name = (SELECT season_name FROM season WHERE end_date IS NULL ORDER BY id DESC LIMIT 1)
+                AND user.stay_flag = 1
+                AND numbered.season_seq > numbered.season_count - user.total_matches AS stay_segment
+        FROM (
+            SELECT
+                history_rows.*,
+                ROW_NUMBER() OVER (
+                    PARTITION BY user_id, season_name ORDER BY match_date, match_history_id
+                ) AS season_seq,
+                COUNT(*) OVER (PARTITION BY user_id, season_name) AS season_count
+            FROM (
+                SELECT id AS match_history_id, user1_id AS user_id, season_name, match_date, user2_id AS opponent_id,
+                       user1_class_a AS class_a, user1_class_b AS class_b,
+                       user2_class_a AS opponent_class_a, user2_class_b AS opponent_class_b,
+                       user1_rating_change AS rating_change, winner_user_id = user1_id AS won
+                FROM match_history
+                UNION ALL
+                SELECT id, user2_id, season_name, match_date, user1_id,
+                       user2_class_a, user2_class_b,
+                       user1_class_a, user1_class_b,
+                       user2_rating_change, winner_user_id = user2_id
+                FROM match_history
+            ) AS history_rows
+        ) AS numbered
+        LEFT JOIN user ON user.id = numbered.user_id
+    )
+    ORDER BY match_date, match_history_id, user_id
+    ''')
+
+
+def _migrate_v4(cursor):
+    """アーカイブ済みシーズンの対戦履歴ファイル名を記録するカラムを追加する"""
+    _add_column_if_missing(cursor, 'season', 'archive_file', 'TEXT')
+
+
+def _migrate_v5(cursor):
+    """対戦履歴にシーズンIDを追加し、シーズンでの絞り込みを整数のインデックス検索にする"""
+    for table in ('match_history', 'player_match'):
+        _add_column_if_missing(cursor, table, 'season_id', 'INTEGER REFERENCES season(id)')
+        cursor.execute(f'''
+        UPDATE {table}
+        SET season_id = (SELECT season.id FROM season WHERE season.season_name = {table}.season_name)
+        WHERE season_id IS NULL
+        ''')
+
+    # シーズン名を含むインデックスをシーズンIDのものに置き換える
+    cursor.execute('DROP INDEX IF EXISTS idx_match_history_user1')
+    cursor.execute('DROP INDEX IF EXISTS idx_match_history_user2')
+    cursor.execute('DROP INDEX IF EXISTS idx_player_match_user_season')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_match_history_user1
+    ON match_history (user1_id, season_id, match_date)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_match_history_user2
+    ON match_history (user2_id, season_id, match_date)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_player_match_user_season
+    ON player_match (user_id, season_id, match_date)
+    ''')
+
+    # アーカイブ済みのシーズンもホットテーブルと同じカラム構成にする
+    cursor.execute('SELECT id, archive_file FROM season WHERE archive_file IS NOT NULL')
+    for season_id, archive_file in cursor.fetchall():
+        archive_conn = connect(os.path.join(DB_ARCHIVE_DIR, archive_file))
+        try:
+            archive_cursor = archive_conn.cursor()
+            for table in ('match_history', 'player_match'):
+                _add_column_if_missing(archive_cursor, table, 'season_id', 'INTEGER')
+                archive_cursor.execute(f'UPDATE {table} SET season_id = ?', (season_id,))
+            archive_conn.commit()
+        finally:
+            archive_conn.close()
+
+
+# player_match からクラスの組み合わせごとの勝敗数を集計する（class_a <= class_b に正規化し、未設定のクラスは空文字）
+CLASS_STATS_AGGREGATE = '''
+SELECT
+    user_id,
+    season_id,
+    MIN(COALESCE(class_a, ''), COALESCE(class_b, '')) AS pair_a,
+    MAX(COALESCE(class_a, ''), COALESCE(class_b, '')) AS pair_b,
+    SUM(CASE WHEN won THEN 1 ELSE 0 END) AS win_count,
+    SUM(CASE WHEN won THEN 0 ELSE 1 END) AS loss_count
+FROM player_match
+WHERE season_id IS NOT NULL
+GROUP BY user_id, season_id, pair_a, pair_b
+'''
+
+
+def _migrate_v6(cursor):
+    """クラス別戦績の集計テーブル class_stats を作成し、対戦履歴（アーカイブを含む）から集計する"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS class_stats (
+        user_id INTEGER NOT NULL,
+        season_id INTEGER NOT NULL,
+        class_a TEXT NOT NULL,
+        class_b TEXT NOT NULL,
+        win_count INTEGER DEFAULT 0,
+        loss_count INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, season_id, class_a, class_b),
+        FOREIGN KEY (user_id) REFERENCES user(id),
+        FOREIGN KEY (season_id) REFERENCES season(id)
+    )
+    ''')
+    cursor.execute('DELETE FROM class_stats')
+    cursor.execute(f'''
+    INSERT INTO class_stats (user_id, season_id, class_a, class_b, win_count, loss_count)
+    {CLASS_STATS_AGGREGATE}
+    ''')
+
+    cursor.execute('SELECT archive_file FROM season WHERE archive_file IS NOT NULL')
+    for (archive_file,) in cursor.fetchall():
+        archive_conn = connect(os.path.join(DB_ARCHIVE_DIR, archive_file))
+        try:
+            rows = archive_conn.execute(CLASS_STATS_AGGREGATE).fetchall()
+        finally:
+            archive_conn.close()
+        cursor.executemany('''
+        INSERT INTO class_stats (user_id, season_id, class_a, class_b, win_count, loss_count)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+
+
+def _migrate_v7(cursor):
+    """進行中の試合を保存する pending_match テーブルを作成する（再起動後に結果入力のボタンと期限を復元するため）"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS pending_match (
+        thread_id TEXT PRIMARY KEY,
+        player1_id TEXT NOT NULL,
+        player2_id TEXT NOT NULL,
+        player1_class_a TEXT,
+        player1_class_b TEXT,
+        player2_class_a TEXT,
+        player2_class_b TEXT,
+        player1_result INTEGER,
+        player2_result INTEGER,
+        result_message_id TEXT,
+        status TEXT NOT NULL DEFAULT 'playing',
+        cancel_requester_id TEXT,
+        cancel_message_id TEXT,
+        deadline REAL,
+        created_at TEXT
+    )
+    ''')
+
+
+# (バージョン, 適用関数) の順に並べる。適用済みのバージョンは PRAGMA user_version に記録される
+MIGRATIONS = [
+    (1, _migrate_v1),
+    (2, _migrate_v2),
+    (3, _migrate_v3),
+    (4, _migrate_v4),
+    (5, _migrate_v5),
+    (6, _migrate_v6),
+    (7, _migrate_v7),
+]
+
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """未適用のマイグレーションを順番に適用し、適用後のバージョンを返す"""
+    current_version = get_schema_version(conn)
+    for version, step in MIGRATIONS:
+        if version <= current_version:
+            continue
+        cursor = conn.cursor()
+        try:
+            # DDL も含めて1バージョン分を1トランザクションで適用する
+            cursor.execute('BEGIN')
+            step(cursor)
+            cursor.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"マイグレーション v{version} の適用中にエラーが発生しました: {e}")
+            raise
+        current_version = version
+    return current_version
+
+
+# 戦績・ランキング表示で頻繁に実行されるクエリ（ORM が発行する SQL と同じ条件）
+HOT_QUERIES = {
+    'show_recent50_stats': (
+        'SELECT * FROM match_history '
+        'WHERE (user1_id = ? OR user2_id = ?) AND season_id = ? '
+        'ORDER BY match_date DESC LIMIT 50',
+        (1, 1, 1),
+    ),
+    'show_class_stats': (
+        'SELECT * FROM match_history '
+        'WHERE ((user1_id = ? AND (user1_class_a = ? OR user1_class_b = ?)) '
+        'OR (user2_id = ? AND (user2_class_a = ? OR user2_class_b = ?))) '
+        'AND season_id = ?',
+        (1, 'エルフ', 'エルフ', 1, 'エルフ', 'エルフ', 1),
+    ),
+    'show_class_stats_all_seasons': (
+        'SELECT * FROM match_history '
+        'WHERE (user1_id = ? AND ((user1_class_a = ? AND user1_class_b = ?) OR (user1_class_a = ? AND user1_class_b = ?))) '
+        'OR (user2_id = ? AND ((user2_class_a = ? AND user2_class_b = ?) OR (user2_class_a = ? AND user2_class_b = ?)))',
+        (1, 'エルフ', 'ロイヤル', 'ロイヤル', 'エルフ', 1, 'エルフ', 'ロイヤル', 'ロイヤル', 'エルフ'),
+    ),
+    'show_vs_stats': (
+        'SELECT * FROM match_history '
+        'WHERE (winner_user_id = ? AND loser_user_id = ?) OR (winner_user_id = ? AND loser_user_id = ?)',
+        (1, 2, 2, 1),
+    ),
+    'show_date_range_stats': (
+        'SELECT * FROM match_history '
+        'WHERE (winner_user_id = ? OR loser_user_id = ?) AND match_date BETWEEN ? AND ?',
+        (1, 1, '2024-01-01 00:00:00', '2024-12-31 23:59:59'),
+    ),
+    'player_match_recent50': (
+        'SELECT * FROM player_match WHERE user_id = ? AND season_id = ? '
+        'ORDER BY match_date DESC, id DESC LIMIT 50',
+        (1, 1),
+    ),
+    'player_match_vs': (
+        'SELECT COUNT(id), SUM(won) FROM player_match WHERE user_id = ? AND opponent_id = ?',
+        (1, 2),
+    ),
+    'player_match_class': (
+        'SELECT COUNT(id), SUM(won) FROM player_match '
+        'WHERE user_id = ? AND (class_a = ? OR class_b = ?) AND season_id = ?',
+        (1, 'エルフ', 'エルフ', 1),
+    ),
+    'class_stats': (
+        'SELECT SUM(win_count), SUM(loss_count) FROM class_stats '
+        'WHERE user_id = ? AND season_id = ? AND (class_a = ? OR class_b = ?)',
+        (1, 1, 'エルフ', 'エルフ'),
+    ),
+    'user_by_discord_id': (
+        'SELECT * FROM user WHERE discord_id = ?',
+        ('123456789012345678',),
+    ),
+    'past_season_ranking': (
+        'SELECT * FROM user_season_record WHERE season_id = ? ORDER BY rating DESC LIMIT 100',
+        (1,),
+    ),
+    'user_season_record_lookup': (
+        'SELECT * FROM user_season_record WHERE user_id = ? AND season_id = ?',
+        (1, 1),
+    ),
+}
+
+
+def check_query_plans(conn):
+    """EXPLAIN QUERY PLAN でホットクエリが全表走査していないか確認し、問題のあるクエリとプランを返す"""
+    failures = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        details = [row[3] for row in plan]
+        # "SCAN <table>" はインデックスを使わない（またはインデックス全体を読む）走査
+        if any(detail.startswith('SCAN') for detail in details):
+            failures[name] = details
+    return failures
+
+
+if __name__ == '__main__':
+    # ログの設定
+    logging.basicConfig(
+        filename='errorlog.txt',  # ログを保存するファイル名
+        level=logging.ERROR,  # ログのレベルをエラーに設定
+        format='%(asctime)s - %(levelname)s - %(message)s'  # ログのフォーマット
+    )
+    conn = connect()
+    try:
+        version = migrate(conn)
+        print(f"スキーマバージョン: {version}")
+        failures = check_query_plans(conn)
+        for name, details in failures.items():
+            print(f"インデックス未使用: {name}")
+            for detail in details:
+                print(f"    {detail}")
+        if not failures:
+            print("全てのホットクエリがインデックスを使用しています。")
+    finally:
+        conn.close()
@@ -0,0 +1,45 @@
+from datetime import datetime
+from data_access import PendingMatch
+
+# pending_match.status の値
+STATUS_PLAYING = 'playing'  # 結果の入力待ち
+STATUS_CANCEL_REQUESTED = 'cancel_requested'  # 対戦相手の中止への回答待ち
+
+# 一方だけが結果を入力してから、もう一方の未入力を敗北とみなすまでの時間（秒）
+RESULT_TIMEOUT = 3 * 60 * 60
+# 対戦相手が中止に回答しない場合に、受け入れたとみなすまでの時間（秒）
+CANCEL_ACCEPT_TIMEOUT = 48 * 60 * 60
+
+
+def save_pending_match(session, thread_id, player1_id, player2_id, matching_classes):
+    """マッチ成立時に進行中の試合を保存する"""
+    player1_class_a, player1_class_b = matching_classes.get(player1_id, (None, None))
+    player2_class_a, player2_class_b = matching_classes.get(player2_id, (None, None))
+    session.merge(PendingMatch(
+        thread_id=str(thread_id),
+        player1_id=str(player1_id),
+        player2_id=str(player2_id),
+        player1_class_a=player1_class_a,
+        player1_class_b=player1_class_b,
+        player2_class_a=player2_class_a,
+        player2_class_b=player2_class_b,
+        status=STATUS_PLAYING,
+        created_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    ))
+
+
+def update_pending_match(session, thread_id, **values):
+    """進行中の試合の状態（結果・期限・メッセージIDなど）を更新する"""
+    for key in ('result_message_id', 'cancel_requester_id', 'cancel_message_id'):
+        if values.get(key) is not None:
+            values[key] = str(values[key])
+    session.query(PendingMatch).filter_by(thread_id=str(thread_id)).update(values, synchronize_session=False)
+
+
+def delete_pending_match(session, thread_id):
+    """試合の終了時に削除する（削除した行数を返す）"""
+    return session.query(PendingMatch).filter_by(thread_id=str(thread_id)).delete(synchronize_session=False)
+
+
+def load_pending_matches(session):
+    return session.query(PendingMatch).order_by(PendingMatch.created_at).all()
@@ -0,0 +1,40 @@
+import asyncio
+import logging
+
+
+class OrderedWorkerPool:
+    """
+    上限付きのワーカーで非同期処理を並行実行する。
+    処理ごとにキー（ユーザーIDなど）を指定し、同じキーを持つ処理だけは投入した順に1つずつ実行する。
+    """
+    def __init__(self, workers, name):
+        self.name = name
+        self.queue = asyncio.Queue()
+        self._tails = {}  # キー -> そのキーを持つ最後の処理の完了を表す Future
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(workers)]
+
+    def submit(self, keys, job):
+        """job() を実行待ちに追加する"""
+        self.queue.put_nowait((set(keys), job))
+
+    async def _worker(self):
+        while True:
+            keys, job = await self.queue.get()
+            # 取り出した直後（他のワーカーに切り替わる前）に、同じキーを持つ直前の処理の後ろに並ぶ
+            # 待つ相手は必ず先に取り出された処理なので、ワーカーが全て待ち状態になることはない
+            previous = [self._tails[key] for key in keys if key in self._tails]
+            done = asyncio.get_running_loop().create_future()
+            for key in keys:
+                self._tails[key] = done
+            try:
+                if previous:
+                    await asyncio.wait(previous)
+                await job()
+            except Exception as e:
+                logging.error(f"Error in {self.name}: {e}")
+            finally:
+                done.set_result(None)
+                for key in keys:
+                    if self._tails.get(key) is done:
+                        del self._tails[key]
+                self.queue.task_done()
@@ -1,243 +1,292 @@
 import discord
 from discord.ext import commands, tasks
 from discord.ui import Button, View, Select
-import asyncio
-from datetime import datetime, timedelta
-from sqlalchemy import create_engine, Column, Integer, String, desc
-from sqlalchemy.ext.automap import automap_base
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import Session
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import case
-import logging
-import atexit
-
-# データベースの設定
-db_path = 'db/shadowverse_bridge.db'
-engine = create_engine(f'sqlite:///{db_path}', echo=True)
-Base = automap_base()
-Base.prepare(engine, reflect=True)
-
-# マッピングされたクラスの取得
-User = Base.classes.user  # テーブル名が 'user' だと仮定
-Class = Base.classes.deck_class
-MatchHistory = Base.classes.match_history  # テーブル名が 'match_history' だと仮定
-Season = Base.classes.season  # テーブル名が 'season' だと仮定
-UserSeasonRecord = Base.classes.user_season_record
-
-session = Session(engine)
-valid_classes = [cls.class_name for cls in session.query(Class.class_name).all()]
-
-current_season_name = None
+import math
+import functools
+from sqlalchemy import desc
+from data_access import User, Season, UserSeasonRecord, run_db, get_current_season
+from api_scheduler import api_scheduler, PRIORITY_BACKGROUND
+from message_deleter import message_deleter
+from ranking_cache import ranking_cache
 
 # 現在のシーズン名を取得
 def get_current_season_name(session):
-    current_season = session.query(Season).filter(Season.end_date == None).order_by(desc(Season.id)).first()
+    current_season = get_current_season(session)
     if current_season:
         return current_season.season_name
     return None
 
 def get_current_season_id(session):
-    current_season = session.query(Season).filter(Season.end_date == None).order_by(desc(Season.id)).first()
+    current_season = get_current_season(session)
     if current_season:
         return current_season.id
     return None
 
-current_season_name = get_current_season_name(session)
-
-current_season_id = get_current_season_id(session)
-
 class RankingView(discord.ui.View):
-    def __init__(self, session):
+    def __init__(self):
         super().__init__(timeout=None)
-        self.session = session
         self.add_item(discord.ui.Button(label="連勝数ランキング", style=discord.ButtonStyle.primary, custom_id="win_streak_ranking"))
         self.add_item(discord.ui.Button(label="勝率ランキング", style=discord.ButtonStyle.primary, custom_id="win_rate_ranking"))
         # レートランキングのボタンは削除
 
-        # リクエストキューと処理タスク
-        self.request_queue = asyncio.Queue()
-        self.processing_task = asyncio.create_task(self.process_queue())
-
-        # ランキングデータのキャッシュ
-        self.cache_expiry = 300  # キャッシュの有効期限（秒）
-        self.cached_rankings = {}
-        self.cache_lock = asyncio.Lock()
-
-        # セマフォで同時リクエストを制限
-        self.semaphore = asyncio.Semaphore(5)
-
-    # リクエストキューを処理するタスク
-    async def process_queue(self):
-        while True:
-            requests = []
-            while not self.request_queue.empty():
-                requests.append(await self.request_queue.get())
-            if requests:
-                await asyncio.gather(*(self.handle_request(interaction) for interaction in requests))
-            await asyncio.sleep(0.1)
-
-    # ボタンが押されたときの処理
+    # ボタンが押されたときの処理（ランキングはキャッシュから作るため、待たせずにその場で応答する）
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
-        await interaction.response.defer(ephemeral=True)
-        await self.request_queue.put(interaction)
+        await self.handle_request(interaction)
         return True
 
     # リクエストを処理
     async def handle_request(self, interaction: discord.Interaction):
-        async with self.semaphore:
-            try:
-                custom_id = interaction.custom_id
-                if custom_id == "win_streak_ranking":
-                    await self.show_win_streak_ranking(interaction)
-                elif custom_id == "win_rate_ranking":
-                    await self.show_win_rate_ranking(interaction)
-            except Exception as e:
-                print(f"Error handling request: {e}")
-
-    # キャッシュを取得または更新
-    async def get_cached_ranking(self, ranking_type):
-        async with self.cache_lock:
-            now = datetime.now()
-            cache = self.cached_rankings.get(ranking_type)
-            if cache and (now - cache['timestamp']).total_seconds() < self.cache_expiry:
-                return cache['data']
-            else:
-                # キャッシュがないか期限切れの場合、データを再取得
-                data = await self.fetch_ranking_data(ranking_type)
-                self.cached_rankings[ranking_type] = {'data': data, 'timestamp': now}
-                return data
-
-    # ランキングデータを取得
-    async def fetch_ranking_data(self, ranking_type):
-        if ranking_type == "win_streak":
-            ranking = self.session.query(User).filter(User.latest_season_matched == True).order_by(desc(User.max_win_streak)).limit(100).all()
-            return ranking
-        elif ranking_type == "win_rate":
-            users = self.session.query(User).filter(User.latest_season_matched == True).all()
-            ranking_with_win_rate = []
-            for user in users:
-                win_count = user.win_count
-                total_matches = user.total_matches
-                loss_count = user.loss_count
-                if total_matches >= 50:
-                    win_rate = (win_count / total_matches) * 100
-                    ranking_with_win_rate.append((user, win_rate, win_count, loss_count))
-            ranking_with_win_rate.sort(key=lambda x: x[1], reverse=True)
-            return ranking_with_win_rate[:16]
-        elif ranking_type == "rating":
-            effective_rating = case(
-                (User.stayed_rating > User.rating, User.stayed_rating),
-                else_=User.rating
-            ).label('effective_rating')
-            ranking = self.session.query(
-                User.user_name,
-                effective_rating,
-                User.rating,
-                User.stayed_rating
-            ).filter(User.latest_season_matched == True).order_by(desc('effective_rating')).limit(100).all()
-            return ranking
+        try:
+            custom_id = interaction.custom_id
+            if custom_id == "win_streak_ranking":
+                await self.show_win_streak_ranking(interaction)
+            elif custom_id == "win_rate_ranking":
+                await self.show_win_rate_ranking(interaction)
+        except Exception as e:
+            print(f"Error handling request: {e}")
 
     # 連勝数ランキングを表示
     async def show_win_streak_ranking(self, interaction: discord.Interaction):
-        ranking = await self.get_cached_ranking("win_streak")
-        current_season_name = get_current_season_name(self.session)
-        embed = discord.Embed(title=f"【{current_season_name}】連勝数ランキング", color=discord.Color.red())
-        await self.send_ranking_embed(embed, ranking, interaction=interaction, ranking_type="win_streak")
+        current_season_name, ranking = await ranking_cache.get("win_streak")
+        own_index = find_rank_index(ranking, interaction.user.id, lambda entry: entry.discord_id)
+        paginator = RankingPaginator(
+            f"【{current_season_name}】連勝数ランキング", discord.Color.red(), ranking,
+            functools.partial(ranking_field, ranking_type="win_streak"), own_index
+        )
+        await paginator.send(interaction)
 
     # 勝率ランキングを表示
     async def show_win_rate_ranking(self, interaction: discord.Interaction):
-        ranking_with_win_rate = await self.get_cached_ranking("win_rate")
-        current_season_name = get_current_season_name(self.session)
-        embed = discord.Embed(title=f"【{current_season_name}】勝率ランキングTOP16", color=discord.Color.green())
-        await self.send_ranking_embed(embed, ranking_with_win_rate, interaction=interaction, ranking_type="win_rate")
-
-    # レートランキングを表示（チャンネルに送信）
-    async def show_rate_ranking(self, channel: discord.TextChannel):
-        ranking = await self.get_cached_ranking("rating")
-        current_season_name = get_current_season_name(self.session)
-        embed = discord.Embed(title=f"【{current_season_name}】レーティングランキング", color=discord.Color.blue())
-        await self.send_ranking_embed(embed, ranking, channel=channel, ranking_type="rating")
-
-    # Embedを送信
-    async def send_ranking_embed(self, embed, ranking, interaction=None, channel=None, ranking_type="win_streak"):
-        messages = []
-        for i, record in enumerate(ranking, start=1):
-            if ranking_type == "win_streak":
-                embed.add_field(name=f"**``` {i}位 ```**", value=f"{record.user_name} - 連勝数 : {record.max_win_streak}", inline=False)
-            elif ranking_type == "win_rate":
-                user, win_rate, win_count, loss_count = record
-                embed.add_field(name=f"**``` {i}位 ```**", value=f"{user.user_name} - 勝率 : {win_rate:.2f}% ({win_count}勝 {loss_count}敗)", inline=False)
-            elif ranking_type == "rating":
-                user_name, effective_rating_value, rating_value, stayed_rating_value = record
-                rounded_rating = round(effective_rating_value or 1500, 3)
-                rate_display = f"{rounded_rating} (stayed)" if stayed_rating_value and stayed_rating_value > rating_value else f"{rounded_rating}"
-                embed.add_field(name=f"**``` {i}位 ```**", value=f"{user_name} - レート : {rate_display}", inline=False)
-            if len(embed.fields) == 25:
-                if interaction:
-                    message = await interaction.followup.send(embed=embed, ephemeral=True)
-                elif channel:
-                    message = await channel.send(embed=embed)
-                messages.append(message)
-                embed.clear_fields()
-
-        if len(embed.fields) > 0:
-            if interaction:
-                message = await interaction.followup.send(embed=embed, ephemeral=True)
-            elif channel:
-                message = await channel.send(embed=embed)
-            messages.append(message)
-
-        # メッセージを削除するタスクを別で実行（必要に応じて）
-        if interaction:
-            asyncio.create_task(self.delete_messages_after_delay(messages))
-
-    # メッセージを一定時間後に削除
-    async def delete_messages_after_delay(self, messages):
-        await asyncio.sleep(300)
-        for msg in messages:
-            try:
-                await msg.delete()
-            except discord.errors.NotFound:
-                pass
+        current_season_name, ranking_with_win_rate = await ranking_cache.get("win_rate")
+        own_index = find_rank_index(ranking_with_win_rate, interaction.user.id, lambda record: record[0].discord_id)
+        paginator = RankingPaginator(
+            f"【{current_season_name}】勝率ランキングTOP16", discord.Color.green(), ranking_with_win_rate,
+            functools.partial(ranking_field, ranking_type="win_rate"), own_index
+        )
+        await paginator.send(interaction)
+
+
+# 1つの Embed に載せる人数（Embed のフィールド数の上限）
+RANKING_PAGE_SIZE = 25
+# ボタンから表示したランキングを残しておく時間（秒）
+RANKING_MESSAGE_LIFETIME = 300
+
+
+def ranking_field(i, record, ranking_type):
+    """ランキングの i 位のフィールド（名前, 値）"""
+    if ranking_type == "win_streak":
+        return f"**``` {i}位 ```**", f"{record.user_name} - 連勝数 : {record.max_win_streak}"
+    elif ranking_type == "win_rate":
+        user, win_rate, win_count, loss_count = record
+        return f"**``` {i}位 ```**", f"{user.user_name} - 勝率 : {win_rate:.2f}% ({win_count}勝 {loss_count}敗)"
+    elif ranking_type == "rating":
+        user_name, effective_rating_value, rating_value, stayed_rating_value = record
+        rounded_rating = round(effective_rating_value or 1500, 3)
+        rate_display = f"{rounded_rating} (stayed)" if stayed_rating_value and stayed_rating_value > rating_value else f"{rounded_rating}"
+        return f"**``` {i}位 ```**", f"{user_name} - レート : {rate_display}"
+
+
+def render_ranking_page(title, color, ranking, field, page):
+    """
+    ランキングの page ページ目（0始まり）の Embed
+    :param field: field(順位, レコード) で (名前, 値) を返す関数
+    """
+    embed = discord.Embed(title=title, color=color)
+    start = page * RANKING_PAGE_SIZE
+    for i, record in enumerate(ranking[start:start + RANKING_PAGE_SIZE], start=start + 1):
+        name, value = field(i, record)
+        embed.add_field(name=name, value=value, inline=False)
+    return embed
+
+
+def render_ranking_pages(title, color, ranking, ranking_type):
+    """ランキングを RANKING_PAGE_SIZE 人ずつの Embed に分ける"""
+    field = functools.partial(ranking_field, ranking_type=ranking_type)
+    return [render_ranking_page(title, color, ranking, field, page) for page in range(math.ceil(len(ranking) / RANKING_PAGE_SIZE))]
+
+
+def find_rank_index(ranking, discord_id, key):
+    """ranking の中での discord_id のユーザーの位置（載っていない場合は None）。key(レコード) は Discord ID を返す関数"""
+    discord_id = str(discord_id)
+    return next((index for index, record in enumerate(ranking) if key(record) == discord_id), None)
+
+
+class RankingPaginator(discord.ui.View):
+    """
+    ランキングを1つのエフェメラルメッセージでページ送りして表示する。
+    表示するページだけをその都度 Embed にし、ボタンへの応答はメッセージの編集1回で済ませる。
+    """
+    def __init__(self, title, color, ranking, field, own_index=None):
+        """
+        :param field: field(順位, レコード) で (名前, 値) を返す関数
+        :param own_index: ボタンを押したユーザーの ranking の中での位置（載っていない場合は None）
+        """
+        super().__init__(timeout=RANKING_MESSAGE_LIFETIME)
+        self.title = title
+        self.color = color
+        self.ranking = ranking
+        self.field = field
+        self.own_index = own_index
+        self.page = 0
+        self.page_count = max(math.ceil(len(ranking) / RANKING_PAGE_SIZE), 1)
+        self.update_buttons()
+
+    def render(self):
+        embed = render_ranking_page(self.title, self.color, self.ranking, self.field, self.page)
+        if not self.ranking:
+            embed.description = "ランキングに載っているユーザーはいません。"
+        embed.set_footer(text=f"{self.page + 1} / {self.page_count} ページ")
+        return embed
+
+    def update_buttons(self):
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.page_count - 1
+        self.jump_to_own_rank.disabled = self.own_index is None
+
+    async def send(self, interaction: discord.Interaction):
+        """インタラクションへの応答として1ページ目を表示し、一定時間後に削除する"""
+        await interaction.response.send_message(embed=self.render(), view=self, ephemeral=True)
+        message_deleter.delete_original_response_later(interaction, RANKING_MESSAGE_LIFETIME)
+
+    async def show_page(self, interaction: discord.Interaction, page):
+        self.page = page
+        self.update_buttons()
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label="◀ 前へ", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, button: discord.ui.Button, interaction: discord.Interaction):
+        await self.show_page(interaction, max(self.page - 1, 0))
+
+    @discord.ui.button(label="次へ ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, button: discord.ui.Button, interaction: discord.Interaction):
+        await self.show_page(interaction, min(self.page + 1, self.page_count - 1))
+
+    @discord.ui.button(label="自分の順位へ", style=discord.ButtonStyle.primary)
+    async def jump_to_own_rank(self, button: discord.ui.Button, interaction: discord.Interaction):
+        await self.show_page(interaction, self.own_index // RANKING_PAGE_SIZE)
+
+
+class RankingPublisher:
+    """
+    ランキングチャンネルのレーティングランキングの投稿を管理する。
+    ページはランキングのデータが変わったときだけ作り直し、投稿済みのメッセージのうち内容が変わったページだけを編集する。
+    初回と、投稿済みのメッセージが見つからない場合のみチャンネルを作り直す。
+    ランキングチャンネルへのリクエストはマッチング関連のリクエストより後回しにする。
+    """
+    def __init__(self):
+        self._channel_id = None
+        self._message_ids = []  # ページごとのメッセージID
+        self._pages = []  # 投稿済みのページ（Embed.to_dict()）
+        self._source = None  # ページを作ったときの ranking_cache のデータ
+        self.edited_count = 0
+        self.skipped_count = 0
+
+    async def publish(self, channel, content, view):
+        """
+        レーティングランキングを最新にする。
+        :param content: チャンネルを作り直す場合に、ランキングの前に送る案内メッセージ
+        :param view: 案内メッセージに付けるビュー
+        """
+        source = await ranking_cache.get("rating", allow_stale=False)
+        if channel.id == self._channel_id and source is self._source:
+            # 前回からランキングのデータが変わっていない（ページも作り直さない）
+            self.skipped_count += 1
+            return
+
+        current_season_name, ranking = source
+        pages = render_ranking_pages(f"【{current_season_name}】レーティングランキング", discord.Color.blue(), ranking, "rating")
+        try:
+            if channel.id == self._channel_id:
+                try:
+                    if not await self._update(channel, pages):
+                        self.skipped_count += 1
+                except discord.NotFound:
+                    # 投稿済みのメッセージが削除されていた場合は作り直す
+                    await self._reset(channel, content, view, pages)
+            else:
+                await self._reset(channel, content, view, pages)
+        except Exception:
+            # 途中で失敗した場合は、次回チャンネルを作り直す
+            self._channel_id = None
+            raise
+        self._source = source
+
+    async def _update(self, channel, pages):
+        """内容が変わったページだけ反映する（何も変わっていない場合は False）"""
+        new_pages = [page.to_dict() for page in pages]
+        if new_pages == self._pages:
+            return False
+        for index, page in enumerate(pages):
+            if index >= len(self._message_ids):
+                message = await self._call(channel, lambda page=page: channel.send(embed=page), "Posting ranking")
+                self._message_ids.append(message.id)
+            elif new_pages[index] != self._pages[index]:
+                message = channel.get_partial_message(self._message_ids[index])
+                await self._call(channel, lambda message=message, page=page: message.edit(embed=page), "Editing ranking")
+                self.edited_count += 1
+        # 人数が減ってページが余った場合は削除する
+        for message_id in self._message_ids[len(pages):]:
+            message = channel.get_partial_message(message_id)
+            await self._call(channel, lambda message=message: message.delete(), "Deleting ranking")
+        del self._message_ids[len(pages):]
+        self._pages = new_pages
+        return True
 
+    async def _reset(self, channel, content, view, pages):
+        await api_scheduler.call(('purge', channel.id), channel.purge, priority=PRIORITY_BACKGROUND, description="Purging channel")
+        await self._call(channel, lambda: channel.send(content, view=view), "Sending message")
+        self._message_ids = []
+        for page in pages:
+            message = await self._call(channel, lambda page=page: channel.send(embed=page), "Posting ranking")
+            self._message_ids.append(message.id)
+        self._pages = [page.to_dict() for page in pages]
+        self._channel_id = channel.id
+
+    @staticmethod
+    async def _call(channel, request, description):
+        return await api_scheduler.call(('message', channel.id), request, priority=PRIORITY_BACKGROUND, description=description)
+
+
+# ランキングチャンネルの投稿（Bot 全体で1つ）
+ranking_publisher = RankingPublisher()
 
 
 #過去シーズン関連
 class RankingButtonView(discord.ui.View):
-    def __init__(self, session):
+    def __init__(self):
         super().__init__(timeout=None)
-        self.session = session
         # レーティング、連勝数、勝率のボタンを追加
-        self.add_item(RankingButton(session, "レーティングランキング", "rate"))
-        self.add_item(RankingButton(session, "連勝数ランキング", "win_streak"))
-        self.add_item(RankingButton(session, "勝率ランキング", "win_rate"))
+        self.add_item(RankingButton("レーティングランキング", "rate"))
+        self.add_item(RankingButton("連勝数ランキング", "win_streak"))
+        self.add_item(RankingButton("勝率ランキング", "win_rate"))
+
+
+def get_past_seasons(session):
+    """終了済みのシーズンを新しい順に取得"""
+    return session.query(Season).filter(Season.end_date.isnot(None)).order_by(Season.id.desc()).all()
 
 
 class RankingButton(discord.ui.Button):
-    def __init__(self, session, label, ranking_type):
+    def __init__(self, label, ranking_type):
         super().__init__(label=label, style=discord.ButtonStyle.primary)
         self.ranking_type = ranking_type
-        self.session = session
 
     async def callback(self, interaction: discord.Interaction):
         # ユーザーがボタンを押したらシーズン選択ビューを表示
-        view = PastRankingSelectView(self.session, self.ranking_type)
+        seasons = await run_db(get_past_seasons)
+        view = PastRankingSelectView(seasons, self.ranking_type)
         await interaction.response.send_message("シーズンを選択してください:", view=view, ephemeral=True)
 
 class PastRankingSelectView(discord.ui.View):
-    def __init__(self, session, ranking_type):
+    def __init__(self, seasons, ranking_type):
         super().__init__(timeout=None)
-        self.session = session
-        self.add_item(PastRankingSelect(session, ranking_type))
+        self.add_item(PastRankingSelect(seasons, ranking_type))
 
 class PastRankingSelect(discord.ui.Select):
-    def __init__(self, session, ranking_type):
-        self.session = session
+    def __init__(self, seasons, ranking_type):
         self.ranking_type = ranking_type
-
-        # 過去のシーズンを取得
-        seasons = self.session.query(Season).filter(Season.end_date.isnot(None)).order_by(Season.id.desc()).all()
+        # シーズンIDとシーズン名の対応
+        self.season_names = {season.id: season.season_name for season in seasons}
 
         # 選択肢を作成
         if seasons:
@@ -263,8 +312,7 @@ class PastRankingSelect(discord.ui.Select):
             return
 
         season_id = int(self.values[0])
-        season_name = self.session.query(Season).filter_by(id=season_id).first().season_name
-        await interaction.response.defer(ephemeral=True)
+        season_name = self.season_names[season_id]
 
         # 選択されたシーズンのランキングを表示
         if self.ranking_type == "rate":
@@ -274,72 +322,52 @@ class PastRankingSelect(discord.ui.Select):
         elif self.ranking_type == "win_rate":
             await self.show_win_rate_ranking(interaction, season_id, season_name)
 
-        # メッセージを削除
-        await asyncio.sleep(10)
-        try:
-            await interaction.delete_original_response()
-        except discord.errors.NotFound:
-            pass  # メッセージが見つからない場合は無視
+    def query_season_records(self, session, season_id, ranking_type):
+        """指定シーズンのランキング対象レコードをユーザー名・Discord ID と合わせて取得"""
+        query = session.query(UserSeasonRecord, User.user_name, User.discord_id).join(
+            User, User.id == UserSeasonRecord.user_id
+        ).filter(UserSeasonRecord.season_id == season_id)
+        if ranking_type == "rating":
+            return query.order_by(desc(UserSeasonRecord.rating)).limit(100).all()
+        elif ranking_type == "win_rate":
+            return query.filter(UserSeasonRecord.total_matches >= 50).all()
+        elif ranking_type == "win_streak":
+            return query.order_by(desc(UserSeasonRecord.max_win_streak)).limit(100).all()
 
     async def show_rate_ranking(self, interaction, season_id, season_name):
-        ranking = self.session.query(UserSeasonRecord).filter_by(season_id=season_id).order_by(desc(UserSeasonRecord.rating)).limit(100).all()
+        ranking = await run_db(self.query_season_records, season_id, "rating")
         embed = discord.Embed(title=f"【{season_name}】レーティングランキング", color=discord.Color.blue())
         await self.send_ranking_embed(embed, ranking, interaction, "rating")
 
     async def show_win_rate_ranking(self, interaction, season_id, season_name):
-        ranking = self.session.query(UserSeasonRecord).filter_by(season_id=season_id).filter(UserSeasonRecord.total_matches >= 50).all()
-        ranking = sorted(ranking, key=lambda record: (record.win_count / record.total_matches) * 100 if record.total_matches > 0 else 0, reverse=True)
+        ranking = await run_db(self.query_season_records, season_id, "win_rate")
+        ranking = sorted(ranking, key=lambda row: (row[0].win_count / row[0].total_matches) * 100 if row[0].total_matches > 0 else 0, reverse=True)
         embed = discord.Embed(title=f"【{season_name}】勝率ランキング", color=discord.Color.green())
         await self.send_ranking_embed(embed, ranking, interaction, "win_rate")
 
     async def show_win_streak_ranking(self, interaction, season_id, season_name):
-        ranking = self.session.query(UserSeasonRecord).filter_by(season_id=season_id).order_by(desc(UserSeasonRecord.max_win_streak)).limit(100).all()
+        ranking = await run_db(self.query_season_records, season_id, "win_streak")
         embed = discord.Embed(title=f"【{season_name}】連勝数ランキング", color=discord.Color.red())
         await self.send_ranking_embed(embed, ranking, interaction, "win_streak")
 
     async def send_ranking_embed(self, embed, ranking, interaction, ranking_type):
-        """ランキングをEmbedで表示し、25人ずつ送信する"""
-        messages = []  # 送信したメッセージを保持
-        for i, record in enumerate(ranking, start=1):
-            user = self.session.query(User).filter_by(id=record.user_id).first()
-            if user:
-                if ranking_type == "rating":
-                    # レートを小数点第3位まで表示
-                    embed.add_field(
-                        name=f"{i}. {user.user_name}",
-                        value=f"レート: {record.rating:.3f}",
-                        inline=False
-                    )
-                elif ranking_type == "win_rate":
-                    win_rate = (record.win_count / record.total_matches) * 100 if record.total_matches > 0 else 0
-                    embed.add_field(
-                        name=f"{i}. {user.user_name}",
-                        value=f"勝率: {win_rate:.3f}% ({record.total_matches}戦 {record.win_count}勝-{record.loss_count}敗)",
-                        inline=False
-                    )
-                elif ranking_type == "win_streak":
-                    embed.add_field(
-                        name=f"{i}. {user.user_name}",
-                        value=f"連勝数: {record.max_win_streak}",
-                        inline=False
-                    )
-
-            # Embedのフィールドが25個になったら送信
-            if len(embed.fields) == 25:
-                message = await interaction.followup.send(embed=embed, ephemeral=True)
-                messages.append(message)  # 送信したメッセージを保存
-                embed.clear_fields()
-
-        # 残りのフィールドがある場合送信
-        if len(embed.fields) > 0:
-            message = await interaction.followup.send(embed=embed, ephemeral=True)
-            messages.append(message)
-
-        # 5分後にすべてのメッセージを削除
-        await asyncio.sleep(300)
-        for msg in messages:
-            try:
-                await msg.delete()  # メッセージが存在するか確認してから削除
-            except discord.errors.NotFound:
-                pass  # メッセージが見つからない場合は無視
-
+        """ランキングを25人ずつのページに分け、1つのメッセージでページ送りして表示する"""
+        own_index = find_rank_index(ranking, interaction.user.id, lambda row: row[2])
+        paginator = RankingPaginator(
+            embed.title, embed.color, ranking,
+            functools.partial(past_ranking_field, ranking_type=ranking_type), own_index
+        )
+        await paginator.send(interaction)
+
+
+def past_ranking_field(i, row, ranking_type):
+    """過去シーズンのランキングの i 位のフィールド（名前, 値）"""
+    record, user_name = row[:2]
+    if ranking_type == "rating":
+        # レートを小数点第3位まで表示
+        return f"{i}. {user_name}", f"レート: {record.rating:.3f}"
+    elif ranking_type == "win_rate":
+        win_rate = (record.win_count / record.total_matches) * 100 if record.total_matches > 0 else 0
+        return f"{i}. {user_name}", f"勝率: {win_rate:.3f}% ({record.total_matches}戦 {record.win_count}勝-{record.loss_count}敗)"
+    elif ranking_type == "win_streak":
+        return f"{i}. {user_name}", f"連勝数: {record.max_win_streak}"
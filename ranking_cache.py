@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from data_access import run_db, get_current_season
+from leaderboard import leaderboard, win_rate
+
+
+def _current_season_name(session):
+    current_season = get_current_season(session)
+    return current_season.season_name if current_season else None
+
+
+def _top(ranking_type):
+    """ランキングの種類ごとの表示データ（ranking.ranking_field の形式）"""
+    if ranking_type == "win_streak":
+        return leaderboard.top("win_streak", 100)
+    elif ranking_type == "win_rate":
+        return [(entry, win_rate(entry), entry.win_count, entry.loss_count) for entry in leaderboard.top("win_rate", 16)]
+    elif ranking_type == "rating":
+        return [(entry.user_name, entry.effective_rating, entry.rating, entry.stayed_rating) for entry in leaderboard.top("rating", 100)]
+
+
+class RankingCache:
+    """
+    ランキング表示用のデータ（シーズン名と上位の一覧）をプロセス全体で共有するキャッシュ。
+    有効期限ではなく leaderboard.version（試合の精算などで進む）と invalidate() の世代で古さを判定する。
+    - 最新のもの: そのまま返す（ヒット）
+    - 古いもの: 古いまますぐに返し、裏で作り直す
+    - まだないもの: 作り直しを待つ（ミス）
+    作り直しは種類ごとに同時に1つだけ行い、重なった要求は同じ結果を使う。
+    """
+    def __init__(self):
+        self._entries = {}  # 種類 -> (作ったときのバージョン, (シーズン名, データ))
+        self._refreshing = {}  # 種類 -> 作り直しのタスク
+        self._generation = 0
+        self.hit_count = 0
+        self.stale_count = 0
+        self.miss_count = 0
+        self.refresh_count = 0
+
+    def _version(self):
+        return leaderboard.version, self._generation
+
+    def invalidate(self):
+        """ランキング以外の表示内容（シーズン名）が変わったときに呼ぶ"""
+        self._generation += 1
+
+    async def get(self, ranking_type, allow_stale=True):
+        """
+        (シーズン名, ランキングのデータ) を返す。内容が変わるまでは同じオブジェクトを返す
+        :param allow_stale: False の場合は古いデータを返さず、作り直しを待つ
+        """
+        entry = self._entries.get(ranking_type)
+        if entry is not None and entry[0] == self._version():
+            self.hit_count += 1
+            return entry[1]
+        refresh = self._refresh(ranking_type)
+        if entry is not None and allow_stale:
+            self.stale_count += 1
+            return entry[1]
+        self.miss_count += 1
+        return await asyncio.shield(refresh)
+
+    def _refresh(self, ranking_type):
+        task = self._refreshing.get(ranking_type)
+        if task is None or task.done():
+            task = self._refreshing[ranking_type] = asyncio.create_task(self._build(ranking_type))
+            task.add_done_callback(self._log_error)
+        return task
+
+    async def _build(self, ranking_type):
+        self.refresh_count += 1
+        await leaderboard.ensure_loaded()
+        # シーズン名の取得中に更新された場合は、次の要求で作り直されるよう取得前のバージョンで保存する
+        version = self._version()
+        season_name = await run_db(_current_season_name)
+        value = (season_name, _top(ranking_type))
+        self._entries[ranking_type] = (version, value)
+        return value
+
+    @staticmethod
+    def _log_error(task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Failed to refresh ranking cache: {task.exception()}")
+
+
+# Bot 全体で共有するランキングのキャッシュ
+ranking_cache = RankingCache()
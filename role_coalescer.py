@@ -0,0 +1,99 @@
+import os
+import time
+import asyncio
+import logging
+from dotenv import load_dotenv
+
+from api_scheduler import api_scheduler, PRIORITY_MATCH
+
+load_dotenv()
+
+# ロールの変更依頼をまとめるために待つ時間（秒）
+ROLE_COALESCE_WINDOW = float(os.getenv('ROLE_COALESCE_MS', 100)) / 1000
+# 反映したロールの状態を、ゲートウェイのキャッシュより優先して使う時間（秒）
+ROLE_STATE_TTL = 5
+
+
+class RoleCoalescer:
+    """
+    メンバーごとにロールの追加・削除の依頼を短い時間まとめ、ロールごとに最後の依頼だけを反映する。
+    反映は add_roles / remove_roles で変更するロールだけに行い、他のロール（運営や他の Bot が同時に変更したものなど）には触れない。
+    既に依頼どおりの状態のロール（既に持っている、追加と削除が打ち消し合ったなど）にはリクエストを送らない。
+    同じメンバーの反映は依頼順に1つずつ行い、直前に反映したロールの状態をしばらくの間はキャッシュより優先する
+    （ゲートウェイからのメンバー更新が届く前に、古いキャッシュを元に判断しないため）。
+    """
+    def __init__(self, window=ROLE_COALESCE_WINDOW):
+        self.window = window
+        self._pending = {}  # Discord ID -> (Member, {Role: 追加なら True}, [Future])
+        self._flushing = {}  # Discord ID -> 最後に開始した反映タスク
+        self._applied = {}  # Discord ID -> ({Role: 直前に反映した状態（持っていれば True）}, 反映した時刻)
+        self.request_count = 0
+        self.edit_count = 0
+        self.skipped_count = 0
+
+    async def change(self, member, role, add):
+        """member の role を追加（add=True）または削除し、反映されるまで待つ"""
+        self.request_count += 1
+        entry = self._pending.get(member.id)
+        if entry is None:
+            entry = self._pending[member.id] = (member, {}, [])
+            previous = self._flushing.get(member.id)
+            self._flushing[member.id] = asyncio.create_task(self._flush(member.id, previous))
+        entry[1][role] = add
+        future = asyncio.get_running_loop().create_future()
+        entry[2].append(future)
+        await future
+
+    async def _flush(self, member_id, previous):
+        await asyncio.sleep(self.window)
+        if previous is not None:
+            await asyncio.wait([previous])
+        member, changes, futures = self._pending.pop(member_id)
+        now = time.monotonic()
+        self._applied = {key: value for key, value in self._applied.items() if now - value[1] < ROLE_STATE_TTL}
+        try:
+            cached = member.guild.get_member(member_id) or member
+            applied = self._applied.get(member_id, ({},))[0]
+
+            def has_role(role):
+                return applied[role] if role in applied else role in cached.roles
+
+            adds = [role for role, add in changes.items() if add and not has_role(role)]
+            removes = [role for role, add in changes.items() if not add and has_role(role)]
+            if not adds and not removes:
+                self.skipped_count += 1
+                logging.info(f"{member.display_name} のロールは変更不要のため、リクエストを省略しました。")
+            else:
+                if adds:
+                    await api_scheduler.call(
+                        ('member_roles', member.guild.id),
+                        lambda: cached.add_roles(*adds),
+                        priority=PRIORITY_MATCH,
+                        description=f"Adding roles to {member.display_name}"
+                    )
+                    self.edit_count += 1
+                if removes:
+                    await api_scheduler.call(
+                        ('member_roles', member.guild.id),
+                        lambda: cached.remove_roles(*removes),
+                        priority=PRIORITY_MATCH,
+                        description=f"Removing roles from {member.display_name}"
+                    )
+                    self.edit_count += 1
+                self._applied[member_id] = ({**applied, **changes}, time.monotonic())
+                logging.info(f"{member.display_name} のロールを変更しました: " + ", ".join(
+                    [f"+{role.name}" for role in adds] + [f"-{role.name}" for role in removes]))
+            for future in futures:
+                if not future.done():
+                    future.set_result(None)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            if self._flushing.get(member_id) is asyncio.current_task():
+                del self._flushing[member_id]
+
+
+# Bot 全体で共有するロール変更の取りまとめ
+role_coalescer = RoleCoalescer()
@@ -0,0 +1,108 @@
+from datetime import datetime
+from sqlalchemy import text
+from data_access import get_latest_season
+
+
+# シーズン集計用の一時テーブル。最新シーズンでマッチングしたユーザーの最終レートと順位を1回の走査で求める
+# final_rating: Stay 前のレートと現在のレートの高い方
+# overwrite:    user_season_record の成績を書き換えるか（Stay 中は現在のレートが Stay 時のレートを上回った場合のみ）
+# record_rating: 書き換える場合に保存するレート
+_CREATE_SEASON_TOTALS = '''
+CREATE TEMP TABLE season_totals AS
+SELECT
+    id AS user_id,
+    win_count,
+    loss_count,
+    total_matches,
+    max_win_streak,
+    final_rating,
+    RANK() OVER (ORDER BY final_rating DESC) AS rank,
+    CASE WHEN stay_flag = 1 THEN COALESCE(rating > stayed_rating, 0) ELSE 1 END AS overwrite,
+    CASE WHEN stay_flag = 1 THEN rating ELSE final_rating END AS record_rating
+FROM (
+    SELECT *, MAX(rating, COALESCE(stayed_rating, 0)) AS final_rating
+    FROM user
+    WHERE latest_season_matched = 1
+)
+'''
+
+# 順位は Stay 中かどうかに関わらず、既存のレコード全てに反映する
+_UPDATE_RANKS = '''
+UPDATE user_season_record
+SET rank = (SELECT t.rank FROM season_totals AS t WHERE t.user_id = user_season_record.user_id)
+WHERE season_id = :season_id
+  AND user_id IN (SELECT user_id FROM season_totals)
+'''
+
+_UPDATE_RECORDS = '''
+UPDATE user_season_record
+SET (rating, win_count, loss_count, total_matches, max_win_streak) = (
+    SELECT t.record_rating, t.win_count, t.loss_count, t.total_matches, t.max_win_streak
+    FROM season_totals AS t
+    WHERE t.user_id = user_season_record.user_id
+)
+WHERE season_id = :season_id
+  AND user_id IN (SELECT user_id FROM season_totals WHERE overwrite = 1)
+'''
+
+_INSERT_RECORDS = '''
+INSERT INTO user_season_record (user_id, season_id, rating, rank, win_count, loss_count, total_matches, max_win_streak)
+SELECT t.user_id, :season_id, t.record_rating, t.rank, t.win_count, t.loss_count, t.total_matches, t.max_win_streak
+FROM season_totals AS t
+WHERE t.overwrite = 1
+  AND NOT EXISTS (
+      SELECT 1 FROM user_season_record AS r
+      WHERE r.user_id = t.user_id AND r.season_id = :season_id
+  )
+'''
+
+# 全ユーザーのレートやポイントをリセット（trust_points は1増やす、最大100）
+_RESET_USERS = '''
+UPDATE user
+SET rating = 1500,
+    latest_season_matched = 0,
+    trust_points = CASE WHEN trust_points < 100 THEN trust_points + 1 ELSE trust_points END,
+    stayed_rating = NULL,
+    total_matches = 0,
+    win_streak = 0,
+    max_win_streak = 0,
+    win_count = 0,
+    loss_count = 0,
+    stay_flag = 0
+'''
+
+
+def totalize_season(session, season_id):
+    """シーズン終了時に全ユーザーのシーズン統計を user_season_record に保存"""
+    session.execute(text('DROP TABLE IF EXISTS temp.season_totals'))
+    session.execute(text(_CREATE_SEASON_TOTALS))
+    try:
+        params = {'season_id': season_id}
+        session.execute(text(_UPDATE_RANKS), params)
+        session.execute(text(_UPDATE_RECORDS), params)
+        session.execute(text(_INSERT_RECORDS), params)
+    finally:
+        session.execute(text('DROP TABLE IF EXISTS temp.season_totals'))
+
+
+def reset_users(session):
+    """次のシーズンに向けて全ユーザーの成績をリセット"""
+    session.execute(text(_RESET_USERS))
+
+
+def roll_over_season(session):
+    """
+    開催中のシーズンを終了し、集計とユーザーのリセットを1トランザクションで行います。
+    :return: 終了したシーズン（終了できるシーズンがない場合は None）
+    """
+    last_season = get_latest_season(session)
+    if not last_season or last_season.end_date is not None:
+        return None
+
+    # シーズンを終了
+    last_season.end_date = datetime.now()
+    session.flush()
+
+    totalize_season(session, last_season.id)
+    reset_users(session)
+    return last_season
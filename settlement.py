@@ -0,0 +1,144 @@
+from collections import namedtuple
+from datetime import datetime
+from data_access import User, MatchHistory, PlayerMatch
+from class_stats import record_class_result
+from pending_match import delete_pending_match
+
+
+# 1プレイヤー分の精算結果（user は run_db 終了後も参照できる切り離されたインスタンス）
+PlayerSettlement = namedtuple('PlayerSettlement', ['user', 'rating_before', 'rating_after', 'rating_change'])
+
+
+def calculate_rating_change(player_rating, opponent_rating, player_wins, opponent_wins):
+    """
+    レートの増減を計算します。
+    :param player_rating: 自分のレート
+    :param opponent_rating: 相手のレート
+    :param player_wins: 自分の勝利数（0, 1, 2）
+    :param opponent_wins: 相手の勝利数（0, 1, 2）
+    :return: レートの増減量
+    """
+    base_change = 20  # 基本のレート増減量
+    rating_diff = player_rating - opponent_rating
+    increment_per_win = 0.025 * abs(rating_diff)  # レート差に基づく増分
+
+    if player_rating > opponent_rating:
+        if player_wins > opponent_wins:
+            rating_change = base_change - increment_per_win
+        else:
+            rating_change = -(base_change + increment_per_win)
+    else:
+        if player_wins > opponent_wins:
+            rating_change = base_change + increment_per_win
+        else:
+            rating_change = -(base_change - increment_per_win)
+
+    return rating_change
+
+
+def settle_match(session, player1_discord_id, player2_discord_id, player1_wins, player2_wins, season_id, season_name, player1_classes, player2_classes):
+    """
+    1試合分の結果を1トランザクションで反映し、両プレイヤーの精算結果を返します。
+    レート・勝敗数・連勝数・最新シーズンのマッチングフラグの更新と対戦履歴の追加をまとめて行うため、
+    run_db から呼び出せばコミットは1回で、途中で失敗した場合は全てロールバックされます。
+    :param player1_classes: プレイヤー1の使用クラス (class_a, class_b)
+    :param player2_classes: プレイヤー2の使用クラス (class_a, class_b)
+    :return: (プレイヤー1の PlayerSettlement, プレイヤー2の PlayerSettlement)
+    """
+    # 両プレイヤーを1回のクエリで取得
+    users = session.query(User).filter(User.discord_id.in_([str(player1_discord_id), str(player2_discord_id)])).all()
+    users_by_discord_id = {user.discord_id: user for user in users}
+    user1 = users_by_discord_id.get(str(player1_discord_id))
+    user2 = users_by_discord_id.get(str(player2_discord_id))
+    if not user1 or not user2:
+        raise ValueError("One or both players not found in the database.")
+
+    # レーティング変動を計算して更新
+    user1_rating_before = user1.rating
+    user2_rating_before = user2.rating
+    user1_rating_change = calculate_rating_change(user1_rating_before, user2_rating_before, player1_wins, player2_wins)
+    user2_rating_change = calculate_rating_change(user2_rating_before, user1_rating_before, player2_wins, player1_wins)
+    user1.rating += user1_rating_change
+    user2.rating += user2_rating_change
+
+    if user1_rating_change > user2_rating_change:
+        winner, loser = user1, user2
+    else:
+        winner, loser = user2, user1
+
+    # 試合数・勝敗数・連勝数を更新
+    for user in (user1, user2):
+        user.total_matches += 1
+        # 最新シーズンでマッチングしたフラグをオンにする
+        user.latest_season_matched = True
+    winner.win_count += 1
+    loser.loss_count += 1
+    winner_change = user1_rating_change if winner is user1 else user2_rating_change
+    loser_change = user2_rating_change if winner is user1 else user1_rating_change
+    if winner_change > 0 and loser_change < 0:
+        winner.win_streak += 1
+        if winner.win_streak > winner.max_win_streak:
+            winner.max_win_streak = winner.win_streak
+        loser.win_streak = 0
+
+    # match_history テーブルにデータを挿入
+    match_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    user1_class_a, user1_class_b = player1_classes
+    user2_class_a, user2_class_b = player2_classes
+    new_match = MatchHistory(
+        user1_id=user1.id,
+        user2_id=user2.id,
+        match_date=match_date,
+        season_id=season_id,
+        season_name=season_name,
+        user1_class_a=user1_class_a,
+        user1_class_b=user1_class_b,
+        user2_class_a=user2_class_a,
+        user2_class_b=user2_class_b,
+        user1_rating_change=user1_rating_change,
+        user2_rating_change=user2_rating_change,
+        winner_user_id=winner.id,
+        loser_user_id=loser.id
+    )
+    session.add(new_match)
+
+    # プレイヤー視点の対戦履歴を両者分追加
+    session.flush()  # new_match.id を確定させる
+    for player, opponent, class_a, class_b, opponent_class_a, opponent_class_b, rating_change in (
+        (user1, user2, user1_class_a, user1_class_b, user2_class_a, user2_class_b, user1_rating_change),
+        (user2, user1, user2_class_a, user2_class_b, user1_class_a, user1_class_b, user2_rating_change),
+    ):
+        session.add(PlayerMatch(
+            match_history_id=new_match.id,
+            user_id=player.id,
+            season_id=season_id,
+            season_name=season_name,
+            match_date=match_date,
+            opponent_id=opponent.id,
+            class_a=class_a,
+            class_b=class_b,
+            opponent_class_a=opponent_class_a,
+            opponent_class_b=opponent_class_b,
+            rating_change=rating_change,
+            rating_after=player.rating,
+            won=player is winner
+        ))
+        # クラス別戦績の集計を更新
+        record_class_result(session, player.id, season_id, class_a, class_b, player is winner)
+
+    return (
+        PlayerSettlement(user1, user1_rating_before, user1.rating, user1_rating_change),
+        PlayerSettlement(user2, user2_rating_before, user2.rating, user2_rating_change),
+    )
+
+
+def settle_pending_match(session, thread_id, *args):
+    """
+    進行中の試合（pending_match）を削除し、同じトランザクションで settle_match を行います。
+    pending_match の行が既にない場合は精算済みとみなし、何もせず None を返します。
+    報告の同時押しや期限切れとの競合、再起動後の復元でも、1試合を二重に精算しないようにするためです。
+    :param args: settle_match の player1_discord_id 以降の引数
+    """
+    if not delete_pending_match(session, thread_id):
+        return None
+    return settle_match(session, *args)
@@ -1,21 +1,40 @@
+import time
+# 起動時間の計測用（モジュールの読み込み時間も含める）
+startup_started_at = time.perf_counter()
+
 import discord
 from discord.ext import commands, tasks
 from discord.ui import Button, View, Select
 import asyncio
-from asyncio import Queue, Semaphore
+import functools
+from asyncio import Queue
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine, Column, Integer, String, desc
-from sqlalchemy.ext.automap import automap_base
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import Session
-from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy import Column, Integer, String
 import logging
-from win_record import WinRecord, CurrentSeasonRecordView, PastSeasonRecordView, Last50RecordView, session
-from ranking import RankingView, RankingButtonView  # ranking.py をインポート
+from data_access import (
+    User, Season, UserSeasonRecord,
+    run_db, db_executor, get_user_by_discord_id, get_latest_season, get_current_season
+)
+from settlement import settle_match, settle_pending_match
+from season_rollover import roll_over_season
+from archive import archive_season
+from matchmaking import WaitingPool, MATCHMAKING_COALESCE_WINDOW, MATCH_PIPELINE_WORKERS, match_latency
+from pipeline import OrderedWorkerPool
+from api_scheduler import api_scheduler, PRIORITY_MATCH, PRIORITY_BACKGROUND
+from role_coalescer import role_coalescer
+from timer_wheel import TimerWheel
+from message_deleter import message_deleter
+from leaderboard import leaderboard
+from ranking_cache import ranking_cache
+from pending_match import (
+    save_pending_match, update_pending_match, delete_pending_match, load_pending_matches,
+    STATUS_CANCEL_REQUESTED, RESULT_TIMEOUT, CANCEL_ACCEPT_TIMEOUT
+)
+from win_record import WinRecord, CurrentSeasonRecordView, PastSeasonRecordView, Last50RecordView
+from ranking import RankingView, RankingButtonView, ranking_publisher  # ranking.py をインポート
 import atexit
 from dotenv import load_dotenv
 import os
-import heapq
 from collections import defaultdict
 from datetime import datetime, timedelta
 import unicodedata
@@ -24,8 +43,6 @@ import traceback
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
-
-api_call_semaphore = Semaphore(5)  # 一度に処理できるリクエスト数を制限
 request_queue = Queue()
 load_dotenv()
 bot_token = os.getenv('TOKEN')
@@ -45,12 +62,6 @@ BATTLE_CHANNEL_ID = 1275436900055912508
 # Battleガイドの文章を常に表示する
 BATTLE_GUIDE_TEXT = "「トラブルの際は、必ず対戦相手とのチャットでコミュニケーションを取って下さい。細かいルールは「battle-guide」を参照して下さい。」"
 
-# データベースの設定
-db_path = 'db/shadowverse_bridge.db'
-engine = create_engine(f'sqlite:///{db_path}', echo=False)
-# 自動マッピング用のベースクラスの準備
-Base = automap_base()
-
 # ログ設定
 logging.basicConfig(
     level=logging.INFO,  # 開発中はDEBUG、本番ではINFOに変更
@@ -61,202 +72,76 @@ logging.basicConfig(
     ]
 )
 
-# データベース内のテーブルをすべて反映
-Base.prepare(engine, reflect=True)
-
-# マッピングされたクラスの取得
-User = Base.classes.user  # テーブル名が 'user' だと仮定
-Class = Base.classes.deck_class
-MatchHistory = Base.classes.match_history  # テーブル名が 'match_history' だと仮定
-Season = Base.classes.season  # テーブル名が 'season' だと仮定
-UserSeasonRecord = Base.classes.user_season_record
-# 他のテーブルも同様にマッピングできます)
-session = Session(engine)
-
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 bot = commands.Bot(command_prefix='!', intents=intents)
 
 current_season_name = None
-
-valid_classes = [cls.class_name for cls in session.query(Class.class_name).all()]
-
-SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+current_season_id = None
 
 # 安全にスレッドを作成する関数
 async def safe_create_thread(channel, user1, user2):
-    retries = 5
-    for attempt in range(retries):
-        try:
-            async with api_call_semaphore:
-                game_thread = await channel.create_thread(
-                    name=f"{user1.display_name}_vs_{user2.display_name}",
-                    type=discord.ChannelType.private_thread,
-                    invitable=False
-                )
-            return game_thread
-        except discord.HTTPException as e:
-            if e.status == 429:
-                retry_after = getattr(e, 'retry_after', None)
-                if retry_after is None:
-                    retry_after = 5  # デフォルトの待機時間（秒）
-                else:
-                    retry_after += 1  # バッファを追加
-                logging.warning(f"Rate limited while creating thread. Retrying after {retry_after} seconds.")
-                await asyncio.sleep(retry_after)
-            else:
-                logging.error(f"Thread creation failed: {e}")
-                if attempt < retries - 1:
-                    await asyncio.sleep(2 ** attempt)
-                else:
-                    raise  # 最大リトライ回数を超えた場合は例外を再スロー
+    return await api_scheduler.call(
+        ('thread_create', channel.id),
+        lambda: channel.create_thread(
+            name=f"{user1.display_name}_vs_{user2.display_name}",
+            type=discord.ChannelType.private_thread,
+            invitable=False
+        ),
+        priority=PRIORITY_MATCH,
+        description="Thread creation"
+    )
 
 # 安全にユーザーをスレッドに追加する関数
 async def safe_add_user_to_thread(thread, user):
-    retries = 5
-    for attempt in range(retries):
-        try:
-            async with api_call_semaphore:
-                await thread.add_user(user)
-            return
-        except discord.HTTPException as e:
-            if e.status == 429:
-                retry_after = getattr(e, 'retry_after', None)
-                if retry_after is None:
-                    retry_after = 5  # デフォルトの待機時間（秒）
-                else:
-                    retry_after += 1  # バッファを追加
-                logging.warning(f"Rate limited while adding user to thread. Retrying after {retry_after} seconds.")
-                await asyncio.sleep(retry_after)
-            else:
-                logging.error(f"Failed to add user {user.display_name} to thread: {e}")
-                if attempt < retries - 1:
-                    await asyncio.sleep(2 ** attempt)
-                else:
-                    raise
+    await api_scheduler.call(
+        ('thread_member', thread.id),
+        lambda: thread.add_user(user),
+        priority=PRIORITY_MATCH,
+        description=f"Adding user {user.display_name} to thread"
+    )
 
 
 # 安全にメッセージを送信する関数
-async def safe_send_message(channel, content, **kwargs):
-    retries = 5
-    for attempt in range(retries):
-        try:
-            async with api_call_semaphore:
-                await channel.send(content, **kwargs)
-            return  # 成功した場合は関数を終了
-        except discord.HTTPException as e:
-            if e.status == 429:
-                retry_after = getattr(e, 'retry_after', None)
-                if retry_after is None:
-                    retry_after = 5  # デフォルトの待機時間（秒）
-                else:
-                    retry_after = retry_after + 1  # バッファを追加
-                logging.warning(f"Rate limited. Retrying after {retry_after} seconds.")
-                await asyncio.sleep(retry_after)
-            else:
-                logging.error(f"Failed to send message: {e}")
-                if attempt < retries - 1:
-                    await asyncio.sleep(2 ** attempt)  # エクスポネンシャルバックオフ
-                else:
-                    raise  # 最大リトライ回数を超えた場合は例外を再スロー
+async def safe_send_message(channel, content, priority=PRIORITY_MATCH, **kwargs):
+    return await api_scheduler.call(
+        ('message', channel.id),
+        lambda: channel.send(content, **kwargs),
+        priority=priority,
+        description="Sending message"
+    )
 
 
 # 安全にロールを追加する関数
 async def assign_role(user: discord.Member, role_name: str):
-    """ユーザーに特定のロールを安全に付与します。"""
-    retries = 5
-    for attempt in range(retries):
-        try:
-            role = discord.utils.get(user.guild.roles, name=role_name)
-            if role and role not in user.roles:
-                async with api_call_semaphore:
-                    await user.add_roles(role)
-                    logging.info(f"ロール {role_name} を {user.display_name} に付与しました。")
-            else:
-                logging.info(f"ロール {role_name} が見つからないか、{user.display_name} は既にそのロールを持っています。")
-            return
-        except discord.HTTPException as e:
-            if e.status == 429:
-                retry_after = getattr(e, 'retry_after', None)
-                if retry_after is None:
-                    retry_after = 5  # デフォルトの待機時間（秒）
-                else:
-                    retry_after += 1  # バッファを追加
-                logging.warning(f"Rate limited while assigning role. Retrying after {retry_after} seconds.")
-                await asyncio.sleep(retry_after)
-            else:
-                logging.error(f"Failed to assign role {role_name} to {user.display_name}: {e}")
-                if attempt < retries - 1:
-                    await asyncio.sleep(2 ** attempt)  # 指数バックオフ
-                else:
-                    raise
+    """ユーザーに特定のロールを安全に付与します（同じユーザーへの変更はまとめて反映）。"""
+    role = discord.utils.get(user.guild.roles, name=role_name)
+    if role:
+        await role_coalescer.change(user, role, True)
+    else:
+        logging.info(f"ロール {role_name} が見つかりません。")
 
 
 # 安全にロールを削除する関数
 async def remove_role(user: discord.Member, role_name: str):
-    """ユーザーから特定のロールを安全に削除します。"""
-    retries = 5
-    for attempt in range(retries):
-        try:
-            role = discord.utils.get(user.guild.roles, name=role_name)
-            if role and role in user.roles:
-                async with api_call_semaphore:
-                    await user.remove_roles(role)
-                    logging.info(f"ロール {role_name} を {user.display_name} から削除しました。")
-            else:
-                logging.info(f"ロール {role_name} が見つからないか、{user.display_name} はそのロールを持っていません。")
-            return
-        except discord.HTTPException as e:
-            if e.status == 429:
-                retry_after = getattr(e, 'retry_after', None)
-                if retry_after is None:
-                    retry_after = 5  # デフォルトの待機時間（秒）
-                else:
-                    retry_after += 1  # バッファを追加
-                logging.warning(f"Rate limited while removing role. Retrying after {retry_after} seconds.")
-                await asyncio.sleep(retry_after)
-            else:
-                logging.error(f"Failed to remove role {role_name} from {user.display_name}: {e}")
-                if attempt < retries - 1:
-                    await asyncio.sleep(2 ** attempt)  # 指数バックオフ
-                else:
-                    raise
-
-
-def calculate_rating_change(player_rating, opponent_rating, player_wins, opponent_wins):
-    """
-    レートの増減を計算します。
-    :param player_rating: 自分のレート
-    :param opponent_rating: 相手のレート
-    :param player_wins: 自分の勝利数（0, 1, 2）
-    :param opponent_wins: 相手の勝利数（0, 1, 2）
-    :return: レートの増減量
-    """
-    base_change = 20  # 基本のレート増減量
-    rating_diff = player_rating - opponent_rating
-    increment_per_win = 0.025 * abs(rating_diff)  # レート差に基づく増分
-
-    if player_rating > opponent_rating:
-        if player_wins > opponent_wins:
-            rating_change = base_change - increment_per_win
-        else:
-            rating_change = -(base_change + increment_per_win)
+    """ユーザーから特定のロールを安全に削除します（同じユーザーへの変更はまとめて反映）。"""
+    role = discord.utils.get(user.guild.roles, name=role_name)
+    if role:
+        await role_coalescer.change(user, role, False)
     else:
-        if player_wins > opponent_wins:
-            rating_change = base_change + increment_per_win
-        else:
-            rating_change = -(base_change - increment_per_win)
+        logging.info(f"ロール {role_name} が見つかりません。")
 
-    return rating_change
 
-def update_current_season_name():
-    global current_season_name
-    latest_season = session.query(Season).filter(Season.end_date == None).order_by(desc(Season.id)).first()
+async def update_current_season_name():
+    global current_season_name, current_season_id
+    latest_season = await run_db(get_current_season)
     if latest_season:
         current_season_name = latest_season.season_name
+        current_season_id = latest_season.id
     else:
         current_season_name = None
+        current_season_id = None
 
 class RegisterView(View):
     def __init__(self):
@@ -282,40 +167,45 @@ class RegisterButton(Button):
 
 waiting_list = []
 active_result_views = {}
+# 結果入力・中止回答の期限（試合ごとにスリープするタスクを作らず、1つのタスクでまとめて処理する）
+match_timers = TimerWheel("match_timers")
 
 class CancelConfirmationView(discord.ui.View):
-    def __init__(self, user1, user2, thread):
+    def __init__(self, user1, user2, thread, deadline=None):
         super().__init__(timeout=None)
         self.user1 = user1  # キャンセルを提案したユーザー
         self.user2 = user2  # 対戦相手
         self.thread = thread
-        self.accept_timer_task = asyncio.create_task(self.accept_timer())  # 48時間後に自動的に中止を受け入れ
+        # 48時間後に自動的に中止を受け入れ（再起動後の復元時は保存済みの期限を使う）
+        self.deadline = deadline or time.time() + CANCEL_ACCEPT_TIMEOUT
+        match_timers.schedule(('cancel', thread.id), self.deadline, self.accept_timer)
 
-    @discord.ui.button(label="はい", style=discord.ButtonStyle.success)
+    @discord.ui.button(label="はい", style=discord.ButtonStyle.success, custom_id="cancel_confirm:yes")
     async def yes_button(self, button: discord.ui.Button, interaction: discord.Interaction):
         if interaction.user.id == self.user2.id:
             # インタラクションにエフェメラルな応答を返す
             await interaction.response.send_message("回答が完了しました。次の試合を開始できます。", ephemeral=True)
 
-            self.accept_timer_task.cancel()  # タイマータスクをキャンセル
+            match_timers.cancel(('cancel', self.thread.id))  # タイマーをキャンセル
             await self.increment_cancelled_count(self.user1, self.user2)
             await self.thread.send(f"{interaction.user.mention} が中止を受け入れ、対戦が無効になりました。このスレッドを削除します。")
             await remove_role(self.user2, "試合中")  # ロールを削除
 
-            # active_result_viewsから削除
+            # active_result_viewsと保存した試合の状態を削除
             if self.thread.id in active_result_views:
                 del active_result_views[self.thread.id]
+            await run_db(delete_pending_match, self.thread.id)
 
             await asyncio.sleep(6)
             await self.thread.delete()
         else:
             await interaction.response.send_message("対戦相手のみがこのボタンを使用できます。", ephemeral=True)
 
-    @discord.ui.button(label="いいえ", style=discord.ButtonStyle.danger)
+    @discord.ui.button(label="いいえ", style=discord.ButtonStyle.danger, custom_id="cancel_confirm:no")
     async def no_button(self, button: discord.ui.Button, interaction: discord.Interaction):
         if interaction.user.id == self.user2.id:
             # インタラクションにエフェメラルな応答を返す
-            self.accept_timer_task.cancel()  # タイマータスクをキャンセル
+            match_timers.cancel(('cancel', self.thread.id))  # タイマーをキャンセル
             await remove_role(self.user2, "試合中")  # ロールを削除
             await interaction.response.send_message("回答が完了しました。次の試合を開始できます。", ephemeral=True)
 
@@ -323,31 +213,34 @@ class CancelConfirmationView(discord.ui.View):
             staff_role = discord.utils.get(interaction.guild.roles, name="staff")
             await self.thread.send(f"{staff_role.mention}")
 
-            # active_result_viewsから削除
+            # active_result_viewsと保存した試合の状態を削除（以降はスタッフが対応する）
             if self.thread.id in active_result_views:
                 del active_result_views[self.thread.id]
+            await run_db(delete_pending_match, self.thread.id)
         else:
             await interaction.response.send_message("対戦相手のみがこのボタンを使用できます。", ephemeral=True)
 
     async def increment_cancelled_count(self, user1, user2):
         # データベースでキャンセル回数を増加
-        user1_db = session.query(User).filter_by(discord_id=str(user1.id)).first()
-        user2_db = session.query(User).filter_by(discord_id=str(user2.id)).first()
-        if user1_db and user2_db:
-            user1_db.cancelled_matches_count += 1
-            user2_db.cancelled_matches_count += 1
-            session.commit()
+        def increment(session):
+            user1_db = get_user_by_discord_id(session, user1.id)
+            user2_db = get_user_by_discord_id(session, user2.id)
+            if user1_db and user2_db:
+                user1_db.cancelled_matches_count += 1
+                user2_db.cancelled_matches_count += 1
+
+        await run_db(increment)
 
     async def accept_timer(self):
-        # 48時間後に自動的に「はい」とみなす
-        await asyncio.sleep(48 * 60 * 60)  # 48時間待機
+        # 48時間後に自動的に「はい」とみなす（match_timers から期限に呼び出される）
         await self.thread.send(f"48時間が経過しました。{self.user2.mention} が応答しなかったため、対戦中止を受け入れたとみなします。このスレッドを削除します。")
         await self.increment_cancelled_count(self.user1, self.user2)
         await remove_role(self.user2, "試合中")  # ロールを削除
 
-        # active_result_viewsから削除
+        # active_result_viewsと保存した試合の状態を削除
         if self.thread.id in active_result_views:
             del active_result_views[self.thread.id]
+        await run_db(delete_pending_match, self.thread.id)
 
         await asyncio.sleep(6)
         await self.thread.delete()
@@ -367,7 +260,7 @@ async def cancel(ctx: discord.ApplicationContext):
             # 試合中ロールを削除
             await remove_role(user1, "試合中")
 
-            # ResultViewのタイマータスクをキャンセル
+            # ResultViewのタイマーをキャンセル
             result_view.cancel_timeout()
 
             # 対戦相手を取得
@@ -379,9 +272,16 @@ async def cancel(ctx: discord.ApplicationContext):
             # エフェメラルな応答を返して「考え中」の表示を消す
             await ctx.respond(f"対戦中止のリクエストを送信しました。{user1.mention}は次の試合を開始できます。", ephemeral=True)
 
-            await ctx.channel.send(
+            cancel_view = CancelConfirmationView(user1, user2, ctx.channel)
+            message = await ctx.channel.send(
                 f"{user1.mention}により対戦が中止されました。{user2.mention}は中止を受け入れるか回答してください。回答するまで次の試合を開始することはできません。問題がない場合は「はい」を押してください。問題がある場合は「いいえ」を押してスタッフに説明してください。回答期限は48時間です。",
-                view=CancelConfirmationView(user1, user2, ctx.channel)
+                view=cancel_view
+            )
+            # 再起動後も回答のボタンと期限を復元できるよう保存
+            await run_db(
+                update_pending_match, thread_id,
+                status=STATUS_CANCEL_REQUESTED, cancel_requester_id=user1.id,
+                cancel_message_id=message.id, deadline=cancel_view.deadline
             )
         else:
             await ctx.respond("このスレッドでは試合が行われていません。", ephemeral=True)
@@ -409,8 +309,9 @@ async def report(ctx: discord.ApplicationContext):
                 user2 = await ctx.guild.fetch_member(user2_id)
             await remove_role(user2, "試合中")
 
-            # ResultViewのタイマータスクをキャンセル
+            # ResultViewのタイマーをキャンセル
             result_view.cancel_timeout()
+            await result_view.save_state()
 
             # インタラクションにエフェメラルな応答を返して「考え中」の表示を消す
             await ctx.respond("報告を受け付けました。スタッフが対応します。", ephemeral=True)
@@ -447,42 +348,43 @@ class OnlyClassSelect(discord.ui.Select):
         active_role = discord.utils.get(interaction.user.roles, name=role_name)  # ロールオブジェクトを取得
         if active_role:  # 試合中のロールが存在するか確認
             await interaction.response.send_message(f"{interaction.user.mention} 現在試合中のため、クラスを変更できません。", ephemeral=True)
-            await asyncio.sleep(10)
-            await interaction.delete_original_response()
+            message_deleter.delete_original_response_later(interaction, 10)
             return
         if len(selected_classes) != 2:
             await interaction.response.send_message("クラスを2つ選択してください。", ephemeral=True)
-            await asyncio.sleep(10)
-            await interaction.delete_original_response()
+            message_deleter.delete_original_response_later(interaction, 10)
             return
         
-        # データベースでユーザーを検索
-        user_instance = session.query(User).filter_by(discord_id=user_id).first()
-        
+        # データベースでユーザーを検索し、クラス1とクラス2を更新
+        def update_classes(session):
+            user_instance = get_user_by_discord_id(session, user_id)
+            if user_instance:
+                user_instance.class1 = selected_classes[0]
+                user_instance.class2 = selected_classes[1]
+            return user_instance
+
+        user_instance = await run_db(update_classes)
+
         if user_instance:
-            # クラス1とクラス2を更新
-            user_instance.class1 = selected_classes[0]
-            user_instance.class2 = selected_classes[1]
-            session.commit()  # 変更を保存
-            
             await interaction.response.send_message(f"Update selected classes: {', '.join(selected_classes)}", ephemeral=True)
-            await asyncio.sleep(30)
-            await interaction.delete_original_response()
+            message_deleter.delete_original_response_later(interaction, 30)
         else:
             await interaction.response.send_message("ユーザー未登録です。", ephemeral=True)
-            await asyncio.sleep(15)
-            await interaction.delete_original_response()
+            message_deleter.delete_original_response_later(interaction, 15)
 
 
 class MatchmakingView(discord.ui.View):
     def __init__(self):
         super().__init__(timeout=None)
         self.bot = bot  # Store the bot instance
-        self.session = session  # Store the database session
-        self.waiting_queue = []  # 優先度付きキュー (heapq) にユーザーを格納
+        self.waiting_pool = WaitingPool()  # レート順の待機リスト
         self.match_lock = asyncio.Lock()  # ロックの導入
         self.previous_opponents = {}  # 各ユーザーの前回のマッチング相手を記録
-        self.background_task = asyncio.create_task(self.background_match_check())  # 定期的な再評価タスクの開始
+        self.starting_users = set()  # マッチ成立後、ロールの付与が終わるまでのユーザー
+        # マッチ成立後の処理は match_lock の外で並行して行う（同じユーザーの処理は成立順に1つずつ）
+        self.match_pipeline = OrderedWorkerPool(MATCH_PIPELINE_WORKERS, "match_pipeline")
+        self.wakeup = asyncio.Event()  # 待機リストに追加されたらマッチング処理を起こす
+        self.background_task = asyncio.create_task(self.background_match_check())  # マッチング処理タスクの開始
         self.request_queue = asyncio.Queue()  # Request queue for batching
         self.processing_task = asyncio.create_task(self.process_queue())  # Start batch processing
         self.user_interactions = {}
@@ -504,21 +406,21 @@ class MatchmakingView(discord.ui.View):
         user = interaction.user
         await interaction.response.defer(ephemeral=True)
         # ユーザーが登録されているか確認
-        user_data = session.query(User).filter_by(discord_id=user.id).first()
+        user_data = await run_db(get_user_by_discord_id, user.id)
         if not user_data:
             message = await interaction.followup.send(f"{user.mention} ユーザー登録を行ってください。", ephemeral=True)
-            asyncio.create_task(self.delete_messages_after_delay(message))
+            message_deleter.delete_followup_later(interaction, message, 60)
             return
         # シーズン期間中か確認
-        latest_season = session.query(Season).order_by(Season.id.desc()).first()
+        latest_season = await run_db(get_latest_season)
         if latest_season is None or latest_season.start_date is None or latest_season.end_date is not None:
             message = await interaction.followup.send(f"{user.mention} シーズン期間外です。", ephemeral=True)
-            asyncio.create_task(self.delete_messages_after_delay(message))
+            message_deleter.delete_followup_later(interaction, message, 60)
             return
         # クラスが設定されているか確認
         if not user_data.class1 or not user_data.class2:
             message = await interaction.followup.send(f"{user.mention} クラスを選択してください。", ephemeral=True)
-            asyncio.create_task(self.delete_messages_after_delay(message))
+            message_deleter.delete_followup_later(interaction, message, 60)
             return
 
         # "試合中"ロールがあるか確認
@@ -526,7 +428,7 @@ class MatchmakingView(discord.ui.View):
         active_role = discord.utils.get(user.roles, name=role_name)  # ロールオブジェクトを取得
         if active_role:  # 試合中のロールが存在するか確認
             message = await interaction.followup.send(f"{user.mention} 現在試合中のため、マッチング待機リストに入ることができません。", ephemeral=True)
-            asyncio.create_task(self.delete_messages_after_delay(message))
+            message_deleter.delete_followup_later(interaction, message, 60)
             return
 
         # ユーザーのインタラクションを保存
@@ -541,10 +443,10 @@ class MatchmakingView(discord.ui.View):
             delay = random.uniform(0.1, 0.5)
             await asyncio.sleep(delay)
 
-            user_data = self.session.query(User).filter_by(discord_id=user.id).first()
+            user_data = await run_db(get_user_by_discord_id, user.id)
             if not user_data:
                 message = await interaction.followup.send(f"{user.mention} ユーザーデータが見つかりません。", ephemeral=True)
-                asyncio.create_task(self.delete_messages_after_delay(message))
+                message_deleter.delete_followup_later(interaction, message, 60)
                 return
 
             # Retrieve the user's rating from the database
@@ -552,129 +454,110 @@ class MatchmakingView(discord.ui.View):
 
             async with self.match_lock:
                 # 待機リストに既に存在するか確認
-                if any(queued_user.id == user.id for _, _, queued_user in self.waiting_queue):
+                if user.id in self.waiting_pool:
                     message = await interaction.followup.send(f"{user.mention} は既に待機リストにいます。", ephemeral=True)
-                    asyncio.create_task(self.delete_messages_after_delay(message))
+                    message_deleter.delete_followup_later(interaction, message, 60)
                     return
                 # "試合中"ロールがあるか確認
                 role_name = "試合中"
                 active_role = discord.utils.get(user.roles, name=role_name)  # ロールオブジェクトを取得
-                if active_role:  # 試合中のロールが存在するか確認
+                # マッチ成立直後でまだロールが付いていない場合も同じ扱いにする
+                if active_role or user.id in self.starting_users:  # 試合中のロールが存在するか確認
                     logging.info(f"User {user.id} is already have matching role.")
                     return
-                heapq.heappush(self.waiting_queue, (user_rating, user_data.id, user))
-                logging.info(f"User {user.id} added to waiting_queue with rating {user_rating}.")
+                self.waiting_pool.add(user_rating, user_data.id, user)
+                logging.info(f"User {user.id} added to waiting_pool with rating {user_rating}.")
                 message = await interaction.followup.send(f"{user.mention} が待機リストに追加されました。", ephemeral=True)
-                asyncio.create_task(self.delete_messages_after_delay(message))
-                # マッチング処理はバックグラウンドタスクに任せる
-            # Schedule the removal after timeout without blocking
-            asyncio.create_task(self.remove_user_after_timeout(user))
+                message_deleter.delete_followup_later(interaction, message, 60)
+                # マッチング処理はバックグラウンドタスクに任せる（待機期限による削除もそちらで行う）
+                self.wakeup.set()
         except Exception as e:
             logging.error(f"Error in add_to_waiting_list: {e}")
 
-    async def delete_messages_after_delay(self, message):
-        await asyncio.sleep(60)
-        try:
-            await message.delete()
-        except discord.errors.NotFound:
-            pass  # メッセージが既に削除されている場合は無視
-        except discord.errors.Forbidden:
-            pass  # エフェメラルメッセージなど、削除できないメッセージの場合は無視
-        except Exception as e:
-            logging.error(f"Failed to delete message: {e}")
-
-    async def remove_user_after_timeout(self, user):
-        await asyncio.sleep(60)
+    async def remove_expired_users(self):
+        """待機期限を過ぎたユーザーを待機リストから外して通知する"""
         async with self.match_lock:
-            for i, (_, _, queued_user) in enumerate(self.waiting_queue):
-                if queued_user.id == user.id:
-                    del self.waiting_queue[i]
-                    heapq.heapify(self.waiting_queue)  # Reconstruct the queue
-                    # 保存しておいたインタラクションを取得
-                    interaction = self.user_interactions.get(user.id)
-                    if interaction:
-                        try:
-                            # エフェメラルメッセージを送信
-                            await interaction.followup.send("マッチング相手が見つかりませんでした。", ephemeral=True)
-                        except Exception as e:
-                            logging.error(f"Failed to send ephemeral message to {user}: {e}")
-                        # インタラクションを削除
-                        del self.user_interactions[user.id]
-                    break
+            for _, _, user in self.waiting_pool.pop_expired():
+                # 保存しておいたインタラクションを取得
+                interaction = self.user_interactions.get(user.id)
+                if interaction:
+                    try:
+                        # エフェメラルメッセージを送信
+                        await interaction.followup.send("マッチング相手が見つかりませんでした。", ephemeral=True)
+                    except Exception as e:
+                        logging.error(f"Failed to send ephemeral message to {user}: {e}")
+                    # インタラクションを削除
+                    del self.user_interactions[user.id]
 
     async def match_users(self):
-        role_name = "試合中"
         async with self.match_lock:
-            matched_users_ids = set()
+            # 連続マッチを避けるため、前回の相手とは組み合わせない
+            def can_pair(user1, user2):
+                return self.previous_opponents.get(user1.id) != user2.id and self.previous_opponents.get(user2.id) != user1.id
+
+            # レート順の待機リストから組み合わせを求める（方式は MATCHMAKING_MODE で切り替え）
             matches = []
+            for (_, _, user1), (_, _, user2) in self.waiting_pool.select_matches(can_pair):
+                # 待機時間を記録し、待機リストから削除
+                match_latency.record(self.waiting_pool.wait_time(user1.id))
+                match_latency.record(self.waiting_pool.wait_time(user2.id))
+                self.waiting_pool.remove(user1.id)
+                self.waiting_pool.remove(user2.id)
+                self.previous_opponents[user1.id] = user2.id
+                self.previous_opponents[user2.id] = user1.id
+                self.starting_users.update([user1.id, user2.id])
+                matches.append((user1, user2))
+
+        # ロール付与・通知・スレッド作成はロックの外で行い、次のマッチングを待たせない
+        for user1, user2 in matches:
+            # マッチングログの追加
+            logging.info(f"{user1.id} ({user1.display_name}) と {user2.id} ({user2.display_name}) がマッチングしました")
+            self.match_pipeline.submit((user1.id, user2.id), functools.partial(self.start_match, user1, user2))
+
+    async def start_match(self, user1, user2):
+        """マッチ成立後の処理（ロール付与 → 通知 → スレッド作成）"""
+        role_name = "試合中"
+        try:
+            # ロールの付与をマッチング確定のタイミングで実行
+            await asyncio.gather(assign_role(user1, role_name), assign_role(user2, role_name))
+        finally:
+            self.starting_users.difference_update([user1.id, user2.id])
 
-            # waiting_queueのコピーを作成して、反復中の変更を防ぐ
-            queue_copy = list(self.waiting_queue)
-            for i in range(len(queue_copy) - 1):
-                user1_rating, _, user1 = queue_copy[i]
-                if user1.id in matched_users_ids:
-                    continue  # マッチ済みのユーザーはスキップ
-                for j in range(i + 1, len(queue_copy)):
-                    user2_rating, _, user2 = queue_copy[j]
-                    if user2.id in matched_users_ids:
-                        continue  # マッチ済みのユーザーはスキップ
-                    if user1.id == user2.id:
-                        continue  # 同じユーザーはスキップ
-
-                    # 連続マッチを避けるため、前回の相手を確認
-                    if self.previous_opponents.get(user1.id) == user2.id or self.previous_opponents.get(user2.id) == user1.id:
-                        continue
-
-                    rating_diff = abs(user1_rating - user2_rating)
-                    if rating_diff <= 300:
-                        # マッチを記録
-                        matched_users_ids.update([user1.id, user2.id])
-                        self.previous_opponents[user1.id] = user2.id
-                        self.previous_opponents[user2.id] = user1.id
-                        matches.append((user1, user2))
-                        # ロールの付与をマッチング確定のタイミングで実行
-                        role_name = "試合中"
-                        await assign_role(user1, role_name)
-                        await asyncio.sleep(0.5)
-                        await assign_role(user2, role_name)
-                        await asyncio.sleep(0.5)
-                        break  # 内側のループを抜けて次の user1 へ
-
-            # マッチしたユーザーを waiting_queue から削除
-            self.waiting_queue = [(rating, id_, user) for rating, id_, user in self.waiting_queue if user.id not in matched_users_ids]
-            heapq.heapify(self.waiting_queue)
-            # マッチングが成立したユーザーに通知
-            for user1, user2 in matches:
-                interaction1 = self.user_interactions.get(user1.id)
-                interaction2 = self.user_interactions.get(user2.id)
-                if interaction1:
-                    message = await interaction1.followup.send(
-                        "マッチングが成立しました。バトルスレッドの作成を待っています。", ephemeral=True)
-                    asyncio.create_task(self.delete_messages_after_delay(message))
-                if interaction2:
-                    message = await interaction2.followup.send(
-                        "マッチングが成立しました。バトルスレッドの作成を待っています。", ephemeral=True)
-                    asyncio.create_task(self.delete_messages_after_delay(message))
-
-            # マッチチャンネルの作成を順番に処理
-            for user1, user2 in matches:
-                # マッチングログの追加
-                logging.info(f"{user1.id} ({user1.display_name}) と {user2.id} ({user2.display_name}) がマッチングしました")
-                await self.create_match_channel(user1, user2)
-                await asyncio.sleep(0.5)  # 0.5秒の遅延を挿入
-
-    # Periodically check the waiting list
+        # マッチングが成立したユーザーに通知
+        async def notify(user):
+            interaction = self.user_interactions.get(user.id)
+            if interaction:
+                message = await interaction.followup.send(
+                    "マッチングが成立しました。バトルスレッドの作成を待っています。", ephemeral=True)
+                message_deleter.delete_followup_later(interaction, message, 60)
+        await asyncio.gather(notify(user1), notify(user2))
+
+        await self.create_match_channel(user1, user2)
+
+    # 待機リストへの追加か、次の許容レート差の拡大・待機期限まで眠ってからマッチングする
     async def background_match_check(self):
         while True:
-            await asyncio.sleep(5)
-            await self.match_users()
+            next_event_time = self.waiting_pool.next_event_time()
+            timeout = None if next_event_time is None else max(next_event_time - time.monotonic(), 0)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+                # 連続して押されたボタンを1回のマッチング処理にまとめる
+                await asyncio.sleep(MATCHMAKING_COALESCE_WINDOW)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.match_users()
+                await self.remove_expired_users()
+            except Exception as e:
+                logging.error(f"Error in background_match_check: {e}")
 
     async def create_match_channel(self, user1, user2):
-        role_name = "試合中"
-        await asyncio.sleep(0.5)
         # マッチング時点でのクラスを取得
-        user1_instance = session.query(User).filter_by(discord_id=user1.id).first()
-        user2_instance = session.query(User).filter_by(discord_id=user2.id).first()
+        user1_instance, user2_instance = await asyncio.gather(
+            run_db(get_user_by_discord_id, user1.id),
+            run_db(get_user_by_discord_id, user2.id)
+        )
         matching_classes = {
             user1.id: (user1_instance.class1, user1_instance.class2),
             user2.id: (user2_instance.class1, user2_instance.class2)
@@ -691,20 +574,19 @@ class MatchmakingView(discord.ui.View):
         # スレッドの作成
         game_thread = await safe_create_thread(channel, user1, user2)
 
-        # スレッドにユーザーを追加
-        await safe_add_user_to_thread(game_thread, user1)
-        await asyncio.sleep(0.5)  # 少し待機
-        await safe_add_user_to_thread(game_thread, user2)
-        await asyncio.sleep(0.5)  # 少し待機
-
+        # スレッドにユーザーを追加（レート制限は safe_add_user_to_thread 側で扱う）
+        await asyncio.gather(
+            safe_add_user_to_thread(game_thread, user1),
+            safe_add_user_to_thread(game_thread, user2)
+        )
 
         # メッセージの送信
         # 勝利数ボタンを表示するためのビューを作成
         view = ResultView(user1.id, user2.id, matching_classes, game_thread, self)
-        await asyncio.sleep(0.5)  # 少し待機
 
-        # ResultViewをactive_result_viewsに登録
+        # ResultViewをactive_result_viewsに登録し、再起動に備えて試合の状態を保存
         active_result_views[game_thread.id] = view
+        await run_db(save_pending_match, game_thread.id, user1.id, user2.id, matching_classes)
 
         content = (
             f"**マッチング成功!**\n\n"
@@ -716,9 +598,8 @@ class MatchmakingView(discord.ui.View):
             f"信用ポイント: {int(user2_instance.trust_points)}\n"
             f"試合が終わったら勝利数を選択してください。"
         )
-        await asyncio.sleep(0.5)
-        
-        await safe_send_message(game_thread, content, view=view)
+        message = await safe_send_message(game_thread, content, view=view)
+        await run_db(update_pending_match, game_thread.id, result_message_id=message.id)
 
         # 前回の相手を更新（ここで更新することで、次回のマッチング時に連続で同じ相手とマッチングしないようにする）
         self.previous_opponents[user1.id] = user2.id
@@ -731,33 +612,38 @@ async def start_matchmaking(channel):
 
 
 class ResultView(discord.ui.View):
-    def __init__(self, player1_id, player2_id, matching_classes, thread, matchmaking_view):
+    def __init__(self, player1_id, player2_id, matching_classes, thread, matchmaking_view, player1_result=None, player2_result=None):
         super().__init__(timeout=None)
         self.player1_id = player1_id
         self.player2_id = player2_id
         self.matching_classes = matching_classes
         self.thread = thread
-        self.player1_result = None
-        self.player2_result = None
+        self.player1_result = player1_result
+        self.player2_result = player2_result
         self.results_locked = False
-        self.timeout_task = None  # タイマータスクを管理
+        self.deadline = None  # 未入力の相手を敗北とみなす期限（match_timers で管理）
         self.matchmaking_view = matchmaking_view  # MatchmakingViewへの参照を追加
 
-    @discord.ui.button(label="2勝", style=discord.ButtonStyle.success)
+    # 再起動後も同じメッセージのボタンを受け付けられるよう custom_id を固定する
+    # ロールの変更はまとめて反映されるまで待つため、先に遅延応答してインタラクションの期限（3秒）に間に合わせる
+    @discord.ui.button(label="2勝", style=discord.ButtonStyle.success, custom_id="result:2")
     async def two_wins(self, button: discord.ui.Button, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
         await remove_role(interaction.user, "試合中")
         await self.handle_result(interaction, 2)
 
-    @discord.ui.button(label="1勝", style=discord.ButtonStyle.primary)
+    @discord.ui.button(label="1勝", style=discord.ButtonStyle.primary, custom_id="result:1")
     async def one_win(self, button: discord.ui.Button, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
         await remove_role(interaction.user, "試合中")
         await self.handle_result(interaction, 1)
 
-    @discord.ui.button(label="0勝", style=discord.ButtonStyle.danger)
+    @discord.ui.button(label="0勝", style=discord.ButtonStyle.danger, custom_id="result:0")
     async def zero_wins(self, button: discord.ui.Button, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
         await remove_role(interaction.user, "試合中")
         await self.handle_result(interaction, 0)
-    @discord.ui.button(label="リセット", style=discord.ButtonStyle.secondary)
+    @discord.ui.button(label="リセット", style=discord.ButtonStyle.secondary, custom_id="result:reset")
     async def reset(self, button: discord.ui.Button, interaction: discord.Interaction):
         await self.handle_reset(interaction)
 
@@ -787,6 +673,7 @@ class ResultView(discord.ui.View):
 
         # タイマーが存在する場合はキャンセル
         self.cancel_timeout()
+        await self.save_state()
 
         # ユーザーにリセット完了を通知
         if not interaction.response.is_done():
@@ -825,6 +712,7 @@ class ResultView(discord.ui.View):
                 self.player1_result = None
             else:
                 self.player2_result = None
+            await self.save_state()
             if not interaction.response.is_done():
                 await interaction.response.send_message(f"{interaction.user.display_name} が結果をリセットしました。")
             else:
@@ -871,51 +759,57 @@ class ResultView(discord.ui.View):
             await self.check_results()
         else:
             # 一方の結果のみが入力された場合、タイマーを開始
-            if self.timeout_task is None:
-                self.timeout_task = asyncio.create_task(self.timeout_wait())
+            if self.deadline is None:
+                self.start_timeout()
+            await self.save_state()
+
+    async def save_state(self):
+        """入力済みの結果と期限を pending_match に保存する"""
+        await run_db(
+            update_pending_match, self.thread.id,
+            player1_result=self.player1_result, player2_result=self.player2_result, deadline=self.deadline
+        )
+
+    def start_timeout(self, deadline=None):
+        """未入力の相手を敗北とみなすタイマーを開始する（復元時は保存済みの期限を使う）"""
+        self.deadline = deadline or time.time() + RESULT_TIMEOUT
+        match_timers.schedule(('result', self.thread.id), self.deadline, self.timeout_wait)
 
     async def timeout_wait(self):
+        """3時間の期限を迎えたとき（match_timers から呼び出される）"""
         guild = self.thread.guild  # スレッドからGuildを取得
-        try:
-            await asyncio.sleep(3 * 60 * 60)  # 3時間
-            if self.player1_result is None and self.player2_result is not None:
-                # プレイヤー1が未入力、プレイヤー2の勝利
-                self.player1_result = 0
-                self.player2_result = 2
-                await self.thread.send(f"<@{self.player1_id}> が勝利数を報告しなかったため、<@{self.player2_id}> の勝利となります。")
-
-                # プレイヤー1から「試合中」ロールを削除
-                player1_member = guild.get_member(self.player1_id)
-                if player1_member:
-                    await remove_role(player1_member, "試合中")
-
-                await self.check_results()
-
-            elif self.player2_result is None and self.player1_result is not None:
-                # プレイヤー2が未入力、プレイヤー1の勝利
-                self.player1_result = 2
-                self.player2_result = 0
-                await self.thread.send(f"<@{self.player2_id}> が勝利数を報告しなかったため、<@{self.player1_id}> の勝利となります。")
-
-                # プレイヤー2から「試合中」ロールを削除
-                player2_member = guild.get_member(self.player2_id)
-                if player2_member:
-                    await remove_role(player2_member, "試合中")
-
-                await self.check_results()
-
-        except asyncio.CancelledError:
-            # タスクがキャンセルされた場合は何もしない
+        self.deadline = None
+        if self.player1_result is None and self.player2_result is not None:
+            # プレイヤー1が未入力、プレイヤー2の勝利
+            self.player1_result = 0
+            self.player2_result = 2
+            await self.thread.send(f"<@{self.player1_id}> が勝利数を報告しなかったため、<@{self.player2_id}> の勝利となります。")
+
+            # プレイヤー1から「試合中」ロールを削除
             player1_member = guild.get_member(self.player1_id)
+            if player1_member:
+                await remove_role(player1_member, "試合中")
+
+            await self.check_results()
+
+        elif self.player2_result is None and self.player1_result is not None:
+            # プレイヤー2が未入力、プレイヤー1の勝利
+            self.player1_result = 2
+            self.player2_result = 0
+            await self.thread.send(f"<@{self.player2_id}> が勝利数を報告しなかったため、<@{self.player1_id}> の勝利となります。")
+
+            # プレイヤー2から「試合中」ロールを削除
             player2_member = guild.get_member(self.player2_id)
-            logging.info(f"{self.player1_id}({player1_member.display_name})と{self.player2_id}({player2_member.display_name})のタスクがキャンセルされました。")
-            pass
+            if player2_member:
+                await remove_role(player2_member, "試合中")
+
+            await self.check_results()
 
     def cancel_timeout(self):
-        """タイマータスクをキャンセルする"""
-        if self.timeout_task is not None:
-            self.timeout_task.cancel()
-            self.timeout_task = None
+        """タイマーをキャンセルする"""
+        if match_timers.cancel(('result', self.thread.id)):
+            logging.info(f"{self.player1_id}と{self.player2_id}のタイマーがキャンセルされました。")
+        self.deadline = None
 
     async def check_results(self):
         if self.results_locked:
@@ -923,50 +817,39 @@ class ResultView(discord.ui.View):
 
         try:
             if (self.player1_result + self.player2_result) in [2, 3] and self.player1_result != self.player2_result:
-                # レーティングを更新し、変動前後の値と変動量を取得
+                # レート・勝敗数・対戦履歴を1トランザクションで更新し、変動前後の値と変動量を取得
+                # 保存していた試合の状態も同じトランザクションで削除し、既に削除されていれば精算しない（二重精算の防止）
+                # run_db を待つ間に他の報告や期限切れが精算を始めないよう、先にロックする
+                self.results_locked = True
                 try:
-                    user1_rating_before, user1_rating_after, user1_rating_change, user2_rating_before, user2_rating_after, user2_rating_change = self.update_ratings(
-                        self.player1_id, self.player2_id, self.player1_result, self.player2_result
+                    settlements = await run_db(
+                        settle_pending_match,
+                        self.thread.id,
+                        self.player1_id,
+                        self.player2_id,
+                        self.player1_result,
+                        self.player2_result,
+                        current_season_id,
+                        current_season_name,
+                        self.matching_classes.get(self.player1_id, (None, None)),
+                        self.matching_classes.get(self.player2_id, (None, None))
                     )
                 except Exception as e:
-                    logging.error(f"Error in update_ratings: {e}")
+                    self.results_locked = False
+                    logging.error(f"Error in settle_match: {e}")
                     await self.thread.send("レーティングの更新中にエラーが発生しました。管理者にお問い合わせください。")
                     return
-
-                self.cancel_timeout()
-
-                user1 = session.query(User).filter_by(discord_id=str(self.player1_id)).first()
-                if user1 is None:
-                    logging.error(f"User with ID {self.player1_id} not found in the database.")
-                    await self.thread.send(f"ユーザーID {self.player1_id} の情報が見つかりませんでした。")
-                    return
-
-                user2 = session.query(User).filter_by(discord_id=str(self.player2_id)).first()
-                if user2 is None:
-                    logging.error(f"User with ID {self.player2_id} not found in the database.")
-                    await self.thread.send(f"ユーザーID {self.player2_id} の情報が見つかりませんでした。")
+                if settlements is None:
+                    logging.info(f"Match in thread {self.thread.id} has already been settled.")
                     return
 
-                user1_a, user1_b = self.matching_classes.get(self.player1_id, (None, None))
-                user2_a, user2_b = self.matching_classes.get(self.player2_id, (None, None))
-
-                update_history(
-                    user1_id=user1.id,
-                    user2_id=user2.id,
-                    season_name=current_season_name,
-                    user1_class_a=user1_a,
-                    user1_class_b=user1_b,
-                    user2_class_a=user2_a,
-                    user2_class_b=user2_b,
-                    user1_rating_change=user1_rating_change,
-                    user2_rating_change=user2_rating_change
-                )
+                self.cancel_timeout()
+                settlement1, settlement2 = settlements
 
-                # 最新シーズンでマッチングしたフラグをオンにする
-                user1.latest_season_matched = True
-                user2.latest_season_matched = True
-                session.commit()  # 変更をデータベースに保存
-                self.results_locked = True
+                user1, user1_rating_before, user1_rating_after, user1_rating_change = settlement1
+                user2, user2_rating_before, user2_rating_after, user2_rating_change = settlement2
+                # 精算した2人だけランキングに反映する
+                leaderboard.update_users([user1, user2])
 
                 # スレッドにレーティング変動メッセージを表示
                 user1_change_sign = "+" if user1_rating_change > 0 else ""
@@ -1003,10 +886,16 @@ class ResultView(discord.ui.View):
                 # 結果が一致しない場合の処理
                 self.player1_result = None
                 self.player2_result = None
-                await self.thread.send(
+                message = await self.thread.send(
                     f"<@{self.player1_id}>と<@{self.player2_id}>、結果が一致しません。再度入力してください。",
                     view=self
                 )
+                await run_db(
+                    update_pending_match, self.thread.id,
+                    player1_result=None, player2_result=None, deadline=None, result_message_id=message.id
+                )
+                # 試合は続くため active_result_views には残す
+                return
         except Exception as e:
             logging.error(f"Error in check_results: {e}")
             await self.thread.send("エラーが発生しました。管理者にお問い合わせください。")
@@ -1015,155 +904,42 @@ class ResultView(discord.ui.View):
                 await self.thread.delete()
             except Exception as delete_exception:
                 logging.error(f"Failed to delete thread after error: {delete_exception}")
+            await run_db(delete_pending_match, self.thread.id)
         # 試合終了後にactive_result_viewsから削除
         if self.thread.id in active_result_views:
             del active_result_views[self.thread.id]
 
-    def update_ratings(self, player1_id, player2_id, player1_wins, player2_wins):
-        """レーティングを更新し、データベースに保存します。"""
-        
-        # プレイヤー1とプレイヤー2をデータベースから取得 (discord_id を使用)
-        player1 = session.query(User).filter_by(discord_id=player1_id).first()
-        player2 = session.query(User).filter_by(discord_id=player2_id).first()
-
-        if not player1 or not player2:
-            raise ValueError("One or both players not found in the database.")
-
-        # レーティングを取得
-        user1_rating_data = player1.rating
-        user2_rating_data = player2.rating
-
-        # 変動前のレーティングを記録
-        user1_rating_before = user1_rating_data
-        user2_rating_before = user2_rating_data
-
-        # レーティング変動を計算
-        user1_rating_change = calculate_rating_change(user1_rating_data, user2_rating_data, player1_wins, player2_wins)
-        user2_rating_change = calculate_rating_change(user2_rating_data, user1_rating_data, player2_wins, player1_wins)
-
-        # レーティングを更新
-        player1.rating += user1_rating_change
-        player2.rating += user2_rating_change
-
-        # データベースに変更を保存
-        session.commit()
-
-        # 変動前の数値と変動量を返す
-        return user1_rating_before, player1.rating, user1_rating_change, user2_rating_before, player2.rating, user2_rating_change
-
-def update_history(user1_id, user2_id, season_name, user1_class_a, user1_class_b, user2_class_a, user2_class_b, user1_rating_change, user2_rating_change):
-    """対戦履歴を更新する関数"""
-    match_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    if user1_rating_change > user2_rating_change:
-        winner_user_id = user1_id
-        loser_user_id = user2_id
-    else:
-        winner_user_id = user2_id
-        loser_user_id = user1_id
-
-    # match_history テーブルにデータを挿入
-    new_match = MatchHistory(
-        user1_id=user1_id,
-        user2_id=user2_id,
-        match_date=match_date,
-        season_name=season_name,
-        user1_class_a=user1_class_a,
-        user1_class_b=user1_class_b,
-        user2_class_a=user2_class_a,
-        user2_class_b=user2_class_b,
-        user1_rating_change=user1_rating_change,
-        user2_rating_change=user2_rating_change,
-        winner_user_id=winner_user_id,
-        loser_user_id=loser_user_id
-    )
-    session.add(new_match)
-
-    # user1 と user2 の情報を取得
-    user1 = session.query(User).filter_by(id=user1_id).first()
-    user2 = session.query(User).filter_by(id=user2_id).first()
-
-    # total_matches を +1 する
-    if user1:
-        user1.total_matches += 1
-    if user2:
-        user2.total_matches += 1
-
-    # win_count と loss_count を更新
-    if user1.id == winner_user_id:
-        user1.win_count += 1
-        user2.loss_count += 1
-    else:
-        user2.win_count += 1
-        user1.loss_count += 1
-
-    # win_streak の更新と max_win_streak の更新
-    if user1_rating_change > 0 and user2_rating_change < 0:
-        # user1 が勝った場合
-        if user1:
-            user1.win_streak += 1
-            if user1.win_streak > user1.max_win_streak:
-                user1.max_win_streak = user1.win_streak  # max_win_streakを更新
-        if user2:
-            user2.win_streak = 0
-    elif user2_rating_change > 0 and user1_rating_change < 0:
-        # user2 が勝った場合
-        if user2:
-            user2.win_streak += 1
-            if user2.win_streak > user2.max_win_streak:
-                user2.max_win_streak = user2.win_streak  # max_win_streakを更新
-        if user1:
-            user1.win_streak = 0
-
-    session.commit()
-
 @bot.slash_command(name="manual_result", description="二人のユーザーの間で勝者を手動で決定します。", default_permission=False)
 @commands.has_permissions(administrator=True)
 async def manual_result(ctx: discord.ApplicationContext, player1: discord.Member, player1_wins: int, player2: discord.Member, player2_wins: int):
     # データベースからユーザー情報を取得
-    user1 = session.query(User).filter_by(discord_id=player1.id).first()
-    user2 = session.query(User).filter_by(discord_id=player2.id).first()
-    matching_classes = {
-        player1.id: (user1.class1, user1.class2),
-        player2.id: (user2.class1, user2.class2)
-    }
+    user1 = await run_db(get_user_by_discord_id, player1.id)
+    user2 = await run_db(get_user_by_discord_id, player2.id)
     if not user1 or not user2:
         await ctx.respond("指定されたユーザーがデータベースに見つかりませんでした。ユーザー登録を行ってください。", ephemeral=True)
         return
 
-    # 勝利数を比較して結果を設定
-    if player1_wins == 2 and player2_wins in [0, 1]:
-        result_view = ResultView(player1.id, player2.id, matching_classes, None, None)
-        result_view.player1_result = 2  # player1が勝者として2勝とする
-        result_view.player2_result = player2_wins  # player2の勝利数を設定
-    elif player2_wins == 2 and player1_wins in [0, 1]:
-        result_view = ResultView(player1.id, player2.id, matching_classes, None, None)
-        result_view.player2_result = 2  # player2が勝者として2勝とする
-        result_view.player1_result = player1_wins  # player1の勝利数を設定
-    else:
+    # 勝利数を確認（2勝した方が勝者）
+    if not ((player1_wins == 2 and player2_wins in [0, 1]) or (player2_wins == 2 and player1_wins in [0, 1])):
         await ctx.respond("勝利数の入力が正しくありません。2勝した方が勝者となり、もう一方は0勝または1勝でなければなりません。", ephemeral=True)
         return
 
-    # スレッドがないため、ユーザーのレート更新部分を修正
-    if result_view.results_locked:
-        return
-
-    # レーティングを更新し、変動前後の値と変動量を取得
-    user1_rating_before, user1_rating_after, user1_rating_change, user2_rating_before, user2_rating_after, user2_rating_change = result_view.update_ratings(
-        result_view.player1_id, result_view.player2_id, result_view.player1_result, result_view.player2_result
+    # レート・勝敗数・対戦履歴を1トランザクションで更新し、変動前後の値と変動量を取得
+    await update_current_season_name()
+    settlement1, settlement2 = await run_db(
+        settle_match,
+        player1.id,
+        player2.id,
+        player1_wins,
+        player2_wins,
+        current_season_id,
+        current_season_name,
+        (user1.class1, user1.class2),
+        (user2.class1, user2.class2)
     )
-
-    # 最新シーズンでマッチングしたフラグをオンにする
-    user1.latest_season_matched = True
-    user2.latest_season_matched = True
-    session.commit()  # 変更をデータベースに保存
-    result_view.results_locked = True
-
-    # 試合履歴を更新
-    update_current_season_name()
-    season_name = current_season_name  # 必要に応じてシーズン名を設定
-    user1_class_a, user1_class_b = matching_classes[player1.id]
-    user2_class_a, user2_class_b = matching_classes[player2.id]
-    update_history(user1.id, user2.id, season_name, user1_class_a, user1_class_b, user2_class_a, user2_class_b, user1_rating_change, user2_rating_change)
+    leaderboard.update_users([settlement1[0], settlement2[0]])
+    _, user1_rating_before, user1_rating_after, user1_rating_change = settlement1
+    _, user2_rating_before, user2_rating_after, user2_rating_change = settlement2
 
     # レート変動を確認できるようにする
     user1_change_sign = "+" if user1_rating_change > 0 else ""
@@ -1178,6 +954,37 @@ async def manual_result(ctx: discord.ApplicationContext, player1: discord.Member
         f"{player2.display_name}のレート: {user2_rating_before:.0f} -> {user2_rating_after:.0f} ({user2_change_sign}{user2_rating_change:.0f})",
     )
 
+@bot.slash_command(name="matchmaking_stats", description="マッチング成立までの待ち時間を表示します。", default_permission=False)
+@commands.has_permissions(administrator=True)
+async def matchmaking_stats(ctx: discord.ApplicationContext):
+    percentiles = match_latency.percentiles(50, 90, 99)
+    if percentiles[50] is None:
+        await ctx.respond("まだマッチングが成立していません。", ephemeral=True)
+        return
+    await ctx.respond(
+        f"マッチング成立までの待ち時間（直近 {len(match_latency.samples)} 人 / 累計 {match_latency.total_count} 人）\n"
+        f"p50: {percentiles[50]:.1f}秒  p90: {percentiles[90]:.1f}秒  p99: {percentiles[99]:.1f}秒",
+        ephemeral=True
+    )
+
+@bot.slash_command(name="api_stats", description="Discord API リクエストの送信状況を表示します。", default_permission=False)
+@commands.has_permissions(administrator=True)
+async def api_stats(ctx: discord.ApplicationContext):
+    stats = api_scheduler.stats()
+    def format_counts(counts):
+        return ", ".join(f"{kind}: {count}" for kind, count in sorted(counts.items())) or "なし"
+    await ctx.respond(
+        f"送信待ち: {stats['waiting']}（うち同時実行の枠待ち {stats['waiting_for_slot']}、最大 {stats['max_waiting']}）  実行中: {stats['in_flight']}\n"
+        f"送信数: {format_counts(stats['requests'])}\n"
+        f"429: {format_counts(stats['rate_limited'])}\n"
+        f"エラー: {format_counts(stats['errors'])}\n"
+        f"ロール変更: 依頼 {role_coalescer.request_count} / 送信 {role_coalescer.edit_count} / 省略 {role_coalescer.skipped_count}\n"
+        f"メッセージ削除: 待ち {len(message_deleter)} / 削除済み {message_deleter.deleted_count} / 失敗 {message_deleter.failed_count}\n"
+        f"ランキングキャッシュ: ヒット {ranking_cache.hit_count} / 古いデータ {ranking_cache.stale_count} / ミス {ranking_cache.miss_count} / 作り直し {ranking_cache.refresh_count}\n"
+        f"ランキング投稿: ページの編集 {ranking_publisher.edited_count} / 変更なし {ranking_publisher.skipped_count}",
+        ephemeral=True
+    )
+
 @bot.slash_command(name="remove_role", description="「試合中」ロールを外します。")
 async def remove_matching_role(ctx: discord.ApplicationContext):
     await remove_role(ctx.user, "試合中")
@@ -1186,13 +993,13 @@ async def remove_matching_role(ctx: discord.ApplicationContext):
 @bot.slash_command(name="adjust_win_loss", description="指定したユーザーの勝敗数を調整します。", hidden=True)
 @commands.has_permissions(administrator=True)
 async def adjust_win_loss(ctx: discord.ApplicationContext, user1: discord.Member, user2: discord.Member):
-    # データベースからユーザー情報を取得
-    user1_data = session.query(User).filter_by(discord_id=user1.id).first()
-    user2_data = session.query(User).filter_by(discord_id=user2.id).first()
-
-    if user1_data and user2_data:
+    def adjust(session):
+        # データベースからユーザー情報を取得
+        user1_data = get_user_by_discord_id(session, user1.id)
+        user2_data = get_user_by_discord_id(session, user2.id)
+        adjusted = False
         # 勝敗数の変更が可能か確認
-        if user1_data.loss_count > 0 and user2_data.win_count > 0:
+        if user1_data and user2_data and user1_data.loss_count > 0 and user2_data.win_count > 0:
             # 第一引数のユーザーのwin_countを+1, loss_countを-1
             user1_data.win_count += 1
             user1_data.loss_count -= 1
@@ -1200,10 +1007,15 @@ async def adjust_win_loss(ctx: discord.ApplicationContext, user1: discord.Member
             # 第二引数のユーザーのwin_countを-1, loss_countを+1
             user2_data.win_count -= 1
             user2_data.loss_count += 1
+            adjusted = True
+        return user1_data, user2_data, adjusted
 
-            # 変更をデータベースにコミット
-            session.commit()
+    user1_data, user2_data, adjusted = await run_db(adjust)
+    if adjusted:
+        leaderboard.update_users([user1_data, user2_data])
 
+    if user1_data and user2_data:
+        if adjusted:
             await ctx.respond(f"{user1.display_name} の勝利数: {user1_data.win_count}, 敗北数: {user1_data.loss_count}\n"
                               f"{user2.display_name} の勝利数: {user2_data.win_count}, 敗北数: {user2_data.loss_count}", ephemeral=True)
         else:
@@ -1245,10 +1057,10 @@ class StayButton(discord.ui.Button):
         self.user_instance = user_instance
 
     async def callback(self, interaction: discord.Interaction):
-        session = SessionLocal()
-        user_id = str(interaction.user.id)
-        user_instance = session.query(User).filter_by(discord_id=user_id).first()
-        current_season = session.query(Season).order_by(Season.id.desc()).first()
+        def load(session):
+            return get_user_by_discord_id(session, interaction.user.id), get_latest_season(session)
+
+        user_instance, current_season = await run_db(load)
 
         if user_instance:
             if user_instance.stay_flag == 0:
@@ -1263,7 +1075,41 @@ class StayButton(discord.ui.Button):
                 await interaction.response.send_message("あなたは既に今シーズンで Stay 機能を使用しました。", ephemeral=True)
         else:
             await interaction.response.send_message("ユーザー情報が見つかりません。ユーザー登録を行ってください。", ephemeral=True)
-        session.close()
+
+def apply_stay(session, user_id, season_id):
+    """現在のデータを user_season_record に保存し、ユーザーの統計データをリセットする"""
+    user_instance = session.query(User).filter_by(id=user_id).first()
+
+    # 現在のデータを user_season_record に保存
+    existing_record = session.query(UserSeasonRecord).filter_by(user_id=user_instance.id, season_id=season_id).first()
+    if existing_record:
+        # 既にレコードが存在する場合は上書きしない
+        pass
+    else:
+        new_record = UserSeasonRecord(
+            user_id=user_instance.id,
+            season_id=season_id,
+            rating=user_instance.rating,
+            rank=None,  # 順位はシーズン終了時に計算
+            win_count=user_instance.win_count,
+            loss_count=user_instance.loss_count,
+            total_matches=user_instance.total_matches,
+            win_streak=user_instance.win_streak,
+            max_win_streak=user_instance.max_win_streak,
+        )
+        session.add(new_record)
+
+    # ユーザーの統計データをリセット
+    user_instance.stayed_rating = user_instance.rating
+    user_instance.rating = 1500
+    user_instance.win_count = 0
+    user_instance.loss_count = 0
+    user_instance.total_matches = 0
+    user_instance.win_streak = 0
+    user_instance.max_win_streak = 0
+
+    # stay_flag を 1 に設定
+    user_instance.stay_flag = 1
 
 class StayConfirmView(discord.ui.View):
     def __init__(self, user_instance, current_season, timeout=60):
@@ -1273,51 +1119,13 @@ class StayConfirmView(discord.ui.View):
 
     @discord.ui.button(label="はい", style=discord.ButtonStyle.success)
     async def confirm(self, button: discord.ui.Button, interaction: discord.Interaction):
-        session = SessionLocal()
         # ボタンを押したユーザーがコマンド実行者か確認
         if interaction.user.id != int(self.user_instance.discord_id):
             await interaction.response.send_message("このボタンはあなたのためのものではありません。", ephemeral=True)
-            session.close()
             return
 
-        # self.user_instance を現在のセッションにマージ
-        user_instance = session.merge(self.user_instance)
-        current_season = session.merge(self.current_season)
-
-        # 現在のデータを user_season_record に保存
-        existing_record = session.query(UserSeasonRecord).filter_by(user_id=user_instance.id, season_id=current_season.id).first()
-        if existing_record:
-            # 既にレコードが存在する場合は上書きしない
-            pass
-        else:
-            new_record = UserSeasonRecord(
-                user_id=user_instance.id,
-                season_id=current_season.id,
-                rating=user_instance.rating,
-                rank=None,  # 順位はシーズン終了時に計算
-                win_count=user_instance.win_count,
-                loss_count=user_instance.loss_count,
-                total_matches=user_instance.total_matches,
-                win_streak=user_instance.win_streak,
-                max_win_streak=user_instance.max_win_streak,
-            )
-            session.add(new_record)
-            session.commit()
-
-        # ユーザーの統計データをリセット
-        user_instance.stayed_rating = user_instance.rating
-        user_instance.rating = 1500
-        user_instance.win_count = 0
-        user_instance.loss_count = 0
-        user_instance.total_matches = 0
-        user_instance.win_streak = 0
-        user_instance.max_win_streak = 0
-
-        # stay_flag を 1 に設定
-        user_instance.stay_flag = 1
-
-        session.commit()
-        session.close()
+        await run_db(apply_stay, self.user_instance.id, self.current_season.id)
+        await leaderboard.reload([self.user_instance.id])
 
         await interaction.response.edit_message(content="Stay 機能を使用しました。あなたのレートと統計データはリセットされました。", view=None)
         
@@ -1341,72 +1149,51 @@ class ProfileButton(discord.ui.Button):
         super().__init__(label="プロフィール表示", style=discord.ButtonStyle.primary)
 
     async def callback(self, interaction: discord.Interaction):
-        session = SessionLocal()
-        user_id = str(interaction.user.id)
-        user_instance = session.query(User).filter_by(discord_id=user_id).first()
-        try:
-            if user_instance:
-                # ユーザー情報の取得
-                user_name = user_instance.user_name
-                shadowverse_id = user_instance.shadowverse_id
-                effective_rating = max(user_instance.rating, user_instance.stayed_rating or 0)
-                rating = round(user_instance.rating, 3)
-                trust_points = user_instance.trust_points
-                win_count = user_instance.win_count
-                loss_count = user_instance.loss_count
-
-                from sqlalchemy import case, desc
-
-                effective_rating_case = case(
-                    (User.stayed_rating > User.rating, User.stayed_rating),
-                    else_=User.rating
-                ).label('effective_rating')
-
-                # ユーザーの順位を計算（latest_season_matched が 1 のユーザーのみ）
-                ranking = session.query(User.id, effective_rating_case).filter(User.latest_season_matched == 1).order_by(desc('effective_rating')).all()
-
-                rank = None
-                if user_instance.latest_season_matched == 1:
-                    for idx, (uid, user_effective_rating) in enumerate(ranking, start=1):
-                        if uid == user_instance.id:
-                            rank = idx
-                            break
-                else:
-                    rank = "未参加です"
-
-                # プロフィールメッセージの作成
-                profile_message = (
-                    f"**ユーザープロフィール**\n"
-                    f"ユーザー名 : {user_name}\n"
-                    f"Shadowverse ID : {shadowverse_id}\n"
-                    f"レーティング : {rating}\n"
-                )
+        user_instance = await run_db(get_user_by_discord_id, interaction.user.id)
+        # 順位は latest_season_matched が 1 のユーザーのみで計算
+        if user_instance and user_instance.latest_season_matched != 1:
+            rank = "未参加です"
+        elif user_instance:
+            rank = await leaderboard.rating_rank(user_instance.id) or "-"
+        if user_instance:
+            # ユーザー情報の取得
+            user_name = user_instance.user_name
+            shadowverse_id = user_instance.shadowverse_id
+            rating = round(user_instance.rating, 3)
+            trust_points = user_instance.trust_points
+            win_count = user_instance.win_count
+            loss_count = user_instance.loss_count
+
+            # プロフィールメッセージの作成
+            profile_message = (
+                f"**ユーザープロフィール**\n"
+                f"ユーザー名 : {user_name}\n"
+                f"Shadowverse ID : {shadowverse_id}\n"
+                f"レーティング : {rating}\n"
+            )
 
-                # stayed_rating が存在する場合、その値を表示
-                if user_instance.stayed_rating:
-                    stayed_rating_rounded = round(user_instance.stayed_rating, 2)
-                    profile_message += f"（Stay時のレート : {stayed_rating_rounded}）\n"
+            # stayed_rating が存在する場合、その値を表示
+            if user_instance.stayed_rating:
+                stayed_rating_rounded = round(user_instance.stayed_rating, 2)
+                profile_message += f"（Stay時のレート : {stayed_rating_rounded}）\n"
 
-                profile_message += (
-                    f"信用ポイント : {trust_points}\n"
-                    f"勝敗 : {win_count}勝 {loss_count}敗\n"
-                    f"順位 : {rank}\n"
-                )
+            profile_message += (
+                f"信用ポイント : {trust_points}\n"
+                f"勝敗 : {win_count}勝 {loss_count}敗\n"
+                f"順位 : {rank}\n"
+            )
 
-                # ビューを作成
-                view = None
+            # ビューを作成
+            view = None
 
-                # stay_flag が 0 の場合、StayButton を追加
-                if user_instance.stay_flag == 0:
-                    view = StayButtonView(user_instance)
-                    profile_message += "\nあなたは stay 機能を使用できます。"
+            # stay_flag が 0 の場合、StayButton を追加
+            if user_instance.stay_flag == 0:
+                view = StayButtonView(user_instance)
+                profile_message += "\nあなたは stay 機能を使用できます。"
 
-                await interaction.response.send_message(profile_message, ephemeral=True, view=view)
-            else:
-                await interaction.response.send_message("ユーザー情報が見つかりません。ユーザー登録を行ってください。", ephemeral=True)
-        finally:
-            # セッションの閉鎖
-            session.close()
+            await interaction.response.send_message(profile_message, ephemeral=True, view=view)
+        else:
+            await interaction.response.send_message("ユーザー情報が見つかりません。ユーザー登録を行ってください。", ephemeral=True)
 
 def count_characters(s):
     """全角も半角も1文字としてカウント"""
@@ -1426,7 +1213,7 @@ async def register_user(interaction, thread):
 
     # 既存ユーザーをチェック
     try:
-        existing_user = session.query(User).filter_by(discord_id=user_id).first()
+        existing_user = await run_db(get_user_by_discord_id, user_id)
         if existing_user and existing_user.rating and existing_user.trust_points:
             await thread.send("あなたはすでに登録されています。")
             await asyncio.sleep(8)
@@ -1490,28 +1277,31 @@ async def register_user(interaction, thread):
                 await thread.delete()
                 return
 
-        session.add(user)
-
-            # データベースにユーザー情報を保存
-        session.commit()
+        # データベースにユーザー情報を保存
+        await run_db(lambda session: session.add(user))
         await thread.send(f"**ユーザー {username} の登録が完了しました。**")
     except Exception as e:
-        session.rollback()
         print(f"エラーが発生しました: {e}")
     finally:
         await asyncio.sleep(6)
         await thread.delete()
-        session.close()
 
 @tasks.loop(hours=1)
 async def update_rate_ranking():
     channel = bot.get_channel(RANKING_CHANNEL_ID)  # レーティングランキングを表示するチャンネルID
     if channel:
-        await channel.purge()
-        view = RankingView(session)
-        await channel.send("ランキングを閲覧するにはボタンを押してください。レーティングランキングは1時間ごとに更新されます。", view=view)
-        ranking_view = RankingView(session)
-        await ranking_view.show_rate_ranking(channel)
+        # 初回はチャンネルを作り直し、以降は順位が変わったページだけ編集する
+        await ranking_publisher.publish(channel, "ランキングを閲覧するにはボタンを押してください。レーティングランキングは1時間ごとに更新されます。", get_ranking_view())
+
+
+ranking_view = None
+
+def get_ranking_view():
+    """ランキングチャンネルのボタンは1つの RankingView を使い回す"""
+    global ranking_view
+    if ranking_view is None:
+        ranking_view = RankingView()
+    return ranking_view
 
 
 async def update_stats_periodically():
@@ -1519,59 +1309,117 @@ async def update_stats_periodically():
     past_record_channel = bot.get_channel(PAST_RECORD_CHANNEL_ID)
     last50_record_channel = bot.get_channel(LAST_50_MATCHES_RECORD_CHANNEL_ID)
     while True:
-        await record_channel.purge()
-        await past_record_channel.purge()
-        await last50_record_channel.purge()
-        view1 = CurrentSeasonRecordView(session)
-        view2 = PastSeasonRecordView(session)
-        view3 = Last50RecordView(WinRecord(session))
-        await record_channel.send(view=view1)
-        await past_record_channel.send(view=view2)
-        await last50_record_channel.send(view=view3)
+        # 3つのチャンネルは独立しているため並行して更新する
+        await asyncio.gather(
+            reset_channel(record_channel, view=CurrentSeasonRecordView()),
+            reset_channel(past_record_channel, view=PastSeasonRecordView()),
+            reset_channel(last50_record_channel, view=Last50RecordView(WinRecord())),
+        )
         await asyncio.sleep(3600)
 
 
-#起動処理
-@bot.event
-async def on_ready():
-    print(f'We have logged in as {bot.user}')
-    update_current_season_name()
-    await bot.sync_commands()
-    ranking_channel = bot.get_channel(RANKING_CHANNEL_ID)  # RANKING_CHANNEL_IDを指定
-    await ranking_channel.purge()
-    view = RankingView(session)
-    await ranking_channel.send("ランキングを閲覧するにはボタンを押してください。レーティングランキングは1時間ごとに更新されます。", view=view)
-    past_ranking_channel = bot.get_channel(PAST_RANING_CHANNEL_ID)  # RANKING_CHANNEL_IDを指定
-    await past_ranking_channel.purge()
-    view = RankingButtonView(session)
-    await past_ranking_channel.send(view=view)
-    welcome_channel = bot.get_channel(WELCOME_CHANNEL_ID)
-    if welcome_channel:
-        await welcome_channel.purge()
-        view = RegisterView()
-        await welcome_channel.send("**SV Ratingsへようこそ！**\n以下のボタンを押してユーザー登録を行ってください。詳しくは☑┊quick-startを参照してください。", view=view)
-    else:
-        print("WELCOME category not found.")
-    # 1時間ごとにランキングを更新
-    update_rate_ranking.start()
-    # マッチングチャンネルにボタンを送信
-    # MatchmakingView のインスタンスを作成してグローバル変数に保持
-    # 部分一致でチャンネルを検索
+async def reset_channel(channel, content=None, view=None):
+    """チャンネルのメッセージを削除し、案内メッセージを送り直す"""
+    await api_scheduler.call(('purge', channel.id), channel.purge, priority=PRIORITY_BACKGROUND, description="Purging channel")
+    await safe_send_message(channel, content, priority=PRIORITY_BACKGROUND, view=view)
+
+
+async def init_matching_channel():
     matching_channel = bot.get_channel(MATCHING_CHANNEL_ID)
     if matching_channel:
-        await matching_channel.purge()
-        await matching_channel.send("使用するクラスを選択してください。", view=MyView())
+        await reset_channel(matching_channel, "使用するクラスを選択してください。", view=MyView())
         await update_matchmaking_button(matching_channel)
     else:
         print("マッチングチャンネルが見つかりませんでした。")
+
+
+async def init_welcome_channel():
+    welcome_channel = bot.get_channel(WELCOME_CHANNEL_ID)
+    if welcome_channel:
+        await reset_channel(welcome_channel, "**SV Ratingsへようこそ！**\n以下のボタンを押してユーザー登録を行ってください。詳しくは☑┊quick-startを参照してください。", view=RegisterView())
+    else:
+        print("WELCOME category not found.")
+
+
+async def init_profile_channel():
     profile_channel = bot.get_channel(PROFILE_CHANNEL_ID)  # PROFILE_CHANNEL_IDを実際のチャンネルIDに置き換えてください
     if profile_channel:
-        await profile_channel.purge()
-        view = ProfileView()
-        await profile_channel.send("プロフィールを表示するには以下のボタンを押してください。", view=view)
+        await reset_channel(profile_channel, "プロフィールを表示するには以下のボタンを押してください。", view=ProfileView())
     else:
         print("プロフィールチャンネルが見つかりませんでした。")
+
+
+async def restore_pending_matches():
+    """pending_match に保存した進行中の試合のボタンと期限を復元する（再起動時）"""
+    pending_matches = await run_db(load_pending_matches)
+    restored = 0
+    for pending in pending_matches:
+        thread_id = int(pending.thread_id)
+        if thread_id in active_result_views:
+            continue  # 再接続時など、既にメモリ上にある試合はそのまま使う
+        try:
+            thread = bot.get_channel(thread_id) or await bot.fetch_channel(thread_id)
+        except discord.NotFound:
+            # スレッドが削除されている場合は試合の状態も削除
+            await run_db(delete_pending_match, thread_id)
+            continue
+        except Exception as e:
+            logging.error(f"Failed to restore pending match {thread_id}: {e}")
+            continue
+
+        player1_id = int(pending.player1_id)
+        player2_id = int(pending.player2_id)
+        matching_classes = {
+            player1_id: (pending.player1_class_a, pending.player1_class_b),
+            player2_id: (pending.player2_class_a, pending.player2_class_b)
+        }
+        view = ResultView(
+            player1_id, player2_id, matching_classes, thread, None,
+            player1_result=pending.player1_result, player2_result=pending.player2_result
+        )
+        active_result_views[thread_id] = view
+        if pending.result_message_id:
+            bot.add_view(view, message_id=int(pending.result_message_id))
+
+        if pending.status == STATUS_CANCEL_REQUESTED:
+            requester_id = int(pending.cancel_requester_id)
+            opponent_id = player2_id if requester_id == player1_id else player1_id
+            user1 = thread.guild.get_member(requester_id) or await thread.guild.fetch_member(requester_id)
+            user2 = thread.guild.get_member(opponent_id) or await thread.guild.fetch_member(opponent_id)
+            cancel_view = CancelConfirmationView(user1, user2, thread, deadline=pending.deadline)
+            if pending.cancel_message_id:
+                bot.add_view(cancel_view, message_id=int(pending.cancel_message_id))
+        elif pending.deadline is not None:
+            # 期限を過ぎている場合は match_timers がすぐに処理する
+            view.start_timeout(pending.deadline)
+        restored += 1
+    if restored:
+        logging.info(f"進行中の試合を {restored} 件復元しました。")
+
+
+#起動処理
+@bot.event
+async def on_ready():
+    print(f'We have logged in as {bot.user}')
+    # 各チャンネルの初期化は互いに依存しないため並行して行う
+    results = await asyncio.gather(
+        update_current_season_name(),
+        bot.sync_commands(),
+        reset_channel(bot.get_channel(PAST_RANING_CHANNEL_ID), view=RankingButtonView()),
+        init_welcome_channel(),
+        init_matching_channel(),
+        init_profile_channel(),
+        restore_pending_matches(),
+        leaderboard.ensure_loaded(),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logging.error(f"起動処理中にエラーが発生しました: {result}")
+    # 1時間ごとにランキングを更新（初回の実行でランキングチャンネルを作り直す）
+    update_rate_ranking.start()
     bot.loop.create_task(update_stats_periodically())
+    logging.info(f"起動処理が完了しました（setup.py の読み込み開始から {time.perf_counter() - startup_started_at:.2f} 秒）")
 
 async def update_matchmaking_button(channel):
     """マッチングチャンネルでボタンを更新する関数"""
@@ -1582,26 +1430,27 @@ async def update_matchmaking_button(channel):
 @bot.slash_command(name="trust_report", description="ユーザーの信用ポイントを減点します", default_permission=False)
 @commands.has_permissions(administrator=True)
 async def trust_report(interaction: discord.Interaction, user: discord.Member, points: int):
-    # ユーザーをデータベースから取得
-    user_instance = session.query(User).filter_by(discord_id=user.id).first()
+    def deduct(session):
+        # ユーザーをデータベースから取得
+        user_instance = get_user_by_discord_id(session, user.id)
+        if user_instance:
+            # 信用ポイントを減点
+            user_instance.trust_points = user_instance.trust_points - points
+        return user_instance
+
+    user_instance = await run_db(deduct)
 
     if not user_instance:
         await interaction.response.send_message(f"ユーザー {user.display_name} がデータベースに見つかりませんでした。", ephemeral=True)
         return
 
-    # 信用ポイントを減点
-    user_instance.trust_points = user_instance.trust_points - points
     credit = user_instance.trust_points
 
-    # 変更をデータベースに保存
-    session.commit()
-
     await interaction.response.send_message(f"{user.display_name} さんに {points} ポイントの減点が適用されました。現在の信用ポイント: {credit}")
 
     # 信用ポイントが60未満の場合の処理
     if credit < 60:
         await interaction.followup.send(f"{user.display_name} さんの信用ポイントが60未満です。必要な対応を行ってください。")
-    session.close()  # セッションを閉じる
 
 
 active_users = {}
@@ -1612,18 +1461,23 @@ active_users = {}
 @commands.has_permissions(administrator=True)
 async def start_season(ctx, season_name: str):
     """新しいシーズンを開始するコマンド"""
-    # 最新のシーズンを取得
-    last_season = session.query(Season).order_by(desc(Season.id)).first()
-
-    if last_season and last_season.end_date is None:
+    def create_season(session):
+        # 最新のシーズンを取得
+        last_season = get_latest_season(session)
+        if last_season and last_season.end_date is None:
+            return False
+
+        # 新しいシーズンを作成
+        new_season = Season(season_name=season_name, start_date=datetime.now(), created_at=datetime.now())
+        session.add(new_season)
+        return True
+
+    if not await run_db(create_season):
         await ctx.send("前のシーズンが終了していないため、新しいシーズンを開始できません。")
         return
 
-    # 新しいシーズンを作成
-    new_season = Season(season_name=season_name, start_date=datetime.now(), created_at=datetime.now())
-    session.add(new_season)
-    session.commit()
-    update_current_season_name()
+    await update_current_season_name()
+    ranking_cache.invalidate()
     await ctx.send(f"'{season_name}' が開始されました！")
     #マッチングボタンの表示
     matching_channel = bot.get_channel(MATCHING_CHANNEL_ID)
@@ -1636,43 +1490,22 @@ async def start_season(ctx, season_name: str):
 @commands.has_permissions(administrator=True)
 async def end_season(ctx):
     """現在のシーズンを終了するコマンド"""
-    # 最新のシーズンを取得
-    last_season = session.query(Season).order_by(desc(Season.id)).first()
-
-    if not last_season or last_season.end_date is not None:
+    # シーズン終了・集計・全ユーザーのリセットを1トランザクションで行う
+    last_season = await run_db(roll_over_season)
+    if not last_season:
         await ctx.send("終了するシーズンが見つかりません。")
         return
+    # 現在のシーズン名を更新（アーカイブより前に行い、以降の試合結果が終了したシーズンに記録されないようにする）
+    await update_current_season_name()
+    # 全ユーザーがリセットされたため、ランキングを読み込み直す
+    await leaderboard.reload()
+
+    # 終了したシーズンの対戦履歴をアーカイブへ移し、ホットテーブルを現在のシーズン分だけにする
+    try:
+        await asyncio.get_running_loop().run_in_executor(db_executor, archive_season, last_season.id)
+    except Exception as e:
+        logging.error(f"シーズン '{last_season.season_name}' のアーカイブ中にエラーが発生しました: {e}")
 
-    # シーズンを終了
-    last_season.end_date = datetime.now()
-    session.commit()
-
-    # シーズン統計を集計
-    win_record = WinRecord(session)
-    win_record.totalize_season(last_season.id)
-
-    # 全ユーザーのレートやポイントをリセット
-    users = session.query(User).all()
-    for user in users:
-        # ユーザーのレーティングを1500にリセット
-        user.rating = 1500
-        user.latest_season_matched = 0
-        # trust_pointsを1増やす（最大100）
-        if user.trust_points < 100:
-            user.trust_points += 1
-        
-        user.stayed_rating = None
-        user.total_matches = 0
-        user.win_streak = 0
-        user.max_win_streak = 0  # 最大連勝数をリセット
-        user.win_count = 0  # 勝利数をリセット
-        user.loss_count = 0  # 敗北数をリセット
-        # stay_flagを0にリセット
-        user.stay_flag = 0
-
-    session.commit()
-    # 現在のシーズン名を更新
-    update_current_season_name()
     await ctx.send(f"シーズン '{last_season.season_name}' が終了しました。")
     #マッチングボタンの削除
     matching_channel = bot.get_channel(MATCHING_CHANNEL_ID)
@@ -0,0 +1,59 @@
+import os
+import sys
+import runpy
+import tempfile
+from types import SimpleNamespace
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# data_access はインポート時にスキーマを読み込むため、どのモジュールよりも先に一時データベースを作る
+_db_dir = tempfile.mkdtemp(prefix='sv_ratings_test_')
+os.environ['DB_PATH'] = os.path.join(_db_dir, 'test.db')
+os.environ['DB_ARCHIVE_DIR'] = os.path.join(_db_dir, 'archive')
+
+
+def _create_schema():
+    """database.py（テーブル作成とマイグレーション）を一時ディレクトリで実行する（errorlog.txt もそこに作られる）"""
+    cwd = os.getcwd()
+    os.chdir(_db_dir)
+    try:
+        runpy.run_path(os.path.join(ROOT, 'database.py'))
+    finally:
+        os.chdir(cwd)
+
+
+_create_schema()
+
+# テストごとに空にするテーブル（外部キーの参照元を先に並べる）
+_TABLES = ['player_match', 'match_history', 'class_stats', 'pending_match', 'user_season_record', 'season', 'user']
+
+
+@pytest.fixture
+def session():
+    """テスト用のセッション。終了時に全テーブルを空にする"""
+    from data_access import SessionLocal, engine
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
+        with engine.begin() as conn:
+            for table in _TABLES:
+                conn.exec_driver_sql(f'DELETE FROM {table}')
+
+
+def make_pool(ratings, joined_at=0.0, first_id=0):
+    """ratings の順に Discord ID が first_id, first_id + 1, ... のユーザーを待機させた WaitingPool"""
+    from matchmaking import WaitingPool
+    pool = WaitingPool()
+    for n, rating in enumerate(ratings):
+        pool.add(rating, n, SimpleNamespace(id=first_id + n), joined_at=joined_at)
+    return pool
+
+
+def pair_ids(matches):
+    """組み合わせを (Discord ID, Discord ID) のソート済みリストにする"""
+    return sorted((entry1[2].id, entry2[2].id) for entry1, entry2 in matches)
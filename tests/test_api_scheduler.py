@@ -0,0 +1,66 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from api_scheduler import ApiScheduler, TokenBucket, PrioritySlots, PRIORITY_MATCH, PRIORITY_BACKGROUND
+
+
+def http_error(status):
+    return discord.HTTPException(SimpleNamespace(status=status, reason=''), '')
+
+
+def test_token_bucket_spaces_requests_after_burst():
+    bucket = TokenBucket(2, 1.0)
+    bucket.updated_at = 0.0
+    assert [bucket.reserve(now=0.0) for _ in range(4)] == [0, 0, 1.0, 2.0]
+    # 時間が経つと補充される
+    assert bucket.reserve(now=10.0) == 0
+    bucket.block(20.0)
+    assert bucket.reserve(now=15.0) == 5.0
+
+
+def test_priority_slots_hand_out_by_priority_then_arrival():
+    async def run():
+        slots = PrioritySlots(1)
+        order = []
+        await slots.acquire(PRIORITY_BACKGROUND)
+
+        async def wait(name, priority):
+            await slots.acquire(priority)
+            order.append(name)
+            slots.release()
+
+        waiters = [
+            asyncio.create_task(wait('background', PRIORITY_BACKGROUND)),
+            asyncio.create_task(wait('match1', PRIORITY_MATCH)),
+            asyncio.create_task(wait('match2', PRIORITY_MATCH)),
+        ]
+        await asyncio.sleep(0)
+        assert len(slots) == 3
+        slots.release()
+        await asyncio.gather(*waiters)
+        assert order == ['match1', 'match2', 'background']
+        assert slots.free == 1
+
+    asyncio.run(run())
+
+
+def test_call_does_not_retry_not_found():
+    async def run():
+        scheduler = ApiScheduler()
+        calls = []
+
+        async def request():
+            calls.append(1)
+            raise http_error(404)
+
+        with pytest.raises(discord.HTTPException):
+            await scheduler.call(('message', 1), request)
+        assert len(calls) == 1 and scheduler.in_flight == 0 and scheduler.slots.free > 0
+
+        assert await scheduler.call(('message', 1), lambda: asyncio.sleep(0, 'ok')) == 'ok'
+        assert scheduler.stats()['requests'] == {'message': 2}
+
+    asyncio.run(run())
@@ -0,0 +1,72 @@
+import time
+import threading
+
+from db_connection import connect, DB_BUSY_TIMEOUT_MS, DB_POOL_SIZE
+
+
+def test_connection_pragmas():
+    conn = connect()
+    try:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+        assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == DB_BUSY_TIMEOUT_MS
+    finally:
+        conn.close()
+
+
+def test_engine_pool_is_bounded():
+    from data_access import engine
+    assert engine.pool.size() == DB_POOL_SIZE
+
+
+def test_readers_do_not_block_result_writer(session):
+    """読み込みのトランザクションが開いたままでも、結果の書き込みが待たされずにコミットできる"""
+    setup = connect()
+    setup.executemany(
+        "INSERT INTO user (discord_id, user_name, shadowverse_id, rating) VALUES (?, ?, ?, 1500)",
+        [(str(n), f'user{n}', str(n)) for n in range(200)]
+    )
+    setup.commit()
+    setup.close()
+
+    stop = threading.Event()
+    errors = []
+    reads = [0]
+
+    def reader():
+        conn = connect()
+        try:
+            while not stop.is_set():
+                # 読み込みのトランザクションを開いたまま少し待つ（ランキングや戦績の表示を想定）
+                conn.execute('BEGIN')
+                conn.execute('SELECT COUNT(*), AVG(rating) FROM user').fetchone()
+                time.sleep(0.005)
+                conn.execute('SELECT MAX(rating) FROM user').fetchone()
+                conn.execute('COMMIT')
+                reads[0] += 1
+        except Exception as e:
+            errors.append(e)
+        finally:
+            conn.close()
+
+    readers = [threading.Thread(target=reader) for _ in range(8)]
+    for thread in readers:
+        thread.start()
+    try:
+        writer = connect()
+        slowest = 0
+        for n in range(100):
+            started_at = time.perf_counter()
+            writer.execute('UPDATE user SET rating = rating + 1, win_count = win_count + 1 WHERE discord_id = ?', (str(n),))
+            writer.commit()
+            slowest = max(slowest, time.perf_counter() - started_at)
+        writer.close()
+    finally:
+        stop.set()
+        for thread in readers:
+            thread.join()
+
+    assert not errors
+    assert reads[0] > 0
+    # ロールバックジャーナルでは読み込みが終わるまで COMMIT が待たされるが、WAL では待たない
+    assert slowest < 0.5
@@ -0,0 +1,95 @@
+import asyncio
+from types import SimpleNamespace
+
+import leaderboard as leaderboard_module
+from data_access import User
+from leaderboard import RankedBoard, Leaderboard, WIN_RATE_MIN_MATCHES
+
+
+def make_user(user_id, rating, stayed_rating=None, matched=1, wins=0, losses=0, max_streak=0):
+    return SimpleNamespace(
+        id=user_id, discord_id=str(1000 + user_id), user_name=f'user{user_id}', rating=rating, stayed_rating=stayed_rating,
+        win_count=wins, loss_count=losses, total_matches=wins + losses, max_win_streak=max_streak,
+        latest_season_matched=matched,
+    )
+
+
+def test_ranked_board_uses_sql_rank_for_ties():
+    board = RankedBoard()
+    for user_id, score in [(1, 1600), (2, 1700), (3, 1600), (4, 1500), (5, 1700)]:
+        board.set(user_id, score)
+    assert [board.rank(user_id) for user_id in range(1, 6)] == [3, 1, 3, 5, 1]
+    assert board.top(3) == [2, 5, 1]
+
+    board.set(2, 1400)
+    board.discard(5)
+    board.set(4, None)
+    assert len(board) == 3
+    assert [board.rank(user_id) for user_id in range(1, 6)] == [1, 3, 1, None, None]
+
+
+def test_leaderboard_boards_follow_updated_users():
+    board = Leaderboard()
+    board.update_users([
+        make_user(1, 1500, stayed_rating=1650),
+        make_user(2, 1600, wins=WIN_RATE_MIN_MATCHES, max_streak=7),
+        make_user(3, 1700, matched=0),
+    ])
+    # Stay 時のレートの方が高い場合はそちらで順位を付け、未参加のユーザーは載せない
+    assert (board.rank('rating', 1), board.rank('rating', 2), board.rank('rating', 3)) == (1, 2, None)
+    assert board.top('win_streak', 1)[0].user_id == 2
+    assert board.rank('win_rate', 1) is None and board.rank('win_rate', 2) == 1
+
+    version = board.version
+    board.update_users([make_user(2, 1600, matched=0)])
+    assert board.get(2) is None and board.rank('win_streak', 2) is None
+    assert board.version == version + 1
+
+
+def test_reload_reads_matched_users(session):
+    session.add_all([
+        User(discord_id=str(1000 + n), user_name=f'user{n}', shadowverse_id=str(n), rating=1500 + 10 * n,
+             win_count=0, loss_count=0, total_matches=0, max_win_streak=0, latest_season_matched=int(n != 0))
+        for n in range(5)
+    ])
+    session.commit()
+    board = Leaderboard()
+
+    async def run():
+        await asyncio.gather(board.ensure_loaded(), board.ensure_loaded())
+        return await board.rating_rank(session.query(User).filter_by(discord_id='1004').one().id)
+
+    assert asyncio.run(run()) == 1
+    assert board.loaded and len(board) == 4 and board.version == 1
+
+
+def test_reload_keeps_users_updated_while_reading(monkeypatch):
+    snapshot = []
+    release = []
+
+    async def run_db(load):
+        await release[0].wait()
+        return list(snapshot)
+
+    monkeypatch.setattr(leaderboard_module, 'run_db', run_db)
+    board = Leaderboard()
+
+    async def reload_while_updating(user_ids, newer):
+        release[:] = [asyncio.Event()]
+        task = asyncio.ensure_future(board.reload(user_ids))
+        await asyncio.sleep(0)
+        board.update_users([newer])
+        release[0].set()
+        await task
+
+    async def run():
+        # 全体の読み込み中に精算された 1 は、読み込んだ古い内容で上書きしない
+        snapshot[:] = [make_user(1, 1500), make_user(2, 1600)]
+        await reload_while_updating(None, make_user(1, 1700))
+        assert (board.get(1).rating, board.rank('rating', 1), board.get(2).rating) == (1700, 1, 1600)
+        # 一部の読み込みも同じ
+        snapshot[:] = [make_user(1, 1500)]
+        await reload_while_updating([1], make_user(1, 1800))
+        assert board.get(1).rating == 1800
+
+    asyncio.run(run())
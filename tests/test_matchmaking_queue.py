@@ -0,0 +1,104 @@
+import time
+import random
+from types import SimpleNamespace
+
+from matchmaking import (
+    WaitingPool, LatencyStats, MATCH_QUEUE_TIMEOUT, MATCH_RATING_WINDOW_INTERVAL, next_window_expansion
+)
+
+
+def add(pool, n, joined_at, rating=1500):
+    return pool.add(rating + n, n, SimpleNamespace(id=n), joined_at=joined_at)
+
+
+def test_pop_expired_returns_entries_past_deadline():
+    pool = WaitingPool()
+    add(pool, 1, joined_at=0.0)
+    add(pool, 2, joined_at=5.0)
+    assert pool.pop_expired(MATCH_QUEUE_TIMEOUT - 1) == []
+    expired = pool.pop_expired(MATCH_QUEUE_TIMEOUT)
+    assert [entry[2].id for entry in expired] == [1]
+    assert 1 not in pool and 2 in pool
+    assert [entry[2].id for entry in pool.pop_expired(MATCH_QUEUE_TIMEOUT + 5)] == [2]
+    assert len(pool) == 0
+
+
+def test_removed_and_readded_user_uses_new_deadline():
+    pool = WaitingPool()
+    add(pool, 1, joined_at=0.0)
+    pool.remove(1)
+    add(pool, 1, joined_at=30.0)
+    # 最初の待機の期限はトンボストーンとして捨てられる
+    assert pool.pop_expired(MATCH_QUEUE_TIMEOUT) == []
+    assert 1 in pool
+    assert [entry[2].id for entry in pool.pop_expired(30.0 + MATCH_QUEUE_TIMEOUT)] == [1]
+
+
+def test_next_event_time_follows_window_expansions_and_deadline():
+    pool = WaitingPool()
+    assert pool.next_event_time(0.0) is None
+    add(pool, 1, joined_at=0.0)
+    assert pool.next_event_time(0.0) == MATCH_RATING_WINDOW_INTERVAL
+    # 拡大の時刻を過ぎると次の拡大が登録される
+    assert pool.next_event_time(MATCH_RATING_WINDOW_INTERVAL) == next_window_expansion(0.0, MATCH_RATING_WINDOW_INTERVAL)
+    # 許容レート差が上限に達した後は待機期限だけが残る
+    assert pool.next_event_time(MATCH_QUEUE_TIMEOUT - 0.5) == MATCH_QUEUE_TIMEOUT
+    pool.remove(1)
+    assert pool.next_event_time(MATCH_QUEUE_TIMEOUT - 0.5) is None
+
+
+def test_event_heap_is_compacted_under_churn():
+    pool = WaitingPool()
+    add(pool, 0, joined_at=0.0)
+    for n in range(1, 5000):
+        add(pool, n, joined_at=0.0)
+        pool.remove(n)
+    # 無効なイベントは待機人数に比例する数までしか溜まらない
+    assert len(pool._events) <= 4 * len(pool) + 64 + 2
+    assert pool.next_event_time(0.0) == MATCH_RATING_WINDOW_INTERVAL
+
+
+def test_latency_percentiles_nearest_rank():
+    stats = LatencyStats()
+    assert stats.percentiles(50, 95) == {50: None, 95: None}
+    for n in range(1, 101):
+        stats.record(n / 1000)
+    assert stats.percentiles(50, 95, 99, 100) == {50: 0.05, 95: 0.095, 99: 0.099, 100: 0.1}
+    assert stats.percentiles(0) == {0: 0.001}
+
+
+def test_latency_stats_keeps_recent_samples():
+    stats = LatencyStats(max_samples=3)
+    for seconds in (10, 1, 2, 3):
+        stats.record(seconds)
+    assert stats.total_count == 4
+    assert stats.percentiles(100) == {100: 3}
+
+
+def test_enqueue_cancel_timeout_churn():
+    """待機・キャンセル・期限切れを繰り返した時の1操作あたりの時間（pytest -s で表示）"""
+    rng = random.Random(15)
+    pool = WaitingPool()
+    now = 0.0
+    operations = 0
+    expired = 0
+    started_at = time.perf_counter()
+    for n in range(20_000):
+        now += 0.01
+        add(pool, n, joined_at=now, rating=rng.randrange(1000, 2000))
+        if rng.random() < 0.5:
+            pool.remove(rng.randrange(n + 1))
+        expired += len(pool.pop_expired(now))
+        pool.next_event_time(now)
+        operations += 4
+    elapsed = time.perf_counter() - started_at
+    print(f"\nqueue churn: {elapsed / operations * 1e6:.2f} us/op, {expired} expired, {len(pool._events)} events for {len(pool)} queued")
+    assert all(now - pool.wait_time(entry[2].id, now) > now - MATCH_QUEUE_TIMEOUT for entry in pool)
+    assert len(pool._events) <= 4 * len(pool) + 64 + 2
+
+
+def test_next_window_expansion_is_always_after_now():
+    # 7.2 + 10 は浮動小数点では (now - joined_at) // 10 が 0 になる
+    joined_at = 7.199999999999891
+    now = joined_at + MATCH_RATING_WINDOW_INTERVAL
+    assert next_window_expansion(joined_at, now) > now
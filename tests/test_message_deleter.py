@@ -0,0 +1,38 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+
+from message_deleter import MessageDeleter
+
+
+class StubWebhook:
+    def __init__(self, webhook_id, missing=()):
+        self.id = webhook_id
+        self.missing = set(missing)
+        self.deleted = []
+
+    async def delete_message(self, message_id):
+        if message_id in self.missing:
+            raise discord.NotFound(SimpleNamespace(status=404, reason='Not Found'), 'Unknown Message')
+        self.deleted.append(message_id)
+
+
+def test_deletions_due_in_same_second_are_flushed_together():
+    async def run():
+        deleter = MessageDeleter()
+        webhook1, webhook2 = StubWebhook(1), StubWebhook(2, missing=[30])
+        interaction1 = SimpleNamespace(followup=webhook1)
+        interaction2 = SimpleNamespace(followup=webhook2)
+        deleter.delete_original_response_later(interaction1, 60)
+        deleter.delete_followup_later(interaction1, SimpleNamespace(id=10), 60)
+        deleter.delete_followup_later(interaction2, SimpleNamespace(id=30), 60)
+        assert len(deleter) == 3 and len(deleter._timers) == 1
+
+        await deleter._flush(next(iter(deleter._pending)))
+        assert len(deleter) == 0
+        assert webhook1.deleted == ['@original', 10] and webhook2.deleted == []
+        # 既に削除されたメッセージは失敗に数えない
+        assert (deleter.deleted_count, deleter.failed_count) == (2, 0)
+
+    asyncio.run(run())
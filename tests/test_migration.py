@@ -0,0 +1,74 @@
+import random
+import sqlite3
+
+from migration import _migrate_v3
+
+
+def make_v2_database(matches, users, open_season='S2'):
+    """player_match を作る前（v2）の対戦履歴だけを持つデータベース"""
+    conn = sqlite3.connect(':memory:')
+    conn.executescript('''
+    CREATE TABLE user (id INTEGER PRIMARY KEY, rating REAL, stay_flag INTEGER, total_matches INTEGER);
+    CREATE TABLE season (id INTEGER PRIMARY KEY, season_name TEXT, end_date TEXT);
+    CREATE TABLE match_history (
+        id INTEGER PRIMARY KEY, user1_id INTEGER, user2_id INTEGER, season_name TEXT, match_date TEXT,
+        user1_class_a TEXT, user1_class_b TEXT, user2_class_a TEXT, user2_class_b TEXT,
+        user1_rating_change REAL, user2_rating_change REAL, winner_user_id INTEGER
+    );
+    ''')
+    conn.executemany('INSERT INTO season VALUES (?, ?, ?)', [(1, 'S1', '2024-01-01'), (2, open_season, None)])
+    conn.executemany('INSERT INTO user VALUES (?, ?, ?, ?)', users)
+    conn.executemany('''
+    INSERT INTO match_history (id, user1_id, user2_id, season_name, match_date, user1_rating_change, user2_rating_change, winner_user_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', matches)
+    return conn
+
+
+def replay(matches, stays):
+    """試合を日付順に再生し、{(match_history_id, user_id): 対戦後のレート} と各ユーザーの最終状態を返す"""
+    ratings, counts, stayed = {}, {}, set()
+    rating_after = {}
+    for match_id, user1, user2, season_name, _, change1, change2, _ in sorted(matches, key=lambda m: (m[4], m[0])):
+        for user_id, change in ((user1, change1), (user2, change2)):
+            key = (user_id, season_name)
+            ratings[key] = ratings.get(key, 1500) + change
+            counts[key] = counts.get(key, 0) + 1
+            rating_after[(match_id, user_id)] = ratings[key]
+            # この試合の後に Stay する（レートと試合数が戻る）
+            if season_name == 'S2' and stays.get(user_id) == counts[key] and user_id not in stayed:
+                stayed.add(user_id)
+                ratings[key], counts[key] = 1500, 0
+    return rating_after, ratings, counts, stayed
+
+
+def test_rating_after_is_rebuilt_forward_including_stay():
+    rng = random.Random(2)
+    matches = []
+    for n in range(400):
+        user1, user2 = rng.sample(range(1, 11), 2)
+        season_name = 'S1' if n < 100 else 'S2'
+        change = rng.choice([-20, -12.5, 15, 20, 22.5])
+        matches.append((n + 1, user1, user2, season_name, f'2024-{n // 100 + 1:02d}-{n % 28 + 1:02d} 12:00:{n % 60:02d}',
+                        change, -change, user1 if change > 0 else user2))
+    stays = {1: 10, 4: 25, 7: 1}  # ユーザーID -> S2 で何試合目の後に Stay したか
+    rating_after, ratings, counts, stayed = replay(matches, stays)
+    assert stayed == set(stays)
+    users = [
+        (user_id, ratings.get((user_id, 'S2'), 1500), int(user_id in stayed), counts.get((user_id, 'S2'), 0))
+        for user_id in range(1, 11)
+    ]
+    conn = make_v2_database(matches, users)
+
+    _migrate_v3(conn.cursor())
+
+    rows = conn.execute('SELECT match_history_id, user_id, rating_after FROM player_match').fetchall()
+    assert len(rows) == 2 * len(matches)
+    assert {(match_id, user_id): after for match_id, user_id, after in rows} == rating_after
+    # 開催中のシーズンの最後の対戦後のレートは現在のレートと一致する
+    for user_id, rating, _, _ in users:
+        last = conn.execute(
+            "SELECT rating_after FROM player_match WHERE user_id = ? AND season_name = 'S2' ORDER BY id DESC LIMIT 1",
+            (user_id,)
+        ).fetchone()
+        assert last is None or last[0] == rating
@@ -0,0 +1,77 @@
+import random
+from types import SimpleNamespace
+
+from matchmaking import WaitingPool
+from conftest import make_pool, pair_ids
+
+
+def always(user1, user2):
+    return True
+
+
+def test_optimal_prefers_closer_pair_than_greedy():
+    # greedy はレートの低い 0 から組むため 0 と 1（差 290）を組ませ、1 と差 10 の 2 が余る
+    pool = make_pool([1500, 1790, 1800])
+    assert pair_ids(pool.find_matches(always, now=0.0)) == [(0, 1)]
+    assert pair_ids(pool.find_optimal_matches(always, now=0.0)) == [(1, 2)]
+
+
+def test_optimal_respects_can_pair():
+    pool = make_pool([1500, 1790, 1800])
+    can_pair = lambda user1, user2: {user1.id, user2.id} != {1, 2}
+    assert pair_ids(pool.find_optimal_matches(can_pair, now=0.0)) == [(0, 1)]
+
+
+def test_optimal_maximises_matches_before_rating_gap():
+    # 2組作れる場合は、レート差の合計が小さい1組より2組を優先する
+    pool = make_pool([1500, 1510, 1700, 1720, 1990])
+    assert pair_ids(pool.find_optimal_matches(always, now=0.0)) == [(0, 1), (2, 3)]
+    pool = make_pool([1500, 1790, 1800, 2080])
+    assert pair_ids(pool.find_optimal_matches(always, now=0.0)) == [(0, 1), (2, 3)]
+
+
+def test_optimal_respects_rating_window():
+    pool = make_pool([1500, 1900, 2300])
+    assert pool.find_optimal_matches(always, now=0.0) == []
+
+
+def test_falls_back_to_greedy_when_time_budget_runs_out():
+    rng = random.Random(12)
+    pool = make_pool([rng.randrange(1200, 1800) for _ in range(600)])
+    pool.find_matches = lambda can_pair, now=None: 'greedy'
+    assert pool.find_optimal_matches(always, now=0.0, time_budget=0) == 'greedy'
+    assert pool.find_optimal_matches(always, now=0.0, time_budget=10) != 'greedy'
+
+
+def simulate(select, seed, duration=600, arrival_rate=0.8, tick=1.0):
+    """
+    待機リストに一定の割合でプレイヤーが入り、tick 秒ごとに組み合わせを確定する簡易シミュレーター。
+    :return: (マッチ数, 平均待ち時間, 平均レート差, 期限切れの人数)
+    """
+    rng = random.Random(seed)
+    pool = WaitingPool()
+    waits, gaps, expired = [], [], 0
+    next_id = 0
+    now = 0.0
+    while now < duration:
+        for _ in range(sum(1 for _ in range(4) if rng.random() < arrival_rate / 4)):
+            pool.add(rng.gauss(1500, 250), next_id, SimpleNamespace(id=next_id), joined_at=now)
+            next_id += 1
+        expired += len(pool.pop_expired(now))
+        for entry1, entry2 in select(pool, now):
+            waits += [pool.wait_time(entry1[2].id, now), pool.wait_time(entry2[2].id, now)]
+            gaps.append(entry2[0] - entry1[0])
+            pool.remove(entry1[2].id)
+            pool.remove(entry2[2].id)
+        now += tick
+    return len(gaps), sum(waits) / len(waits), sum(gaps) / len(gaps), expired
+
+
+def test_simulated_greedy_and_optimal_modes():
+    """両方式の平均待ち時間と平均レート差を比べる（pytest -s で表示）"""
+    greedy = simulate(lambda pool, now: pool.find_matches(always, now), seed=1)
+    optimal = simulate(lambda pool, now: pool.find_optimal_matches(always, now), seed=1)
+    for name, (matched, wait, gap, expired) in (('greedy', greedy), ('optimal', optimal)):
+        print(f"\n{name}: {matched} matches, average wait {wait:.2f} s, average rating gap {gap:.1f}, expired {expired}")
+    assert greedy[0] > 0 and optimal[0] > 0
+    assert optimal[2] <= greedy[2]
@@ -0,0 +1,59 @@
+import asyncio
+
+from pipeline import OrderedWorkerPool
+
+
+def test_jobs_with_same_key_run_in_order_and_others_in_parallel():
+    async def run():
+        pool = OrderedWorkerPool(4, 'test')
+        log = []
+        running = [0]
+        peak = [0]
+
+        def job(name, seconds):
+            async def run_job():
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+                log.append(('start', name))
+                await asyncio.sleep(seconds)
+                log.append(('end', name))
+                running[0] -= 1
+            return run_job
+
+        # a1 と a2 はユーザー 1 を共有するため、a1 が終わるまで a2 は始まらない
+        pool.submit([1, 2], job('a1', 0.03))
+        pool.submit([1, 3], job('a2', 0.0))
+        pool.submit([4], job('b', 0.01))
+        pool.submit([5], job('c', 0.01))
+        pool.submit([6], job('d', 0.01))
+        await asyncio.wait_for(pool.queue.join(), 1)
+
+        assert log.index(('end', 'a1')) < log.index(('start', 'a2'))
+        assert log.index(('start', 'b')) < log.index(('end', 'a1'))
+        assert peak[0] <= 4
+        assert pool._tails == {}
+        for task in pool._tasks:
+            task.cancel()
+
+    asyncio.run(run())
+
+
+def test_failing_job_does_not_block_its_key():
+    async def run():
+        pool = OrderedWorkerPool(2, 'test')
+        done = []
+
+        async def fail():
+            raise RuntimeError('boom')
+
+        async def succeed():
+            done.append(True)
+
+        pool.submit([1], fail)
+        pool.submit([1], succeed)
+        await asyncio.wait_for(pool.queue.join(), 1)
+        assert done == [True]
+        for task in pool._tasks:
+            task.cancel()
+
+    asyncio.run(run())
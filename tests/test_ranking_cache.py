@@ -0,0 +1,48 @@
+import asyncio
+from types import SimpleNamespace
+
+import ranking_cache as ranking_cache_module
+from leaderboard import Leaderboard
+from ranking_cache import RankingCache
+
+
+def make_user(user_id, rating):
+    return SimpleNamespace(
+        id=user_id, discord_id=str(user_id), user_name=f'user{user_id}', rating=rating, stayed_rating=None,
+        win_count=0, loss_count=0, total_matches=0, max_win_streak=0, latest_season_matched=1,
+    )
+
+
+def test_cache_is_versioned_by_leaderboard(monkeypatch):
+    board = Leaderboard()
+    board.loaded = True
+    board.update_users([make_user(1, 1600), make_user(2, 1500)])
+    season_reads = []
+
+    async def run_db(func):
+        season_reads.append(func)
+        return 'S1'
+
+    monkeypatch.setattr(ranking_cache_module, 'leaderboard', board)
+    monkeypatch.setattr(ranking_cache_module, 'run_db', run_db)
+
+    async def run():
+        cache = RankingCache()
+        first = await asyncio.gather(cache.get('rating'), cache.get('rating'))
+        assert first[0] is first[1] and first[0] == ('S1', [('user1', 1600, 1600, None), ('user2', 1500, 1500, None)])
+        assert await cache.get('rating') is first[0]
+        assert (cache.miss_count, cache.hit_count, cache.refresh_count) == (2, 1, 1)
+
+        # 精算でバージョンが進むと、古いものをすぐ返して裏で作り直す
+        board.update_users([make_user(2, 1700)])
+        assert await cache.get('rating') is first[0]
+        await asyncio.sleep(0)
+        updated = await cache.get('rating')
+        assert updated[1][0][0] == 'user2' and cache.stale_count == 1
+
+        # allow_stale=False は作り直しを待つ
+        cache.invalidate()
+        assert await cache.get('rating', allow_stale=False) is not updated
+        assert cache.refresh_count == 3 and len(season_reads) == 3
+
+    asyncio.run(run())
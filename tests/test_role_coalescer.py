@@ -0,0 +1,50 @@
+import asyncio
+from types import SimpleNamespace
+
+from role_coalescer import RoleCoalescer
+
+
+class StubMember:
+    """add_roles / remove_roles の呼び出しを記録するメンバー（guild.get_member は自分を返す）"""
+    def __init__(self, member_id, roles=()):
+        self.id = member_id
+        self.display_name = f'member{member_id}'
+        self.roles = list(roles)
+        self.guild = SimpleNamespace(id=1, get_member=lambda _: self)
+        self.calls = []
+
+    async def add_roles(self, *roles):
+        self.calls.append(('add', roles))
+
+    async def remove_roles(self, *roles):
+        self.calls.append(('remove', roles))
+
+
+class StubRole:
+    def __init__(self, name):
+        self.name = name
+
+
+def test_changes_are_coalesced_per_member():
+    async def run():
+        coalescer = RoleCoalescer(window=0.01)
+        playing, waiting, admin = StubRole('試合中'), StubRole('マッチング中'), StubRole('運営')
+        member = StubMember(1, roles=[waiting, admin])
+        await asyncio.gather(
+            coalescer.change(member, waiting, False),
+            coalescer.change(member, playing, True),
+            coalescer.change(member, StubRole('一時'), True),
+        )
+        # 変更するロールだけを送り、運営ロールには触れない
+        assert sorted(call[0] for call in member.calls) == ['add', 'remove']
+        assert dict(member.calls)['remove'] == (waiting,)
+        assert coalescer.edit_count == 2 and coalescer.request_count == 3
+
+        # 追加と削除が打ち消し合う場合と、直前に反映した状態と同じ場合はリクエストを送らない
+        member.calls.clear()
+        temporary = StubRole('一時2')
+        await asyncio.gather(coalescer.change(member, temporary, True), coalescer.change(member, temporary, False))
+        await coalescer.change(member, playing, True)
+        assert member.calls == [] and coalescer.skipped_count == 2
+
+    asyncio.run(run())
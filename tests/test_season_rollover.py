@@ -0,0 +1,185 @@
+import random
+from datetime import datetime
+
+from data_access import User, Season, UserSeasonRecord
+from season_rollover import totalize_season, roll_over_season
+
+
+def reference_totalize_season(session, season_id):
+    """
+    以前の WinRecord.totalize_season（ユーザーごとに処理する実装）から session.commit() を除いたもの。
+    stay_flag = 1 で stayed_rating が NULL の場合、以前の実装は rating > None で例外になっていたため、
+    SQL の COALESCE(rating > stayed_rating, 0) と同じく上書きしない扱いにしている。
+    """
+    users = session.query(User).filter(User.latest_season_matched == True).all()
+
+    user_final_ratings = []
+    for user in users:
+        final_rating = max(user.rating, user.stayed_rating or 0)
+        user_final_ratings.append((user.id, final_rating))
+    user_final_ratings.sort(key=lambda x: x[1], reverse=True)
+
+    user_rankings = {}
+    current_rank = 1
+    previous_rating = None
+    for idx, (user_id, final_rating) in enumerate(user_final_ratings):
+        if final_rating != previous_rating:
+            current_rank = idx + 1
+        user_rankings[user_id] = current_rank
+        previous_rating = final_rating
+
+    def overwrite(record, rating, user):
+        record.rating = rating
+        record.win_count = user.win_count
+        record.loss_count = user.loss_count
+        record.total_matches = user.total_matches
+        record.max_win_streak = user.max_win_streak
+        record.rank = user_rankings[user.id]
+
+    def create(rating, user):
+        session.add(UserSeasonRecord(
+            user_id=user.id,
+            season_id=season_id,
+            rating=rating,
+            rank=user_rankings[user.id],
+            win_count=user.win_count,
+            loss_count=user.loss_count,
+            total_matches=user.total_matches,
+            max_win_streak=user.max_win_streak,
+        ))
+
+    for user in users:
+        final_rating = max(user.rating, user.stayed_rating or 0)
+        existing_record = session.query(UserSeasonRecord).filter_by(user_id=user.id, season_id=season_id).first()
+        if user.stay_flag == 1:
+            if user.stayed_rating is not None and user.rating > user.stayed_rating:
+                if existing_record:
+                    overwrite(existing_record, user.rating, user)
+                else:
+                    create(user.rating, user)
+            elif existing_record:
+                existing_record.rank = user_rankings[user.id]
+        elif existing_record:
+            overwrite(existing_record, final_rating, user)
+        else:
+            create(final_rating, user)
+    session.flush()
+
+
+def season_records(session):
+    return sorted(
+        (r.user_id, r.season_id, r.rating, r.rank, r.win_count, r.loss_count, r.total_matches, r.max_win_streak)
+        for r in session.query(UserSeasonRecord).all()
+    )
+
+
+def add_season(session, name='S1'):
+    season = Season(season_name=name, start_date=datetime.now(), created_at=datetime.now())
+    session.add(season)
+    session.flush()
+    return season
+
+
+def add_user(session, n, rating, stayed_rating=None, stay_flag=0, matched=1, wins=3, losses=2, max_streak=2, trust_points=100):
+    user = User(
+        discord_id=str(1000 + n), user_name=f'user{n}', shadowverse_id=str(n),
+        rating=rating, stayed_rating=stayed_rating, stay_flag=stay_flag, latest_season_matched=matched,
+        win_count=wins, loss_count=losses, total_matches=wins + losses,
+        win_streak=1, max_win_streak=max_streak, trust_points=trust_points,
+    )
+    session.add(user)
+    session.flush()
+    return user
+
+
+def add_record(session, user, season, rating=1400, rank=99):
+    session.add(UserSeasonRecord(
+        user_id=user.id, season_id=season.id, rating=rating, rank=rank,
+        win_count=1, loss_count=1, total_matches=2, max_win_streak=1,
+    ))
+    session.flush()
+
+
+def assert_same_as_reference(session, season_id):
+    session.commit()
+    reference_totalize_season(session, season_id)
+    expected = season_records(session)
+    session.rollback()
+
+    totalize_season(session, season_id)
+    session.flush()
+    assert season_records(session) == expected
+    return expected
+
+
+def test_stay_flag_branches_ties_and_null_stayed_rating(session):
+    season = add_season(session)
+    other_season = add_season(session, 'S0')
+    # stay_flag = 0: 新規作成・既存の上書き（Stay 時のレートの方が高い場合はそちらを使う）
+    new_user = add_user(session, 1, 1600)
+    overwritten = add_user(session, 2, 1550, stayed_rating=1700)
+    add_record(session, overwritten, season)
+    null_stayed = add_user(session, 3, 1580, stayed_rating=None)
+    # stay_flag = 1: Stay 後のレートの方が高い場合は上書き、低い場合は順位のみ更新、レコードがなければ何もしない
+    stay_better = add_user(session, 4, 1650, stayed_rating=1600, stay_flag=1)
+    add_record(session, stay_better, season)
+    stay_worse = add_user(session, 5, 1500, stayed_rating=1700, stay_flag=1)
+    add_record(session, stay_worse, season)
+    stay_worse_no_record = add_user(session, 6, 1500, stayed_rating=1620, stay_flag=1)
+    stay_null_stayed = add_user(session, 7, 1590, stayed_rating=None, stay_flag=1)
+    add_record(session, stay_null_stayed, season)
+    # 同じ最終レートは同順位（RANK）: 1600 が3人、1650 が1人、1700 が2人
+    tied = add_user(session, 8, 1600)
+    # 最新シーズンでマッチングしていないユーザーと、他のシーズンのレコードは変更しない
+    not_matched = add_user(session, 9, 1900, matched=0)
+    add_record(session, not_matched, season, rank=5)
+    add_record(session, new_user, other_season, rank=7)
+
+    records = {row[0]: row for row in assert_same_as_reference(session, season.id) if row[1] == season.id}
+
+    assert records[stay_worse.id][3] == records[overwritten.id][3] == 1
+    assert records[stay_better.id][3] == 3
+    assert records[new_user.id][3] == records[tied.id][3] == 5
+    assert records[stay_worse.id][2] == 1400  # 順位のみ更新
+    assert records[stay_better.id][2] == 1650
+    assert records[null_stayed.id][2] == 1580
+    assert records[stay_null_stayed.id][2] == 1400  # stayed_rating が NULL の場合は上書きしない
+    assert stay_worse_no_record.id not in records
+    assert records[not_matched.id][3] == 5
+
+
+def test_randomised_users_match_reference(session):
+    rng = random.Random(20240601)
+    season = add_season(session)
+    for n in range(300):
+        stay_flag = rng.random() < 0.3
+        stayed_rating = rng.choice([None, rng.randrange(1400, 1700, 25)]) if rng.random() < 0.5 or stay_flag else None
+        user = add_user(
+            session, n, rng.randrange(1400, 1700, 25), stayed_rating=stayed_rating, stay_flag=int(stay_flag),
+            matched=int(rng.random() < 0.9), wins=rng.randrange(30), losses=rng.randrange(30), max_streak=rng.randrange(10)
+        )
+        if rng.random() < 0.4:
+            add_record(session, user, season, rating=rng.randrange(1400, 1700), rank=rng.randrange(1, 300))
+
+    assert_same_as_reference(session, season.id)
+
+
+def test_roll_over_season_closes_season_and_resets_users(session):
+    season = add_season(session)
+    add_user(session, 1, 1700, stayed_rating=1650, stay_flag=1, trust_points=99)
+    add_user(session, 2, 1450, trust_points=100)
+    session.commit()
+
+    assert roll_over_season(session).id == season.id
+    session.commit()
+    session.expire_all()
+
+    assert session.query(Season).get(season.id).end_date is not None
+    assert len(session.query(UserSeasonRecord).filter_by(season_id=season.id).all()) == 2
+    for user in session.query(User).all():
+        assert (user.rating, user.stayed_rating, user.stay_flag, user.latest_season_matched) == (1500, None, 0, 0)
+        assert (user.win_count, user.loss_count, user.total_matches, user.win_streak, user.max_win_streak) == (0, 0, 0, 0, 0)
+        assert user.trust_points == 100
+
+    # 終了済みのシーズンしかない場合は何もしない
+    assert roll_over_season(session) is None
@@ -0,0 +1,136 @@
+import time
+import pytest
+
+from data_access import User, MatchHistory, PlayerMatch, session_scope
+from settlement import calculate_rating_change, settle_match, settle_pending_match
+from pending_match import save_pending_match
+
+
+def add_users(session, *ratings):
+    users = [
+        User(discord_id=str(1000 + n), user_name=f'user{n}', shadowverse_id=str(n), rating=rating,
+             win_count=0, loss_count=0, total_matches=0, win_streak=0, max_win_streak=0, latest_season_matched=0)
+        for n, rating in enumerate(ratings)
+    ]
+    session.add_all(users)
+    session.commit()
+    return users
+
+
+def test_calculate_rating_change():
+    assert calculate_rating_change(1500, 1500, 2, 1) == 20
+    assert calculate_rating_change(1500, 1500, 1, 2) == -20
+    # レートの高い方が勝つと増加量が減り、負けると減少量が増える
+    assert calculate_rating_change(1600, 1500, 2, 0) == 17.5
+    assert calculate_rating_change(1600, 1500, 0, 2) == -22.5
+    assert calculate_rating_change(1500, 1600, 2, 0) == 22.5
+    assert calculate_rating_change(1500, 1600, 0, 2) == -17.5
+
+
+def test_settle_match_updates_players_and_history(session):
+    user1, user2 = add_users(session, 1600, 1500)
+    user1.win_streak, user1.max_win_streak = 2, 2
+    user2.win_streak, user2.max_win_streak = 3, 5
+    session.commit()
+
+    settlement1, settlement2 = settle_match(
+        session, 1000, 1001, 2, 1, 1, 'S1', ('エルフ', 'ロイヤル'), ('ウィッチ', 'ドラゴン')
+    )
+    session.commit()
+
+    assert settlement1[1:] == (1600, 1617.5, 17.5)
+    assert settlement2[1:] == (1500, 1482.5, -17.5)
+    assert settlement1.user.id == user1.id and settlement2.user.id == user2.id
+
+    session.expire_all()
+    winner, loser = session.query(User).get(user1.id), session.query(User).get(user2.id)
+    assert (winner.rating, winner.win_count, winner.loss_count, winner.total_matches) == (1617.5, 1, 0, 1)
+    assert (loser.rating, loser.win_count, loser.loss_count, loser.total_matches) == (1482.5, 0, 1, 1)
+    assert (winner.win_streak, winner.max_win_streak) == (3, 3)
+    assert (loser.win_streak, loser.max_win_streak) == (0, 5)
+    assert winner.latest_season_matched and loser.latest_season_matched
+
+    history = session.query(MatchHistory).one()
+    assert (history.winner_user_id, history.loser_user_id, history.season_id) == (user1.id, user2.id, 1)
+    assert (history.user1_rating_change, history.user2_rating_change) == (17.5, -17.5)
+    player_matches = {row.user_id: row for row in session.query(PlayerMatch).all()}
+    assert player_matches[user1.id].won and not player_matches[user2.id].won
+    assert player_matches[user1.id].opponent_id == user2.id
+    assert player_matches[user2.id].rating_after == 1482.5
+    assert player_matches[user1.id].match_history_id == history.id
+
+
+def test_settle_match_with_unknown_player_changes_nothing(session):
+    user1, = add_users(session, 1500)
+    with pytest.raises(ValueError):
+        with session_scope() as scoped:
+            settle_match(scoped, 1000, 9999, 2, 0, 1, 'S1', (None, None), (None, None))
+
+    session.expire_all()
+    assert session.query(User).get(user1.id).rating == 1500
+    assert session.query(MatchHistory).count() == 0
+
+
+def test_settle_pending_match_settles_once(session):
+    """同じスレッドの精算を2回呼んでも、レートと対戦履歴は1回分だけ反映される"""
+    user1, user2 = add_users(session, 1500, 1500)
+    save_pending_match(session, 555, 1000, 1001, {})
+    session.commit()
+
+    args = (555, 1000, 1001, 2, 0, 1, 'S1', (None, None), (None, None))
+    with session_scope() as scoped:
+        first = settle_pending_match(scoped, *args)
+    with session_scope() as scoped:
+        second = settle_pending_match(scoped, *args)
+
+    assert first[0].rating_after == 1520 and second is None
+    session.expire_all()
+    assert session.query(User).get(user1.id).rating == 1520
+    assert session.query(User).get(user2.id).total_matches == 1
+    assert session.query(MatchHistory).count() == 1
+    assert session.query(PlayerMatch).count() == 2
+
+
+def legacy_settle(player1_discord_id, player2_discord_id, player1_wins, player2_wins, season_id):
+    """以前の check_results と同じく、レート・対戦履歴・マッチングフラグを別々のトランザクションで更新する"""
+    with session_scope() as session:
+        user1 = session.query(User).filter_by(discord_id=str(player1_discord_id)).first()
+        user2 = session.query(User).filter_by(discord_id=str(player2_discord_id)).first()
+        change1 = calculate_rating_change(user1.rating, user2.rating, player1_wins, player2_wins)
+        change2 = calculate_rating_change(user2.rating, user1.rating, player2_wins, player1_wins)
+        user1.rating += change1
+        user2.rating += change2
+    with session_scope() as session:
+        user1 = session.query(User).filter_by(discord_id=str(player1_discord_id)).first()
+        user2 = session.query(User).filter_by(discord_id=str(player2_discord_id)).first()
+        winner, loser = (user1, user2) if player1_wins > player2_wins else (user2, user1)
+        winner.win_count += 1
+        loser.loss_count += 1
+        for user in (user1, user2):
+            user.total_matches += 1
+        session.add(MatchHistory(user1_id=user1.id, user2_id=user2.id, season_id=season_id,
+                                 winner_user_id=winner.id, loser_user_id=loser.id))
+    with session_scope() as session:
+        for discord_id in (player1_discord_id, player2_discord_id):
+            session.query(User).filter_by(discord_id=str(discord_id)).first().latest_season_matched = True
+
+
+def test_settlement_throughput(session):
+    """1試合ずつ run_db と同じくセッションを分けて精算し、1秒あたりの精算数を以前の方式と比べる"""
+    add_users(session, *([1500] * 20))
+    matches = [(1000 + n % 20, 1000 + (n + 1) % 20) for n in range(200)]
+
+    def measure(settle):
+        started_at = time.perf_counter()
+        for player1, player2 in matches:
+            settle(player1, player2)
+        return len(matches) / (time.perf_counter() - started_at)
+
+    def single_transaction(player1, player2):
+        with session_scope() as scoped:
+            settle_match(scoped, player1, player2, 2, 1, 1, 'S1', (None, None), (None, None))
+
+    legacy_rate = measure(lambda player1, player2: legacy_settle(player1, player2, 2, 1, 1))
+    rate = measure(single_transaction)
+    print(f"\nsettled matches/s: single transaction {rate:.0f}, previous three transactions {legacy_rate:.0f}")
+    assert rate > 0 and legacy_rate > 0
@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+import asyncio
+import subprocess
+
+from conftest import ROOT
+from data_access import User, run_db
+from leaderboard import Leaderboard
+from pending_match import save_pending_match, load_pending_matches
+
+# 起動時のチャンネルの初期化（purge + 案内メッセージの送信）1回分として待つ時間（秒）
+DISCORD_CALL_SECONDS = 0.05
+
+
+def import_seconds(statement):
+    """新しいプロセスで statement を実行し、その時間（秒）と読み込まれた matplotlib の有無を返す"""
+    code = (
+        "import sys, time\n"
+        "started_at = time.perf_counter()\n"
+        f"{statement}\n"
+        "print(time.perf_counter() - started_at, 'matplotlib' in sys.modules)\n"
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', code], cwd=ROOT, env=os.environ.copy(), capture_output=True, text=True, check=True
+    ).stdout.split()
+    return float(output[0]), output[1] == 'True'
+
+
+def test_module_import_times():
+    """スキーマの読み込み（automap）と win_record の読み込み時間（pytest -s で表示）"""
+    reflection, _ = import_seconds("import data_access")
+    lazy, lazy_loaded = import_seconds("import win_record")
+    # 以前は win_record の読み込み時に matplotlib.pyplot も読み込んでいた
+    eager, _ = import_seconds("import win_record\nimport matplotlib.pyplot")
+    print(f"\nimport data_access (automap): {reflection * 1000:.0f} ms")
+    print(f"import win_record: {lazy * 1000:.0f} ms (with matplotlib.pyplot {eager * 1000:.0f} ms)")
+    assert not lazy_loaded
+
+
+class StubChannel:
+    """purge と send に一定の時間がかかるチャンネル"""
+    async def purge(self):
+        await asyncio.sleep(DISCORD_CALL_SECONDS / 2)
+
+    async def send(self, content=None, view=None):
+        await asyncio.sleep(DISCORD_CALL_SECONDS / 2)
+
+
+async def reset_channel(channel):
+    await channel.purge()
+    await channel.send()
+
+
+def add_users_and_matches(session, users, matches):
+    session.add_all(
+        User(discord_id=str(1000 + n), user_name=f'user{n}', shadowverse_id=str(n), rating=1500 + n % 300,
+             win_count=0, loss_count=0, total_matches=0, win_streak=0, max_win_streak=0, latest_season_matched=1)
+        for n in range(users)
+    )
+    for n in range(matches):
+        save_pending_match(session, 9000 + n, 1000 + 2 * n, 1001 + 2 * n, {})
+    session.commit()
+
+
+def test_gathered_startup_work(session):
+    """on_ready の初期化を順番に行った場合と並行した場合の時間（pytest -s で表示）"""
+    add_users_and_matches(session, 2000, 50)
+    channels = [StubChannel() for _ in range(4)]  # 過去ランキング・ようこそ・マッチング・プロフィール
+
+    def startup_work():
+        return [
+            *(reset_channel(channel) for channel in channels),
+            asyncio.sleep(DISCORD_CALL_SECONDS),  # bot.sync_commands
+            run_db(load_pending_matches),  # restore_pending_matches
+            Leaderboard().ensure_loaded(),
+        ]
+
+    async def sequential():
+        for work in startup_work():
+            await work
+
+    async def gathered():
+        await asyncio.gather(*startup_work())
+
+    def measure(run):
+        started_at = time.perf_counter()
+        asyncio.run(run())
+        return time.perf_counter() - started_at
+
+    before = measure(sequential)
+    after = measure(gathered)
+    print(f"\nstartup work: sequential {before * 1000:.0f} ms, gathered {after * 1000:.0f} ms")
+    assert after < before
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+import timer_wheel
+from timer_wheel import TimerWheel
+
+START = 1_000_000
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """timer_wheel が参照する time.time を手動で進める時計に置き換える"""
+    now = [float(START)]
+    monkeypatch.setattr(timer_wheel.time, 'time', lambda: now[0])
+    return now
+
+
+def make_wheel(slots=8, levels=3):
+    wheel = TimerWheel('test', slots=slots, levels=levels)
+    # タスクを起動せず、_advance を直接呼んで時刻を進める
+    wheel._task = object()
+    wheel._wakeup = asyncio.Event()
+    return wheel
+
+
+def run_until(wheel, clock, end_tick):
+    """end_tick まで1ティックずつ進め、{キー: 実行されたティック} を返す"""
+    fired = {}
+    while wheel._current_tick < end_tick:
+        clock[0] = wheel._current_tick + 1
+        for key, _ in wheel._advance():
+            fired[key] = wheel._current_tick
+    return fired
+
+
+def test_timers_fire_at_their_tick_across_levels_and_overflow(clock):
+    # slots=8, levels=3 では 1段目が 8 ティック、2段目が 64 ティック、3段目が 512 ティックを受け持ち、それより先は overflow
+    wheel = make_wheel()
+    delays = [1, 2, 7, 8, 9, 63, 64, 65, 100, 511, 512, 513, 1000, 4097, 5000]
+    for delay in delays:
+        wheel.schedule(delay, START + delay, None)
+    assert wheel._overflow  # 範囲外の期限がある
+
+    fired = run_until(wheel, clock, START + 6000)
+    assert fired == {delay: START + delay for delay in delays}
+    assert len(wheel) == 0
+
+
+def test_past_deadline_fires_on_next_tick(clock):
+    wheel = make_wheel()
+    wheel.schedule('late', START - 30, None)
+    assert run_until(wheel, clock, START + 3) == {'late': START + 1}
+
+
+def test_cancel_and_reschedule_invalidate_old_timer(clock):
+    wheel = make_wheel()
+    wheel.schedule('cancelled', START + 70, None)
+    wheel.schedule('moved', START + 600, None)
+    wheel.schedule('moved', START + 5, None)
+    assert wheel.cancel('cancelled') and not wheel.cancel('cancelled')
+    assert len(wheel) == 1 and 'moved' in wheel
+
+    assert run_until(wheel, clock, START + 1000) == {'moved': START + 5}
+
+
+def test_schedule_after_idle_starts_from_current_time(clock):
+    wheel = make_wheel()
+    # 空の間に時計だけが進んでも、期限は登録時の時刻から数える
+    clock[0] = START + 10_000.0
+    wheel.schedule('after_idle', START + 10_003, None)
+    assert wheel._current_tick == START + 10_000
+    assert run_until(wheel, clock, START + 10_010) == {'after_idle': START + 10_003}
+
+
+def test_run_fires_callbacks():
+    async def run():
+        fired = asyncio.Event()
+
+        async def callback():
+            fired.set()
+
+        wheel = TimerWheel('test', tick=0.01)
+        wheel.schedule('key', timer_wheel.time.time() + 0.03, callback)
+        await asyncio.wait_for(fired.wait(), 1)
+        wheel._task.cancel()
+
+    asyncio.run(run())
@@ -0,0 +1,87 @@
+import time
+import random
+from types import SimpleNamespace
+import pytest
+
+from matchmaking import WaitingPool, MATCH_RATING_WINDOW, rating_window
+from conftest import make_pool, pair_ids
+
+
+def reference_find_matches(pool, can_pair, now):
+    """find_matches と同じ規則（レートの低い順に、許容レート差以内で最も近い相手）を全ペアの走査で求める"""
+    entries = list(pool)
+    matched_ids = set()
+    matches = []
+    for i, entry in enumerate(entries):
+        if entry[2].id in matched_ids:
+            continue
+        for candidate in entries[i + 1:]:
+            window = max(rating_window(pool.wait_time(entry[2].id, now)), rating_window(pool.wait_time(candidate[2].id, now)))
+            if candidate[2].id in matched_ids or candidate[0] - entry[0] > window or not can_pair(entry[2], candidate[2]):
+                continue
+            matched_ids.update([entry[2].id, candidate[2].id])
+            matches.append((entry, candidate))
+            break
+    return matches
+
+
+def test_add_remove_and_membership():
+    pool = make_pool([1600, 1500, 1700], first_id=10_000)
+    assert len(pool) == 3 and 10_000 in pool
+    assert [entry[0] for entry in pool] == [1500, 1600, 1700]
+    assert not pool.add(1550, 0, SimpleNamespace(id=10_000))  # 既に待機中
+    assert pool.remove(10_001)
+    assert not pool.remove(10_001)
+    assert 10_001 not in pool and [entry[0] for entry in pool] == [1600, 1700]
+
+
+def test_candidates_are_within_window_and_nearest_first():
+    pool = make_pool([1500, 1900, 1550, 1801, 1700], first_id=10_000)
+    assert [entry[0] for entry in pool.candidates(0, 300)] == [1550, 1700]
+
+
+def test_find_matches_pairs_nearest_within_window():
+    pool = make_pool([1500, 1520, 1900, 2300], first_id=10_000)
+    assert pair_ids(pool.find_matches(lambda user1, user2: True, now=0.0)) == [(10_000, 10_001)]
+
+
+def test_find_matches_respects_can_pair():
+    pool = make_pool([1500, 1510, 1520], first_id=10_000)
+    # 前回の対戦相手同士は組まない
+    can_pair = lambda user1, user2: {user1.id, user2.id} != {10_000, 10_001}
+    assert pair_ids(pool.find_matches(can_pair, now=0.0)) == [(10_000, 10_002)]
+
+
+def test_find_matches_uses_wider_window_of_longer_waiter():
+    gap = MATCH_RATING_WINDOW + 40
+    pool = WaitingPool()
+    pool.add(1500, 0, SimpleNamespace(id=1), joined_at=0.0)
+    pool.add(1500 + gap, 1, SimpleNamespace(id=2), joined_at=0.0)
+    assert pool.find_matches(lambda user1, user2: True, now=0.0) == []
+
+    # 後から来た相手の許容レート差が狭くても、長く待っている方の許容レート差で組める
+    wait = next(seconds for seconds in range(1, 600) if rating_window(seconds) >= gap)
+    pool.remove(2)
+    pool.add(1500 + gap, 1, SimpleNamespace(id=2), joined_at=float(wait))
+    assert pair_ids(pool.find_matches(lambda user1, user2: True, now=float(wait))) == [(1, 2)]
+
+
+def test_find_matches_equals_pairwise_scan():
+    rng = random.Random(11)
+    pool = WaitingPool()
+    for n in range(300):
+        pool.add(rng.randrange(1000, 2500), n, SimpleNamespace(id=n), joined_at=rng.uniform(0, 60))
+    can_pair = lambda user1, user2: (user1.id + user2.id) % 7 != 0
+    assert pair_ids(pool.find_matches(can_pair, now=60.0)) == pair_ids(reference_find_matches(pool, can_pair, 60.0))
+
+
+@pytest.mark.parametrize('queued', [100, 1_000, 10_000])
+def test_find_matches_latency(queued):
+    """待機人数ごとのマッチング1回分の時間（pytest -s で表示）"""
+    rng = random.Random(queued)
+    pool = make_pool([rng.gauss(1500, 200) for _ in range(queued)])
+    started_at = time.perf_counter()
+    matches = pool.find_matches(lambda user1, user2: True, now=0.0)
+    elapsed = time.perf_counter() - started_at
+    print(f"\nfind_matches with {queued} queued: {elapsed * 1000:.2f} ms, {len(matches)} matches")
+    assert len(matches) == queued // 2
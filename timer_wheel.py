@@ -0,0 +1,113 @@
+import math
+import time
+import asyncio
+import logging
+
+
+class TimerWheel:
+    """
+    階層型タイマーホイール。期限付きの処理を1つのタスクでまとめて実行する。
+    1段目は tick 秒ごとのスロット、2段目以降は1つ下の段の1周分を1スロットとし、
+    上の段のスロットは時刻が進んだときに下の段へ振り分け直す。
+    ホイール全体の範囲を超える期限は、最上段が1周するたびに振り分け直す。
+
+    タイマーはキーで識別し、同じキーで登録し直すと古い方は無効になる。
+    キャンセルや登録し直しで無効になった要素はスロットに残るが、そのスロットの処理時に捨てられる。
+    """
+    def __init__(self, name, tick=1.0, slots=64, levels=3):
+        self.name = name
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._overflow = []  # ホイールの範囲を超える要素
+        self._timers = {}  # キー -> (期限のティック, 処理)
+        self._current_tick = int(time.time() // tick)  # 処理済みの最後のティック
+        self._wakeup = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def _tick_of(self, timestamp):
+        return math.ceil(timestamp / self.tick)
+
+    def schedule(self, key, deadline, callback):
+        """
+        deadline（UNIX時刻）に callback() を実行する。期限を過ぎている場合は次のティックで実行する。
+        :param callback: 引数なしで呼び出せるコルーチン関数
+        """
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        if not self._timers:
+            # 空の間は時刻を進めていないため、現在時刻に合わせる
+            self._current_tick = max(self._current_tick, int(time.time() // self.tick))
+        timer = (max(self._tick_of(deadline), self._current_tick + 1), callback)
+        self._timers[key] = timer
+        self._place(key, timer)
+        self._wakeup.set()
+
+    def cancel(self, key):
+        """タイマーを取り消す（登録されていなかった場合は False）"""
+        return self._timers.pop(key, None) is not None
+
+    def _place(self, key, timer):
+        target_tick = timer[0]
+        for level in range(self.levels):
+            span = self.slots ** (level + 1)
+            # 1つ上の段で同じスロットに入る範囲なら、この段に置く
+            if target_tick // span == self._current_tick // span:
+                self._wheels[level][(target_tick // self.slots ** level) % self.slots].append((key, timer))
+                return
+        self._overflow.append((key, timer))
+
+    def _advance(self):
+        """1ティック進め、期限を迎えたタイマーを返す"""
+        self._current_tick += 1
+        # 上の段から順に、新しく始まる区間のスロットを下の段へ振り分け直す
+        if self._current_tick % self.slots ** self.levels == 0:
+            overflow, self._overflow = self._overflow, []
+            for key, timer in overflow:
+                self._place(key, timer)
+        for level in range(self.levels - 1, 0, -1):
+            if self._current_tick % self.slots ** level == 0:
+                slot = self._wheels[level][(self._current_tick // self.slots ** level) % self.slots]
+                entries = list(slot)
+                slot.clear()
+                for key, timer in entries:
+                    if self._timers.get(key) is timer:
+                        self._place(key, timer)
+
+        slot = self._wheels[0][self._current_tick % self.slots]
+        due = [(key, timer) for key, timer in slot if self._timers.get(key) is timer]
+        slot.clear()
+        for key, _ in due:
+            del self._timers[key]
+        return due
+
+    async def _fire(self, key, callback):
+        try:
+            await callback()
+        except Exception as e:
+            logging.error(f"Error in {self.name} timer {key}: {e}")
+
+    async def _run(self):
+        while True:
+            if not self._timers:
+                # タイマーがない間は登録されるまで眠る
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await asyncio.sleep(max((self._current_tick + 1) * self.tick - time.time(), 0))
+            now_tick = int(time.time() // self.tick)
+            # スリープが遅れた場合も含め、現在時刻までのティックを順に処理する
+            while self._current_tick < now_tick:
+                if not self._timers:
+                    self._current_tick = now_tick
+                    break
+                for key, (_, callback) in self._advance():
+                    asyncio.create_task(self._fire(key, callback))
@@ -1,92 +1,80 @@
 import discord
 from discord.ui import Button, View, Select
-from sqlalchemy import create_engine, Column, Integer, String, desc
-from sqlalchemy.ext.automap import automap_base
-from sqlalchemy.orm import Session
-import matplotlib.pyplot as plt
+from sqlalchemy import desc, func, case
 import io
-import asyncio
-
-# データベースの設定
-db_path = 'db/shadowverse_bridge.db'
-engine = create_engine(f'sqlite:///{db_path}', echo=True)
-# 自動マッピング用のベースクラスの準備
-Base = automap_base()
-
-# データベース内のテーブルをすべて反映
-Base.prepare(engine, reflect=True)
-
-# マッピングされたクラスの取得
-User = Base.classes.user  # テーブル名が 'user' だと仮定
-Class = Base.classes.deck_class
-MatchHistory = Base.classes.match_history  # テーブル名が 'match_history' だと仮定
-Season = Base.classes.season  # テーブル名が 'season' だと仮定
-UserSeasonRecord = Base.classes.user_season_record
-session = Session(engine)
+from data_access import (
+    User, Season, UserSeasonRecord, PlayerMatch,
+    run_db, get_user_by_discord_id, get_latest_season, get_class_names
+)
+from archive import run_on_match_tables
+from class_stats import get_class_stats
+from message_deleter import message_deleter
+from leaderboard import leaderboard
 
 class CurrentSeasonRecord:
-    def __init__(self, session):
-        self.session = session
-
-    def get_current_season(self):
-        season = self.session.query(Season).order_by(Season.id.desc()).first()
-        return season
+    def load_class_select(self, session, discord_id):
+        user = get_user_by_discord_id(session, discord_id)
+        season = get_latest_season(session)
+        return user, season, get_class_names(session)
 
     async def show_class_select(self, interaction):
-        user = self.session.query(User).filter_by(discord_id=str(interaction.user.id)).first()
+        user, season, class_names = await run_db(self.load_class_select, interaction.user.id)
         # latest_season_matched が False なら "未参加です" と返して終了
         if user and not user.latest_season_matched:
             await interaction.response.send_message("未参加です", ephemeral=True)
             return
-        season = self.get_current_season()
         if season:
             await interaction.response.send_message(
                 content="クラスを選択してください:", 
-                view=ClassSelectView(season_id=season.id), 
+                view=ClassSelectView(class_names, season_id=season.id), 
                 ephemeral=True
             )
         else:
             await interaction.response.send_message("シーズンが見つかりません。", ephemeral=True)
 
 class CurrentSeasonRecordView(discord.ui.View):
-    def __init__(self, session):
+    def __init__(self):
         super().__init__(timeout=None)
-        self.session = session
         button = discord.ui.Button(label="現在のシーズン", style=discord.ButtonStyle.primary)
 
         async def button_callback(interaction):
-            record = CurrentSeasonRecord(self.session)
+            record = CurrentSeasonRecord()
             await record.show_class_select(interaction)
 
         button.callback = button_callback
         self.add_item(button)
 
 class PastSeasonRecordView(discord.ui.View):
-    def __init__(self, session):
+    def __init__(self):
         super().__init__(timeout=None)
-        self.session = session
         button = discord.ui.Button(label="過去のシーズン", style=discord.ButtonStyle.secondary)
 
         async def button_callback(interaction):
-            record = PastSeasonRecord(self.session)
+            record = PastSeasonRecord()
             await record.show_season_select(interaction)
 
         button.callback = button_callback
         self.add_item(button)
 
 class PastSeasonRecord:
-    def __init__(self, session):
-        self.session = session
-
-    def get_past_seasons(self):
+    def get_past_seasons(self, session):
         # 最新シーズンを取得
-        latest_season = self.session.query(Season).order_by(Season.id.desc()).first()
+        latest_season = get_latest_season(session)
         # 最新シーズンを除いたシーズン一覧を取得
-        seasons = self.session.query(Season).filter(Season.id != latest_season.id).order_by(Season.id.desc()).all()
+        seasons = session.query(Season).filter(Season.id != latest_season.id).order_by(Season.id.desc()).all()
         return seasons
 
+    def load_season_participation(self, session, discord_id, season_id):
+        """ユーザーと、そのユーザーの指定シーズンの記録を取得"""
+        user = get_user_by_discord_id(session, discord_id)
+        if not user:
+            return None, None
+        user_record = session.query(UserSeasonRecord).filter_by(user_id=user.id, season_id=season_id).first()
+        return user, user_record
+
     async def show_season_select(self, interaction):
-        seasons = self.get_past_seasons()
+        seasons = await run_db(self.get_past_seasons)
+        class_names = await run_db(get_class_names)
         options = [
             discord.SelectOption(label="全シーズン", value="all")
         ]
@@ -109,28 +97,26 @@ class PastSeasonRecord:
                 # 全シーズンを選択した場合、season_id を None にして ClassSelectView を呼び出す
                 await select_interaction.followup.send(
                     content="クラスを選択してください:", 
-                    view=ClassSelectView(season_id=None),
+                    view=ClassSelectView(class_names, season_id=None),
                     ephemeral=True
                 )
             else: 
                 selected_season_id = int(selected_season_id)
-                user = self.session.query(User).filter_by(discord_id=str(select_interaction.user.id)).first()
+                user, user_record = await run_db(self.load_season_participation, select_interaction.user.id, selected_season_id)
                 if not user:
                     await select_interaction.followup.send("ユーザーが見つかりません。", ephemeral=True)
                     return
 
             # ユーザーが選択したシーズンに参加しているか確認
-                user_record = self.session.query(UserSeasonRecord).filter_by(user_id=user.id, season_id=selected_season_id).first()
                 if not user_record:
                     # 参加していなかった場合 "未参加です。" と返す
                     message = await select_interaction.followup.send("未参加です。", ephemeral=True)
-                    await asyncio.sleep(10)
-                    await message.delete()
+                    message_deleter.delete_followup_later(select_interaction, message, 10)
                     return
             # ユーザーがシーズンに参加している場合、クラスを選択させる
                 await select_interaction.followup.send(
                     content="クラスを選択してください:", 
-                    view=ClassSelectView(season_id=selected_season_id),
+                    view=ClassSelectView(class_names, season_id=selected_season_id),
                     ephemeral=True
                 )
 
@@ -138,13 +124,8 @@ class PastSeasonRecord:
         view = discord.ui.View()
         view.add_item(select)
         await interaction.response.send_message("シーズンを選択してください:", view=view, ephemeral=True)
-        await asyncio.sleep(15)
-        # インタラクションメッセージを削除する
-        try:
-            await interaction.delete_original_response()
-        except discord.errors.NotFound:
-            # メッセージが見つからなかった場合はエラーを無視
-            pass
+        # 15秒後にインタラクションメッセージを削除する
+        message_deleter.delete_original_response_later(interaction, 15)
 
 class Last50Record:
     def __init__(self, win_record):
@@ -176,11 +157,9 @@ class Last50RecordView(discord.ui.View):
 
 class ClassSelect(discord.ui.Select):
     """クラス選択を行う処理。"""
-    def __init__(self, season_id=None):
-        self.session = session
-        # データベースからクラス名を取得
-        class_names = self.session.query(Class.class_name).all()
-        valid_classes = [name[0] for name in class_names]  # クラス名をリストに変換
+    def __init__(self, class_names, season_id=None):
+        # データベースから取得したクラス名
+        valid_classes = class_names
 
         options = [
             discord.SelectOption(label="全クラス", value="all_classes")
@@ -192,7 +171,7 @@ class ClassSelect(discord.ui.Select):
     async def callback(self, interaction: discord.Interaction):
         selected_classes = self.values
         user_id = interaction.user.id  # 操作したユーザーのDiscord IDを取得
-        win_record = WinRecord(session)
+        win_record = WinRecord()
 
         # 全クラスと他のクラスが選ばれている場合のチェック
         if "all_classes" in selected_classes and len(selected_classes) > 1:
@@ -224,111 +203,37 @@ class ClassSelect(discord.ui.Select):
         
 
 class ClassSelectView(discord.ui.View):
-    def __init__(self, season_id=None):
+    def __init__(self, class_names, season_id=None):
         super().__init__(timeout=None)
-        self.add_item(ClassSelect(season_id))
+        self.add_item(ClassSelect(class_names, season_id))
 
 class WinRecord:
-    def __init__(self, session: Session):
-        self.session = session
-
-    def totalize_season(self, season_id):
-        """シーズン終了時に全ユーザーのシーズン統計を user_season_record に保存"""
-        users = self.session.query(User).filter(User.latest_season_matched == True).all()
-        season = self.session.query(Season).filter_by(id=season_id).first()
-        if not season:
-            raise ValueError(f"Season with ID {season_id} not found.")
-        season_name = season.season_name
-
-        # ユーザーごとの最終レートを計算し、順位付けのためにリストに格納
-        user_final_ratings = []
-        for user in users:
-            # 効果的レートを計算
-            final_rating = max(user.rating, user.stayed_rating or 0)
-            user_final_ratings.append((user.id, final_rating))
-
-        # 効果的レートでユーザーをソートして順位を計算
-        user_final_ratings.sort(key=lambda x: x[1], reverse=True)
-
-        user_rankings = {}
-        current_rank = 1
-        previous_rating = None
-        for idx, (user_id, final_rating) in enumerate(user_final_ratings):
-            if final_rating != previous_rating:
-                current_rank = idx + 1
-            user_rankings[user_id] = current_rank
-            previous_rating = final_rating
-
-        # 各ユーザーの統計情報を保存
-        for user in users:
-            # 効果的レートを取得
-            final_rating = max(user.rating, user.stayed_rating or 0)
-
-            # ユーザーの stay_flag と stayed_rating を確認
-            existing_record = self.session.query(UserSeasonRecord).filter_by(
-                user_id=user.id,
-                season_id=season_id
-            ).first()
-
-            if user.stay_flag == 1:
-                if user.rating > user.stayed_rating:
-                    # rating の方が高い場合、既存のレコードを上書き
-                    if existing_record:
-                        existing_record.rating = user.rating
-                        existing_record.win_count = user.win_count
-                        existing_record.loss_count = user.loss_count
-                        existing_record.total_matches = user.total_matches
-                        existing_record.max_win_streak = user.max_win_streak
-                        existing_record.rank = user_rankings[user.id]
-                    else:
-                        # レコードが存在しない場合、新規作成
-                        new_record = UserSeasonRecord(
-                            user_id=user.id,
-                            season_id=season_id,
-                            rating=user.rating,
-                            rank=user_rankings[user.id],
-                            win_count=user.win_count,
-                            loss_count=user.loss_count,
-                            total_matches=user.total_matches,
-                            max_win_streak=user.max_win_streak,
-                        )
-                        self.session.add(new_record)
-                else:
-                    # rating <= stayed_rating の場合、既存のレコードの rank を更新
-                    if existing_record:
-                        existing_record.rank = user_rankings[user.id]
-            else:
-                # stay_flag が 0 のユーザー
-                if existing_record:
-                    # 既存のレコードがある場合、データを上書き
-                    existing_record.rating = final_rating
-                    existing_record.win_count = user.win_count
-                    existing_record.loss_count = user.loss_count
-                    existing_record.total_matches = user.total_matches
-                    existing_record.max_win_streak = user.max_win_streak
-                    existing_record.rank = user_rankings[user.id]
-                else:
-                    # レコードが存在しない場合、新規作成
-                    new_record = UserSeasonRecord(
-                        user_id=user.id,
-                        season_id=season_id,
-                        rating=final_rating,
-                        rank=user_rankings[user.id],
-                        win_count=user.win_count,
-                        loss_count=user.loss_count,
-                        total_matches=user.total_matches,
-                        max_win_streak=user.max_win_streak,
-                    )
-                    self.session.add(new_record)
-
-        self.session.commit()
+    def count_player_matches(self, session, *criteria, season=None):
+        """player_match から条件に一致する試合数と勝利数を集計する（アーカイブ済みのシーズンも含む）"""
+        if season is not None:
+            criteria = criteria + (PlayerMatch.season_id == season.id,)
+
+        def count(target_session):
+            return target_session.query(
+                func.count(PlayerMatch.id),
+                func.coalesce(func.sum(case((PlayerMatch.won == True, 1), else_=0)), 0)
+            ).filter(*criteria).one()
+
+        counts = run_on_match_tables(session, count, season)
+        total_count = sum(total for total, _ in counts)
+        win_count = sum(wins for _, wins in counts)
+        return total_count, win_count
 
     async def show_all_time_stats(self, interaction: discord.Interaction, user_id):
         """全シーズン累計の統計を表示"""
-        user = self.session.query(User).filter_by(discord_id=str(user_id)).first()
+        def load(session):
+            user = get_user_by_discord_id(session, user_id)
+            records = session.query(UserSeasonRecord).filter_by(user_id=user.id).all() if user else []
+            return user, records
+
+        user, records = await run_db(load)
         if user:
             # user_season_recordから全シーズンの勝敗数を集計
-            records = self.session.query(UserSeasonRecord).filter_by(user_id=user.id).all()
             total_win_count = sum(record.win_count for record in records)
             total_loss_count = sum(record.loss_count for record in records)
             total_count = total_win_count + total_loss_count
@@ -340,25 +245,27 @@ class WinRecord:
             )
         else:
             message = await interaction.followup.send("ユーザーが見つかりません。", ephemeral=True)
-        await asyncio.sleep(10)
-        try:
-            await message.delete()
-        except discord.errors.NotFound:
-            pass
+        message_deleter.delete_followup_later(interaction, message, 10)
 
     async def show_season_stats(self, interaction: discord.Interaction, user_id, season_id):
         """指定されたシーズンの統計を表示"""
-        user = self.session.query(User).filter_by(discord_id=str(user_id)).first()
-
-        # `season_id` から `season_name` を取得
-        season = self.session.query(Season).filter_by(id=season_id).first()
+        def load(session):
+            user = get_user_by_discord_id(session, user_id)
+            # `season_id` から `season_name` を取得
+            season = session.query(Season).filter_by(id=season_id).first()
+            # 最新シーズンかどうかを判定するために、seasonテーブルからidが一番大きく、end_dateがnullのものを取得する
+            latest_season = session.query(Season).filter(Season.end_date == None).order_by(Season.id.desc()).first()
+            past_record = None
+            if user and season and not (latest_season and season.season_name == latest_season.season_name):
+                past_record = session.query(UserSeasonRecord).filter_by(user_id=user.id, season_id=season_id).first()
+            return user, season, latest_season, past_record
+
+        user, season, latest_season, past_record = await run_db(load)
         if not season:
             await interaction.followup.send("指定されたシーズンが見つかりません。", ephemeral=True)
             return
 
         season_name = season.season_name
-        # 最新シーズンかどうかを判定するために、seasonテーブルからidが一番大きく、end_dateがnullのものを取得する
-        latest_season = self.session.query(Season).filter(Season.end_date == None).order_by(Season.id.desc()).first()
 
         # 最新シーズンかどうかの判定
         is_latest_season = (season_name == latest_season.season_name if latest_season else False)
@@ -371,13 +278,12 @@ class WinRecord:
                 total_count = win_count + loss_count
                 win_rate = (win_count / total_count) * 100 if total_count > 0 else 0
 
-                # 最新シーズンのレートと順位を計算
+                # 最新シーズンのレートと順位を計算（マッチングしていない場合は順位なし）
                 final_rating = user.rating
-                rank = self.session.query(User).filter(User.rating > final_rating).count() + 1
+                rank = await leaderboard.rating_rank(user.id) or "-"
 
             else:
                 # 過去シーズンの場合、PastSeasonRecordからデータを取得
-                past_record = self.session.query(UserSeasonRecord).filter_by(user_id=user.id, season_id=season_id).first()
                 if not past_record:
                     await interaction.followup.send("過去シーズンのレコードが見つかりません。", ephemeral=True)
                     return
@@ -399,22 +305,23 @@ class WinRecord:
         else:
             message = await interaction.followup.send("ユーザーが見つかりません。", ephemeral=True)
 
-        await asyncio.sleep(10)
-        try:
-            await message.delete()
-        except discord.errors.NotFound:
-            pass
+        message_deleter.delete_followup_later(interaction, message, 10)
 
     async def show_date_range_stats(self, interaction: discord.Interaction, user_id, start_date, end_date):
         """指定された日付範囲の統計を表示"""
-        user = self.session.query(User).filter_by(discord_id=str(user_id)).first()
+        def load(session):
+            user = get_user_by_discord_id(session, user_id)
+            if not user:
+                return None, 0, 0
+            total_count, win_count = self.count_player_matches(
+                session,
+                PlayerMatch.user_id == user.id,
+                PlayerMatch.match_date.between(start_date, end_date)
+            )
+            return user, total_count, win_count
+
+        user, total_count, win_count = await run_db(load)
         if user:
-            matches = self.session.query(MatchHistory).filter(
-                ((MatchHistory.winner_user_id == user.id) | (MatchHistory.loser_user_id == user.id)) &
-                (MatchHistory.match_date.between(start_date, end_date))
-            ).all()
-            win_count = sum(1 for match in matches if match.winner_user_id == user.id)
-            total_count = len(matches)
             loss_count = total_count - win_count
             win_rate = (win_count / total_count) * 100 if total_count > 0 else 0
             await interaction.followup.send(
@@ -426,15 +333,20 @@ class WinRecord:
 
     async def show_vs_stats(self, interaction: discord.Interaction, user_id, opponent_id):
         """指定された相手との対戦履歴を表示"""
-        user = self.session.query(User).filter_by(discord_id=str(user_id)).first()
-        opponent = self.session.query(User).filter_by(discord_id=str(opponent_id)).first()
+        def load(session):
+            user = get_user_by_discord_id(session, user_id)
+            opponent = get_user_by_discord_id(session, opponent_id)
+            if not (user and opponent):
+                return user, opponent, 0, 0
+            total_count, win_count = self.count_player_matches(
+                session,
+                PlayerMatch.user_id == user.id,
+                PlayerMatch.opponent_id == opponent.id
+            )
+            return user, opponent, total_count, win_count
+
+        user, opponent, total_count, win_count = await run_db(load)
         if user and opponent:
-            matches = self.session.query(MatchHistory).filter(
-                ((MatchHistory.winner_user_id == user.id) & (MatchHistory.loser_user_id == opponent.id)) |
-                ((MatchHistory.winner_user_id == opponent.id) & (MatchHistory.loser_user_id == user.id))
-            ).all()
-            win_count = sum(1 for match in matches if match.winner_user_id == user.id)
-            total_count = len(matches)
             loss_count = total_count - win_count
             win_rate = (win_count / total_count) * 100 if total_count > 0 else 0
             message = await interaction.followup.send(
@@ -443,22 +355,40 @@ class WinRecord:
             )
         else:
             message = await interaction.followup.send("ユーザーまたは対戦相手が見つかりません。", ephemeral=True)
-        await asyncio.sleep(10)
-        try:
-            await message.delete()
-        except discord.errors.NotFound:
-            # メッセージが見つからなかった場合はエラーを無視
-            pass
+        message_deleter.delete_followup_later(interaction, message, 10)
+
+    def load_recent50(self, session, user_id):
+        """直近50戦の表示に必要なデータを1つのセッションでまとめて取得"""
+        # インタラクションユーザーのIDからuserテーブルのIDを取得
+        user = get_user_by_discord_id(session, user_id)
+        # 最新のシーズンを取得
+        latest_season = get_latest_season(session)
+        if not user or not latest_season or not user.latest_season_matched:
+            return user, latest_season, [], {}
+
+        # 該当するplayer_matchを取得（最新シーズンのみ、新しい順に最大50戦）
+        def fetch(target_session):
+            return target_session.query(PlayerMatch).filter(
+                PlayerMatch.user_id == user.id,
+                PlayerMatch.season_id == latest_season.id
+            ).order_by(PlayerMatch.match_date.desc(), PlayerMatch.id.desc()).limit(50).all()
+
+        matches = run_on_match_tables(session, fetch, latest_season)[0]
+
+        # 対戦相手の名前をまとめて取得
+        opponent_ids = {match.opponent_id for match in matches}
+        opponent_names = dict(
+            session.query(User.id, User.user_name).filter(User.id.in_(opponent_ids)).all()
+        ) if opponent_ids else {}
+        return user, latest_season, matches, opponent_names
+
     async def show_recent50_stats(self, interaction: discord.Interaction, user_id):
         """最新のシーズンの直近50戦のレート推移のグラフと統計を表示"""
-        # インタラクションユーザーのIDからuserテーブルのIDを取得
-        user = self.session.query(User).filter_by(discord_id=str(user_id)).first()
+        user, latest_season, matches_for_embed, opponent_names = await run_db(self.load_recent50, user_id)
         if not user:
             await interaction.response.send_message("ユーザーが見つかりません。", ephemeral=True)
             return
 
-        # 最新のシーズンを取得
-        latest_season = self.session.query(Season).order_by(Season.id.desc()).first()
         if not latest_season:
             await interaction.response.send_message("最新のシーズンが見つかりません。", ephemeral=True)
             return
@@ -467,6 +397,8 @@ class WinRecord:
             await interaction.response.send_message("未参加です", ephemeral=True)
             return
 
+        rank = await leaderboard.rating_rank(user.id) or "-"
+
         # クラス名と略字の対応
         class_abbreviations = {
             "エルフ": "E",
@@ -479,72 +411,39 @@ class WinRecord:
             "ネメシス": "Nm"
         }
 
-        # 該当するmatch_historyを取得（最新シーズンのみ）
-        matches_query = self.session.query(MatchHistory).filter(
-            ((MatchHistory.user1_id == user.id) | (MatchHistory.user2_id == user.id)) &
-            (MatchHistory.season_name == latest_season.season_name)
-        ).order_by(MatchHistory.match_date.desc())
+        matches_for_graph = list(reversed(matches_for_embed))  # グラフ用（古い順）
+        total_matches = len(matches_for_embed)
 
-        total_matches = matches_query.count()
-
-        # 初期レートと試合リストの設定
         if total_matches >= 50:
-            # 最新50戦を取得
-            latest_50_matches = matches_query.limit(50).all()
-            # 試合を古い順に並べ替えてレート推移を計算
-            matches_for_graph = list(reversed(latest_50_matches))  # グラフ用（古い順）
-            matches_for_embed = latest_50_matches  # Embed用（新しい順）
             title_suffix = " (最新50戦)"
         else:
-            # 総試合数が50未満の場合、初期レートを1500とする
-            initial_rating = 1500
-            # 試合を古い順に取得
-            matches_for_graph = self.session.query(MatchHistory).filter(
-                ((MatchHistory.user1_id == user.id) | (MatchHistory.user2_id == user.id)) &
-                (MatchHistory.season_name == latest_season.season_name)
-            ).order_by(MatchHistory.match_date.asc()).all()
-            matches_for_embed = list(reversed(matches_for_graph))  # Embed用（新しい順）
             title_suffix = f" (最新{total_matches}戦)" if total_matches > 0 else ""
 
-        # レート推移の初期化
-        initial_rating = 1500 if total_matches < 50 else user.rating - sum(
-            match.user1_rating_change if match.user1_id == user.id else match.user2_rating_change
-            for match in matches_for_graph
-        )
+        # レート推移の初期化（最初の試合の対戦前レートから開始）
+        if matches_for_graph:
+            initial_rating = matches_for_graph[0].rating_after - matches_for_graph[0].rating_change
+        else:
+            initial_rating = 1500
         ratings = [initial_rating]
         win_count = 0
         loss_count = 0
         class_stats = {}
 
-        # 対戦履歴のリスト
-        match_entries = []
-
         # グラフ用のデータ計算
         for match in matches_for_graph:
             # 勝敗の判定
-            if match.winner_user_id == user.id:
+            if match.won:
                 result = "WIN"
                 win_count += 1
             else:
                 result = "LOSE"
                 loss_count += 1
 
-            # レーティング変動の取得
-            if match.user1_id == user.id:
-                rating_change = match.user1_rating_change
-            else:
-                rating_change = match.user2_rating_change
-
-            # レーティングの更新
-            current_rating = ratings[-1] + rating_change
-            ratings.append(current_rating)
+            # 対戦後のレーティング
+            ratings.append(match.rating_after)
 
             # クラスごとの勝敗を集計
-            if match.user1_id == user.id:
-                user_classes = (match.user1_class_a, match.user1_class_b)
-            else:
-                user_classes = (match.user2_class_a, match.user2_class_b)
-
+            user_classes = (match.class_a, match.class_b)
             key = ','.join([class_abbreviations.get(c, c) for c in user_classes if c])
             if key not in class_stats:
                 class_stats[key] = {'win': 0, 'loss': 0}
@@ -556,8 +455,8 @@ class WinRecord:
         total_count = win_count + loss_count
         win_rate = (win_count / total_count) * 100 if total_count > 0 else 0
 
-        # 順位を計算 (例: レートが高い順にランキング)
-        rank = self.session.query(User).filter(User.rating > user.rating).count() + 1
+        # matplotlib は読み込みに時間がかかるため、グラフを初めて作成する時に読み込む（起動時間の短縮）
+        import matplotlib.pyplot as plt
 
         # Matplotlibのフォント設定（日本語対応）
         plt.rcParams['font.family'] = 'Yu Gothic'  # 適切な日本語フォントを指定してください
@@ -607,7 +506,7 @@ class WinRecord:
 
         for idx, match in enumerate(matches_for_embed, start=1):
             # 勝敗の判定
-            if match.winner_user_id == user.id:
+            if match.won:
                 result = "**```WIN```**"
                 # フィールド名のスペース調整
                 spacing = "　"  # 全角スペース
@@ -615,21 +514,10 @@ class WinRecord:
                 result = "**```LOSE```**"
                 spacing = "  "  # 半角スペース2つ
 
-            # レーティング変動の取得
-            if match.user1_id == user.id:
-                opponent_id = match.user2_id
-                rating_change = match.user1_rating_change
-                user_classes = (match.user1_class_a, match.user1_class_b)
-                opponent_classes = (match.user2_class_a, match.user2_class_b)
-            else:
-                opponent_id = match.user1_id
-                rating_change = match.user2_rating_change
-                user_classes = (match.user2_class_a, match.user2_class_b)
-                opponent_classes = (match.user1_class_a, match.user1_class_b)
-
-            # 対戦相手の名前を取得
-            opponent = self.session.query(User).filter_by(id=opponent_id).first()
-            opponent_name = opponent.user_name if opponent else "Unknown"
+            rating_change = match.rating_change
+            user_classes = (match.class_a, match.class_b)
+            opponent_classes = (match.opponent_class_a, match.opponent_class_b)
+            opponent_name = opponent_names.get(match.opponent_id, "Unknown")
 
             # クラス名を略字に変換
             user_class_abbr = ','.join([class_abbreviations.get(c, c) for c in user_classes if c])
@@ -666,27 +554,9 @@ class WinRecord:
         history_message = await interaction.followup.send(embed=embeds[0], view=view, ephemeral=True)
 
         # 10分後（600秒）にメッセージを削除
-        await asyncio.sleep(600)
-        try:
-            await history_message.delete()
-            await graph_message.delete()
-            await interaction.delete_original_response()
-        except discord.errors.NotFound:
-            pass
-
-            # クラスごとの勝敗を集計
-            if match.user1_id == user.id:
-                user_classes = (match.user1_class_a, match.user1_class_b)
-            else:
-                user_classes = (match.user2_class_a, match.user2_class_b)
-
-            key = ','.join([class_abbreviations.get(c, c) for c in user_classes if c])
-            if key not in class_stats:
-                class_stats[key] = {'win': 0, 'loss': 0}
-            if result == "WIN":
-                class_stats[key]['win'] += 1
-            else:
-                class_stats[key]['loss'] += 1
+        message_deleter.delete_followup_later(interaction, history_message, 600)
+        message_deleter.delete_followup_later(interaction, graph_message, 600)
+        message_deleter.delete_original_response_later(interaction, 600)
 
     class MatchHistoryPaginator(discord.ui.View):
         def __init__(self, embeds):
@@ -712,61 +582,36 @@ class WinRecord:
 
     async def show_class_stats(self, interaction: discord.Interaction, user_id, selected_classes, season_id=None):
         """指定されたクラスでの戦績を表示"""
-        user = self.session.query(User).filter_by(discord_id=str(user_id)).first()
-        if not user:
-            message = await interaction.followup.send("ユーザーが見つかりません。", ephemeral=True)
-            await asyncio.sleep(300)
-            try:
-                await message.delete()
-            except discord.errors.NotFound:
-                # メッセージが見つからなかった場合はエラーを無視
-                pass
-            return
+        def load(session):
+            user = get_user_by_discord_id(session, user_id)
+            if not user:
+                return None, 0, 0
+            # 集計テーブルから取得するため、対戦履歴を走査しない
+            total_count, win_count = get_class_stats(session, user.id, selected_classes, season_id)
+            return user, total_count, win_count
 
-        # クエリを作成
         if isinstance(selected_classes, list) and len(selected_classes) == 2:
             class1, class2 = selected_classes
-            query = self.session.query(MatchHistory).filter(
-                ((MatchHistory.user1_id == user.id) & 
-                (((MatchHistory.user1_class_a == class1) & (MatchHistory.user1_class_b == class2)) |
-                ((MatchHistory.user1_class_a == class2) & (MatchHistory.user1_class_b == class1)))) |
-                ((MatchHistory.user2_id == user.id) & 
-                (((MatchHistory.user2_class_a == class1) & (MatchHistory.user2_class_b == class2)) |
-                ((MatchHistory.user2_class_a == class2) & (MatchHistory.user2_class_b == class1))))
-            )
             selected_class_str = f"{class1} と {class2}"
         else:
-            selected_class = selected_classes[0] if isinstance(selected_classes, list) else selected_classes
-            query = self.session.query(MatchHistory).filter(
-                ((MatchHistory.user1_id == user.id) & 
-                ((MatchHistory.user1_class_a == selected_class) | (MatchHistory.user1_class_b == selected_class))) |
-                ((MatchHistory.user2_id == user.id) & 
-                ((MatchHistory.user2_class_a == selected_class) | (MatchHistory.user2_class_b == selected_class)))
-            )
-            selected_class_str = selected_class
+            selected_class_str = selected_classes[0] if isinstance(selected_classes, list) else selected_classes
 
-        if season_id is not None:
-            season_name = self.session.query(Season).filter_by(id=season_id).first().season_name
-            query = query.filter(MatchHistory.season_name == season_name)
+        user, total_count, win_count = await run_db(load)
+        if not user:
+            message = await interaction.followup.send("ユーザーが見つかりません。", ephemeral=True)
+            message_deleter.delete_followup_later(interaction, message, 300)
+            return
 
-        matches = query.all()
-        win_count = sum(1 for match in matches if match.winner_user_id == user.id)
-        total_count = len(matches)
         loss_count = total_count - win_count
         win_rate = (win_count / total_count) * 100 if total_count > 0 else 0
 
-        # メッセージを送信し、30秒後に削除
+        # メッセージを送信し、5分後に削除
         message = await interaction.followup.send(
             f"{user.user_name} の {selected_class_str} クラスでの戦績:\n"
             f"勝率: {win_rate:.2f}%\n"
             f"{total_count}戦   {win_count}勝-{loss_count}敗", 
             ephemeral=True
         )
-        await asyncio.sleep(300)
-        try:
-            await message.delete()
-        except discord.errors.NotFound:
-            # メッセージが見つからなかった場合はエラーを無視
-            pass
+        message_deleter.delete_followup_later(interaction, message, 300)
 
 